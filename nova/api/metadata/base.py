@@ -283,6 +283,18 @@ class InstanceMetadata():
             raise KeyError(path)
 
         # right now, the only valid path is metadata.json
+        metadata = self.get_openstack_metadata(version)
+
+        if self._check_os_version(GRIZZLY, version):
+            metadata['random_seed'] = base64.b64encode(os.urandom(512))
+
+        data = {
+            MD_JSON_NAME: json.dumps(metadata),
+        }
+
+        return data[path]
+
+    def get_openstack_metadata(self, version):
         metadata = {}
         metadata['uuid'] = self.uuid
 
@@ -312,14 +324,7 @@ class InstanceMetadata():
         metadata['launch_index'] = self.instance['launch_index']
         metadata['availability_zone'] = self.availability_zone
 
-        if self._check_os_version(GRIZZLY, version):
-            metadata['random_seed'] = base64.b64encode(os.urandom(512))
-
-        data = {
-            MD_JSON_NAME: json.dumps(metadata),
-        }
-
-        return data[path]
+        return metadata
 
     def _check_version(self, required, requested, versions=VERSIONS):
         return versions.index(requested) >= versions.index(required)
@@ -404,6 +409,47 @@ class InstanceMetadata():
             yield ('%s/%s/%s' % ("openstack", CONTENT_DIR, cid), content)
 
 
+class MetadataDocument(InstanceMetadata):
+    """Instance metadata rendered once and kept as plain data.
+
+    Built from an InstanceMetadata, it answers the same lookups without
+    any database or network calls, and pickles compactly so that it can
+    be kept in the metadata cache until the instance changes.
+    """
+
+    # Bumped whenever the rendered data changes shape, so that documents
+    # cached by older code are not served.
+    VERSION = 1
+
+    def __init__(self, meta_data):
+        self.uuid = meta_data.uuid
+        self.address = meta_data.address
+        self.password = meta_data.password
+        self.userdata_raw = meta_data.userdata_raw
+        self.content = meta_data.content
+        self.ec2_metadata = dict((version,
+                                  meta_data.get_ec2_metadata(version))
+                                 for version in VERSIONS)
+        self.openstack_metadata = dict((version,
+                                        meta_data.get_openstack_metadata(
+                                            version))
+                                       for version in OPENSTACK_VERSIONS)
+
+    def get_ec2_metadata(self, version):
+        if version == "latest":
+            version = VERSIONS[-1]
+
+        if version not in VERSIONS:
+            raise InvalidMetadataVersion(version)
+
+        return self.ec2_metadata[version]
+
+    def get_openstack_metadata(self, version):
+        # get_openstack_item() adds the random seed to this, so hand out
+        # a copy of the rendered data.
+        return dict(self.openstack_metadata[version])
+
+
 def get_metadata_by_address(address):
     ctxt = context.get_admin_context()
     fixed_ip = network.API().get_fixed_ip_by_address(ctxt, address)
@@ -0,0 +1,108 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Cache of rendered instance metadata.
+
+Metadata documents are kept by instance uuid, and fixed IP addresses are
+indexed to the uuid of their instance, so that answering a metadata
+request is a couple of cache lookups and a walk of the document.
+
+This module is also a notification driver.  Adding it to
+notification_driver on the API, compute and network services, with
+memcached_servers shared with nova-api-metadata, drops the documents of
+instances as notifications about changes to them are sent, so that
+metadata_cache_expiration can be raised well beyond its default.
+"""
+
+from nova.api.metadata import base
+from nova.common import memorycache
+from nova.openstack.common import cfg
+
+metadata_cache_opts = [
+    cfg.IntOpt('metadata_cache_expiration',
+               default=15,
+               help='Time in seconds to cache rendered instance metadata '
+                    'for'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(metadata_cache_opts)
+
+# Notifications about changes to the metadata of the instance named by
+# the instance_id of their payloads.
+INVALIDATING_EVENTS = (
+    'compute.instance.',
+    'network.floating_ip.',
+    'security_group.',
+)
+
+
+def _document_key(instance_id):
+    return 'metadata-v%d-%s' % (base.MetadataDocument.VERSION, instance_id)
+
+
+def _address_key(address):
+    return 'metadata-address-%s' % address
+
+
+class MetadataCache(object):
+    """Rendered metadata documents indexed by instance and address."""
+
+    def __init__(self, client=None):
+        self._cache = client or memorycache.get_client()
+
+    def get_by_address(self, address):
+        instance_id = self._cache.get(_address_key(address))
+        if instance_id is None:
+            return None
+        return self.get_by_instance_id(instance_id, address)
+
+    def get_by_instance_id(self, instance_id, address):
+        document = self._cache.get(_document_key(instance_id))
+        # The document was rendered for another address if the fixed IP
+        # moved to a new instance, or the request came another way.
+        if document is None or document.address != address:
+            return None
+        return document
+
+    def set(self, document, index_address=False):
+        expiration = CONF.metadata_cache_expiration
+        self._cache.set(_document_key(document.uuid), document, expiration)
+        if index_address:
+            self._cache.set(_address_key(document.address), document.uuid,
+                            expiration)
+
+    def invalidate(self, instance_id):
+        self._cache.delete(_document_key(instance_id))
+
+
+_CACHE = None
+
+
+def notify(_context, message):
+    """Drop the metadata of the instance a notification is about."""
+    global _CACHE
+
+    if not message['event_type'].startswith(INVALIDATING_EVENTS):
+        return
+    payload = message.get('payload')
+    if not isinstance(payload, dict) or not payload.get('instance_id'):
+        return
+
+    if _CACHE is None:
+        _CACHE = MetadataCache()
+    _CACHE.invalidate(payload['instance_id'])
@@ -25,14 +25,12 @@ import webob.dec
 import webob.exc
 
 from nova.api.metadata import base
-from nova.common import memorycache
+from nova.api.metadata import cache
 from nova import exception
 from nova.openstack.common import cfg
 from nova.openstack.common import log as logging
 from nova import wsgi
 
-CACHE_EXPIRATION = 15  # in seconds
-
 CONF = cfg.CONF
 CONF.import_opt('use_forwarded_for', 'nova.api.auth')
 
@@ -57,14 +55,13 @@ class MetadataRequestHandler(wsgi.Application):
     """Serve metadata."""
 
     def __init__(self):
-        self._cache = memorycache.get_client()
+        self._cache = cache.MetadataCache()
 
     def get_metadata_by_remote_address(self, address):
         if not address:
             raise exception.FixedIpNotFoundForAddress(address=address)
 
-        cache_key = 'metadata-%s' % address
-        data = self._cache.get(cache_key)
+        data = self._cache.get_by_address(address)
         if data:
             return data
 
@@ -73,13 +70,13 @@ class MetadataRequestHandler(wsgi.Application):
         except exception.NotFound:
             return None
 
-        self._cache.set(cache_key, data, CACHE_EXPIRATION)
+        data = base.MetadataDocument(data)
+        self._cache.set(data, index_address=True)
 
         return data
 
     def get_metadata_by_instance_id(self, instance_id, address):
-        cache_key = 'metadata-%s' % instance_id
-        data = self._cache.get(cache_key)
+        data = self._cache.get_by_instance_id(instance_id, address)
         if data:
             return data
 
@@ -88,7 +85,8 @@ class MetadataRequestHandler(wsgi.Application):
         except exception.NotFound:
             return None
 
-        self._cache.set(cache_key, data, CACHE_EXPIRATION)
+        data = base.MetadataDocument(data)
+        self._cache.set(data)
 
         return data
 
@@ -46,6 +46,11 @@ osapi_opts = [
                default=None,
                help='Base URL that will be presented to users in links '
                     'to glance resources'),
+    cfg.BoolOpt('osapi_compute_pagination_cursors',
+                default=False,
+                help='Use opaque cursors carrying the sort key values, '
+                     'rather than server ids, as the marker of the next '
+                     'link when listing servers'),
 ]
 CONF = cfg.CONF
 CONF.register_opts(osapi_opts)
@@ -489,13 +494,7 @@ class ViewBuilder(object):
         links = []
         limit = int(request.params.get("limit", 0))
         if limit and limit == len(items):
-            last_item = items[-1]
-            if id_key in last_item:
-                last_item_id = last_item[id_key]
-            elif 'id' in last_item:
-                last_item_id = last_item["id"]
-            else:
-                last_item_id = last_item["flavorid"]
+            last_item_id = self._get_item_marker(items[-1], id_key)
             links.append({
                 "rel": "next",
                 "href": self._get_next_link(request,
@@ -504,6 +503,15 @@ class ViewBuilder(object):
             })
         return links
 
+    def _get_item_marker(self, item, id_key="uuid"):
+        """Return the marker of the next link following item."""
+        if id_key in item:
+            return item[id_key]
+        elif 'id' in item:
+            return item["id"]
+        else:
+            return item["flavorid"]
+
     def _update_link_prefix(self, orig_url, prefix):
         if not prefix:
             return orig_url
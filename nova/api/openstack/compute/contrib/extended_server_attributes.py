@@ -32,17 +32,19 @@ class ExtendedServerAttributesController(wsgi.Controller):
                                                                  **kwargs)
         self.compute_api = compute.API()
 
-    def _get_hypervisor_hostname(self, context, instance):
-        compute_node = db.compute_node_get_by_host(context, instance["host"])
+    def _get_hypervisor_hostname(self, req, instance):
+        # The compute nodes of the hosts of the instances are fetched
+        # together by _prefetch_compute_nodes().
+        compute_node = req.get_db_item('compute_nodes', instance["host"])
 
         try:
             return compute_node["hypervisor_hostname"]
         except TypeError:
             return
 
-    def _extend_server(self, context, server, instance):
+    def _extend_server(self, req, server, instance):
         key = "%s:hypervisor_hostname" % Extended_server_attributes.alias
-        server[key] = self._get_hypervisor_hostname(context, instance)
+        server[key] = self._get_hypervisor_hostname(req, instance)
 
         for attr in ['host', 'name']:
             if attr == 'name':
@@ -52,6 +54,20 @@ class ExtendedServerAttributesController(wsgi.Controller):
                 key = "%s:%s" % (Extended_server_attributes.alias, attr)
             server[key] = instance[attr]
 
+    @wsgi.prefetch('show', 'detail')
+    def _prefetch_compute_nodes(self, req, resp_obj, **kwargs):
+        context = req.environ['nova.context']
+        if authorize(context):
+            if 'servers' in resp_obj.obj:
+                servers = resp_obj.obj['servers']
+            else:
+                servers = [resp_obj.obj['server']]
+            hosts = [req.get_db_instance(server['id'])['host']
+                     for server in servers]
+            req.prefetch_db_items(
+                'compute_nodes', hosts,
+                lambda hosts: db.compute_node_get_by_hosts(context, hosts))
+
     @wsgi.extends
     def show(self, req, resp_obj, id):
         context = req.environ['nova.context']
@@ -62,7 +78,7 @@ class ExtendedServerAttributesController(wsgi.Controller):
             db_instance = req.get_db_instance(server['id'])
             # server['id'] is guaranteed to be in the cache due to
             # the core API adding it in its 'show' method.
-            self._extend_server(context, server, db_instance)
+            self._extend_server(req, server, db_instance)
 
     @wsgi.extends
     def detail(self, req, resp_obj):
@@ -76,7 +92,7 @@ class ExtendedServerAttributesController(wsgi.Controller):
                 db_instance = req.get_db_instance(server['id'])
                 # server['id'] is guaranteed to be in the cache due to
                 # the core API adding it in its 'detail' method.
-                self._extend_server(context, server, db_instance)
+                self._extend_server(req, server, db_instance)
 
 
 class Extended_server_attributes(extensions.ExtensionDescriptor):
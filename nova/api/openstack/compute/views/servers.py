@@ -22,10 +22,15 @@ from nova.api.openstack import common
 from nova.api.openstack.compute.views import addresses as views_addresses
 from nova.api.openstack.compute.views import flavors as views_flavors
 from nova.api.openstack.compute.views import images as views_images
+from nova.openstack.common import cfg
 from nova.openstack.common import log as logging
 from nova.openstack.common import timeutils
+from nova import utils
 
 
+CONF = cfg.CONF
+CONF.import_opt('osapi_compute_pagination_cursors',
+                'nova.api.openstack.common')
 LOG = logging.getLogger(__name__)
 
 
@@ -46,6 +51,16 @@ class ViewBuilder(common.ViewBuilder):
         "ERROR",
     )
 
+    # The instance fields read by index(), so that listing servers only
+    # loads those.  The detailed views are extended with other fields by
+    # the API extensions, so they get whole instances.  created_at is
+    # needed for the pagination cursors.
+    index_fields = (
+        "created_at",
+        "display_name",
+        "uuid",
+    )
+
     def __init__(self):
         """Initialize view builder."""
         super(ViewBuilder, self).__init__()
@@ -139,6 +154,18 @@ class ViewBuilder(common.ViewBuilder):
 
         return servers_dict
 
+    def _get_item_marker(self, item, id_key="uuid"):
+        """Return the marker of the next link following an instance.
+
+        With pagination cursors enabled this is the created_at and uuid
+        of the instance, the keys servers are listed by, so that the next
+        page is found without looking the marker instance up.
+        """
+        if CONF.osapi_compute_pagination_cursors:
+            return utils.encode_pagination_cursor(
+                    {'created_at': item['created_at'], 'uuid': item['uuid']})
+        return super(ViewBuilder, self)._get_item_marker(item, id_key)
+
     @staticmethod
     def _get_metadata(instance):
         metadata = instance.get("metadata", [])
@@ -66,7 +66,7 @@ class Request(webob.Request):
 
     def __init__(self, *args, **kwargs):
         super(Request, self).__init__(*args, **kwargs)
-        self._extension_data = {'db_items': {}}
+        self._extension_data = {'db_items': {}, 'prefetches': {}}
 
     def cache_db_items(self, key, items, item_key='id'):
         """
@@ -99,6 +99,38 @@ class Request(webob.Request):
         """
         return self.get_db_items(key).get(item_key)
 
+    def prefetch_db_items(self, key, item_keys, fetch):
+        """
+        Allow API extensions to declare the objects they will get with
+        get_db_item() for the items of a response, so they are fetched
+        together in one call of fetch by fetch_db_items().
+
+        fetch is called with the list of the item keys not cached yet,
+        for all the extensions which declared objects of key, and
+        returns a dict of the objects found by item key.
+        """
+        prefetches = self._extension_data['prefetches']
+        if key not in prefetches:
+            prefetches[key] = (set(), fetch)
+        prefetches[key][0].update(item_keys)
+
+    def fetch_db_items(self):
+        """
+        Fetch and cache the objects declared with prefetch_db_items().
+        Item keys with no object found are cached as None.
+        """
+        prefetches = self._extension_data['prefetches']
+        self._extension_data['prefetches'] = {}
+        for key, (item_keys, fetch) in prefetches.iteritems():
+            db_items = self._extension_data['db_items'].setdefault(key, {})
+            missing = [item_key for item_key in item_keys
+                       if item_key not in db_items]
+            if not missing:
+                continue
+            found = fetch(missing)
+            for item_key in missing:
+                db_items[item_key] = found.get(item_key)
+
     def cache_db_instances(self, instances):
         self.cache_db_items('instances', instances, 'uuid')
 
@@ -730,6 +762,7 @@ class Resource(wsgi.Application):
         # Save a mapping of extensions
         self.wsgi_extensions = {}
         self.wsgi_action_extensions = {}
+        self.wsgi_prefetches = {}
         self.inherits = inherits
 
     def register_actions(self, controller):
@@ -758,6 +791,13 @@ class Resource(wsgi.Application):
                     self.wsgi_extensions[method_name] = []
                 self.wsgi_extensions[method_name].append(extension)
 
+        prefetches = getattr(controller, 'wsgi_prefetches', [])
+        for method_name, extended_names in prefetches:
+            prefetch = getattr(controller, method_name)
+            for extended_name in extended_names:
+                self.wsgi_prefetches.setdefault(extended_name, [])
+                self.wsgi_prefetches[extended_name].append(prefetch)
+
     def get_action_args(self, request_environment):
         """Parse dictionary created by routes library."""
 
@@ -843,6 +883,21 @@ class Resource(wsgi.Application):
         # Run post-processing in the reverse order
         return None, reversed(post)
 
+    def prefetch_extensions(self, prefetches, resp_obj, request,
+                            action_args):
+        """Let extensions declare the objects they need, then fetch
+        them all at once, before post-processing extensions run.
+        """
+        try:
+            with ResourceExceptionHandler():
+                for prefetch in prefetches:
+                    prefetch(req=request, resp_obj=resp_obj, **action_args)
+                request.fetch_db_items()
+        except Fault as ex:
+            return ex
+
+        return None
+
     def post_process_extensions(self, extensions, resp_obj, request,
                                 action_args):
         for ext in extensions:
@@ -979,6 +1034,12 @@ class Resource(wsgi.Application):
                     resp_obj._default_code = meth.wsgi_code
                 resp_obj.preserialize(accept, self.default_serializers)
 
+                # Fetch what post-processing extensions need in bulk
+                response = self.prefetch_extensions(
+                        self.wsgi_prefetches.get(action, []), resp_obj,
+                        request, action_args)
+
+            if resp_obj and not response:
                 # Process post-processing extensions
                 response = self.post_process_extensions(post, resp_obj,
                                                         request, action_args)
@@ -1090,6 +1151,24 @@ def extends(*args, **kwargs):
     return decorator
 
 
+def prefetch(*names):
+    """Indicate a function declares, with req.prefetch_db_items(), the
+    objects the extensions of the named operations will need::
+
+        @prefetch('show', 'detail')
+        def _prefetch_servers(self, req, resp_obj, **kwargs):
+            pass
+
+    It is called with the arguments of the extensions, before any of
+    them.
+    """
+
+    def decorator(func):
+        func.wsgi_prefetch = names
+        return func
+    return decorator
+
+
 class ControllerMetaclass(type):
     """Controller metaclass.
 
@@ -1103,6 +1182,7 @@ class ControllerMetaclass(type):
         # Find all actions
         actions = {}
         extensions = []
+        prefetches = []
         # start with wsgi actions from base classes
         for base in bases:
             actions.update(getattr(base, 'wsgi_actions', {}))
@@ -1113,10 +1193,13 @@ class ControllerMetaclass(type):
                 actions[value.wsgi_action] = key
             elif getattr(value, 'wsgi_extends', None):
                 extensions.append(value.wsgi_extends)
+            elif getattr(value, 'wsgi_prefetch', None):
+                prefetches.append((key, value.wsgi_prefetch))
 
         # Add the actions and extensions to the class dict
         cls_dict['wsgi_actions'] = actions
         cls_dict['wsgi_extensions'] = extensions
+        cls_dict['wsgi_prefetches'] = prefetches
 
         return super(ControllerMetaclass, mcs).__new__(mcs, name, bases,
                                                        cls_dict)
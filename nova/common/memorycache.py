@@ -16,7 +16,11 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-"""Super simple fake memcache client."""
+"""Bounded in process cache exposing a memcache client interface."""
+
+import collections
+import heapq
+import sys
 
 from nova.openstack.common import cfg
 from nova.openstack.common import timeutils
@@ -25,6 +29,16 @@ memcache_opts = [
     cfg.ListOpt('memcached_servers',
                 default=None,
                 help='Memcached servers or None for in process cache.'),
+    cfg.IntOpt('memorycache_max_entries',
+               default=10000,
+               help='Maximum number of entries kept by the in process '
+                    'cache before least recently used entries are evicted. '
+                    '0 means unlimited.'),
+    cfg.IntOpt('memorycache_max_bytes',
+               default=0,
+               help='Approximate maximum size in bytes of the values kept '
+                    'by the in process cache before least recently used '
+                    'entries are evicted. 0 means unlimited.'),
 ]
 
 CONF = cfg.CONF
@@ -41,31 +55,107 @@ def get_client():
     return client_cls(CONF.memcached_servers, debug=0)
 
 
+def _value_size(value):
+    """Returns an estimate of the memory used by a cached value."""
+    if isinstance(value, basestring):
+        return len(value)
+    return sys.getsizeof(value)
+
+
 class Client(object):
-    """Replicates a tiny subset of memcached client interface."""
+    """Replicates a tiny subset of memcached client interface.
+
+    Every lookup or update of an entry stamps it with a new tick and
+    queues the (tick, key) pair, so the least recently used entry is at
+    the front of the queue and lookups and updates are O(1).  Expiry
+    times are tracked in a heap that is swept from the front on every
+    operation.  Pairs left stale in either are skipped when popped.  The
+    cache is bounded by the memorycache_max_entries and
+    memorycache_max_bytes options.
+    """
 
     def __init__(self, *args, **kwargs):
         """Ignores the passed in args."""
+        self.max_entries = kwargs.get('max_entries',
+                                      CONF.memorycache_max_entries)
+        self.max_bytes = kwargs.get('max_bytes', CONF.memorycache_max_bytes)
+        # key -> (timeout, value, size, tick)
         self.cache = {}
+        # (tick, key) pairs, oldest access first
+        self._used = collections.deque()
+        self._tick = 0
+        # (timeout, key) pairs
+        self._expiry = []
+        self.total_bytes = 0
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0,
+                      'expirations': 0}
+
+    def _remove(self, key):
+        (_timeout, _value, size, _tick) = self.cache.pop(key)
+        self.total_bytes -= size
+
+    def _store(self, key, timeout, value, size):
+        self._tick += 1
+        self.cache[key] = (timeout, value, size, self._tick)
+        self._used.append((self._tick, key))
+
+    def _expire(self, now):
+        """Drops every entry whose timeout is due."""
+        while self._expiry and self._expiry[0][0] <= now:
+            (timeout, key) = heapq.heappop(self._expiry)
+            entry = self.cache.get(key)
+            if entry is not None and entry[0] == timeout:
+                self._remove(key)
+                self.stats['expirations'] += 1
+
+    def _evict(self):
+        """Drops least recently used entries until within budget."""
+        while self.cache and (
+                (self.max_entries and len(self.cache) > self.max_entries) or
+                (self.max_bytes and self.total_bytes > self.max_bytes)):
+            (tick, key) = self._used.popleft()
+            entry = self.cache.get(key)
+            if entry is not None and entry[3] == tick:
+                self._remove(key)
+                self.stats['evictions'] += 1
+        if len(self._used) > 2 * len(self.cache) + 64:
+            # Compact the queue and the heap so stale pairs from looked
+            # up, overwritten or evicted keys cannot accumulate without
+            # bound.
+            self._used = collections.deque(sorted(
+                (entry[3], key) for key, entry in self.cache.iteritems()))
+        if len(self._expiry) > 2 * len(self.cache) + 64:
+            self._expiry = [(entry[0], key)
+                            for key, entry in self.cache.iteritems()
+                            if entry[0]]
+            heapq.heapify(self._expiry)
 
     def get(self, key):
-        """Retrieves the value for a key or None.
-
-        this expunges expired keys during each get"""
-
-        for k in self.cache.keys():
-            (timeout, _value) = self.cache[k]
-            if timeout and timeutils.utcnow_ts() >= timeout:
-                del self.cache[k]
-
-        return self.cache.get(key, (0, None))[1]
+        """Retrieves the value for a key or None."""
+        self._expire(timeutils.utcnow_ts())
+        entry = self.cache.get(key)
+        if entry is None:
+            self.stats['misses'] += 1
+            return None
+        self._store(key, *entry[:3])
+        self._evict()
+        self.stats['hits'] += 1
+        return entry[1]
 
     def set(self, key, value, time=0, min_compress_len=0):
         """Sets the value for a key."""
+        now = timeutils.utcnow_ts()
+        self._expire(now)
         timeout = 0
         if time != 0:
-            timeout = timeutils.utcnow_ts() + time
-        self.cache[key] = (timeout, value)
+            timeout = now + time
+            heapq.heappush(self._expiry, (timeout, key))
+        if key in self.cache:
+            self._remove(key)
+        size = _value_size(value)
+        self._store(key, timeout, value, size)
+        self.total_bytes += size
+        self._evict()
         return True
 
     def add(self, key, value, time=0, min_compress_len=0):
@@ -80,5 +170,21 @@ class Client(object):
         if value is None:
             return None
         new_value = int(value) + delta
-        self.cache[key] = (self.cache[key][0], str(new_value))
+        (timeout, _value, size, _tick) = self.cache[key]
+        new_str = str(new_value)
+        self._store(key, timeout, new_str, len(new_str))
+        self.total_bytes += len(new_str) - size
         return new_value
+
+    def delete(self, key, time=0):
+        """Deletes the value for a key."""
+        if key in self.cache:
+            self._remove(key)
+        return 1
+
+    def get_stats(self):
+        """Returns hit, miss, eviction and size counters for the cache."""
+        stats = dict(self.stats)
+        stats['entries'] = len(self.cache)
+        stats['bytes'] = self.total_bytes
+        return stats
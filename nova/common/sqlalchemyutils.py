@@ -43,18 +43,27 @@ def paginate_query(query, model, limit, sort_keys, marker=None,
     the lexicographical ordering:
     (k1 > X1) or (k1 == X1 && k2 > X2) or (k1 == X1 && k2 == X2 && k3 > X3)
 
-    We also have to cope with different sort_directions.
+    We also have to cope with different sort_directions, and with NULL
+    marker values, which are taken to sort before any other value.
 
     Typically, the id of the last row is used as the client-facing pagination
     marker, then the actual marker object must be fetched from the db and
-    passed in to us as marker.
+    passed in to us as marker.  The marker may also be a dictionary of the
+    sort key values, e.g. decoded from a pagination cursor, which saves
+    fetching it.
+
+    Unless X1 is NULL, the criteria above are also bounded by k1 >= X1
+    (or k1 <= X1 when descending), which lets the database seek straight
+    to the marker in an index on the sort keys rather than scanning the
+    rows before it.
 
     :param query: the query object to which we should add paging/sorting
     :param model: the ORM model class
     :param limit: maximum number of items to return
     :param sort_keys: array of attributes by which results should be sorted
-    :param marker: the last item of the previous page; we returns the next
-                    results after this value.
+    :param marker: the last item of the previous page, or a dictionary of
+                   its sort key values; we returns the next results after
+                   this value.
     :param sort_dir: direction in which results should be sorted (asc, desc)
     :param sort_dirs: per-column array of sort_dirs, corresponding to sort_keys
 
@@ -96,7 +105,10 @@ def paginate_query(query, model, limit, sort_keys, marker=None,
     if marker is not None:
         marker_values = []
         for sort_key in sort_keys:
-            v = getattr(marker, sort_key)
+            if isinstance(marker, dict):
+                v = marker[sort_key]
+            else:
+                v = getattr(marker, sort_key)
             marker_values.append(v)
 
         # Build up an array of sort criteria as in the docstring
@@ -108,13 +120,20 @@ def paginate_query(query, model, limit, sort_keys, marker=None,
                 crit_attrs.append((model_attr == marker_values[j]))
 
             model_attr = getattr(model, sort_keys[i])
-            if sort_dirs[i] == 'desc':
-                crit_attrs.append((model_attr < marker_values[i]))
-            elif sort_dirs[i] == 'asc':
-                crit_attrs.append((model_attr > marker_values[i]))
-            else:
+            if sort_dirs[i] not in ('desc', 'asc'):
                 raise ValueError(_("Unknown sort direction, "
                                    "must be 'desc' or 'asc'"))
+            if marker_values[i] is None:
+                # NOTE: NULL sorts before any value, as in MySQL and
+                #       SQLite.
+                if sort_dirs[i] == 'desc':
+                    crit_attrs.append(sqlalchemy.sql.false())
+                else:
+                    crit_attrs.append((model_attr != None))
+            elif sort_dirs[i] == 'desc':
+                crit_attrs.append((model_attr < marker_values[i]))
+            else:
+                crit_attrs.append((model_attr > marker_values[i]))
 
             criteria = sqlalchemy.sql.and_(*crit_attrs)
             criteria_list.append(criteria)
@@ -122,6 +141,13 @@ def paginate_query(query, model, limit, sort_keys, marker=None,
         f = sqlalchemy.sql.or_(*criteria_list)
         query = query.filter(f)
 
+        if marker_values[0] is not None:
+            model_attr = getattr(model, sort_keys[0])
+            if sort_dirs[0] == 'desc':
+                query = query.filter(model_attr <= marker_values[0])
+            else:
+                query = query.filter(model_attr >= marker_values[0])
+
     if limit is not None:
         query = query.limit(limit)
 
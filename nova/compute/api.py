@@ -50,6 +50,7 @@ from nova.openstack.common import excutils
 from nova.openstack.common import importutils
 from nova.openstack.common import jsonutils
 from nova.openstack.common import log as logging
+from nova.openstack.common.notifier import api as notifier_api
 from nova.openstack.common import timeutils
 from nova.openstack.common import uuidutils
 import nova.policy
@@ -1237,7 +1238,7 @@ class API(base.Base):
         return inst
 
     def get_all(self, context, search_opts=None, sort_key='created_at',
-                sort_dir='desc', limit=None, marker=None):
+                sort_dir='desc', limit=None, marker=None, fields=None):
         """Get all instances filtered by one of the given parameters.
 
         If there is no filter and the context is an admin, it will retrieve
@@ -1249,6 +1250,9 @@ class API(base.Base):
         The results will be returned sorted in the order specified by the
         'sort_dir' parameter using the key specified in the 'sort_key'
         parameter.
+
+        If 'fields' is given, the instances returned only hold those
+        columns and joined relationships, plus 'id' and 'uuid'.
         """
 
         #TODO(bcwaldon): determine the best argument for target here
@@ -1316,14 +1320,21 @@ class API(base.Base):
         inst_models = self._get_instances_by_filters(context, filters,
                                                      sort_key, sort_dir,
                                                      limit=limit,
-                                                     marker=marker)
+                                                     marker=marker,
+                                                     fields=fields)
 
         # Convert the models to dictionaries
         instances = []
         for inst_model in inst_models:
-            instance = dict(inst_model.iteritems())
-            # NOTE(comstud): Doesn't get returned by iteritems
-            instance['name'] = inst_model['name']
+            if fields is None:
+                instance = dict(inst_model.iteritems())
+                # NOTE(comstud): Doesn't get returned by iteritems
+                instance['name'] = inst_model['name']
+            else:
+                # NOTE: Only touch what was loaded, anything else would
+                #       be lazy loaded one instance at a time.
+                instance = dict((key, inst_model[key])
+                                for key in set(fields) | set(['id', 'uuid']))
             instances.append(instance)
 
         return instances
@@ -1331,7 +1342,8 @@ class API(base.Base):
     def _get_instances_by_filters(self, context, filters,
                                   sort_key, sort_dir,
                                   limit=None,
-                                  marker=None):
+                                  marker=None,
+                                  fields=None):
         if 'ip6' in filters or 'ip' in filters:
             res = self.network_api.get_instance_uuids_by_ip_filter(context,
                                                                    filters)
@@ -1342,7 +1354,8 @@ class API(base.Base):
 
         return self.db.instance_get_all_by_filters(context, filters,
                                                    sort_key, sort_dir,
-                                                   limit=limit, marker=marker)
+                                                   limit=limit, marker=marker,
+                                                   fields=fields)
 
     @wrap_check_policy
     @check_instance_state(vm_state=[vm_states.ACTIVE, vm_states.STOPPED])
@@ -2751,6 +2764,12 @@ class SecurityGroupAPI(base.Base):
         self.trigger_handler('instance_add_security_group',
                 context, instance, security_group_name)
 
+        payload = dict(instance_id=instance_uuid,
+                       security_group=security_group_name)
+        notifier_api.notify(context, notifier_api.publisher_id("compute"),
+                            'security_group.add_to_instance',
+                            notifier_api.INFO, payload)
+
     @wrap_check_security_groups_policy
     def remove_from_instance(self, context, instance, security_group_name):
         """Remove the security group associated with the instance."""
@@ -2781,6 +2800,12 @@ class SecurityGroupAPI(base.Base):
         self.trigger_handler('instance_remove_security_group',
                 context, instance, security_group_name)
 
+        payload = dict(instance_id=instance_uuid,
+                       security_group=security_group_name)
+        notifier_api.notify(context, notifier_api.publisher_id("compute"),
+                            'security_group.remove_from_instance',
+                            notifier_api.INFO, payload)
+
     def trigger_handler(self, event, *args):
         handle = getattr(self.sgh, 'trigger_%s_refresh' % event)
         handle(*args)
@@ -127,9 +127,14 @@ def service_get_by_host_and_topic(context, host, topic):
     return IMPL.service_get_by_host_and_topic(context, host, topic)
 
 
-def service_get_all(context, disabled=None):
-    """Get all services."""
-    return IMPL.service_get_all(context, disabled)
+def service_get_all(context, disabled=None, updated_since=None):
+    """Get all services.
+
+    If updated_since is given, only services created or updated at or
+    after that time are returned.
+    """
+    return IMPL.service_get_all(context, disabled,
+                                updated_since=updated_since)
 
 
 def service_does_host_exist(context, host_name, include_disabled=False):
@@ -195,9 +200,13 @@ def compute_node_get(context, compute_id):
     return IMPL.compute_node_get(context, compute_id)
 
 
-def compute_node_get_all(context):
-    """Get all computeNodes."""
-    return IMPL.compute_node_get_all(context)
+def compute_node_get_all(context, updated_since=None):
+    """Get all computeNodes.
+
+    If updated_since is given, only computeNodes created or updated at or
+    after that time are returned.
+    """
+    return IMPL.compute_node_get_all(context, updated_since=updated_since)
 
 
 def compute_node_search_by_hypervisor(context, hypervisor_match):
@@ -222,6 +231,11 @@ def compute_node_get_by_host(context, host):
     return IMPL.compute_node_get_by_host(context, host)
 
 
+def compute_node_get_by_hosts(context, hosts):
+    """Get the computeNode of each of hosts that has one, by host."""
+    return IMPL.compute_node_get_by_hosts(context, hosts)
+
+
 def compute_node_statistics(context):
     return IMPL.compute_node_statistics(context)
 
@@ -614,11 +628,15 @@ def instance_get_all(context, columns_to_join=None):
 
 
 def instance_get_all_by_filters(context, filters, sort_key='created_at',
-                                sort_dir='desc', limit=None, marker=None):
-    """Get all instances that match all filters."""
+                                sort_dir='desc', limit=None, marker=None,
+                                fields=None):
+    """Get all instances that match all filters.
+
+    If fields is given, only those columns and relationships are loaded.
+    """
     return IMPL.instance_get_all_by_filters(context, filters, sort_key,
                                             sort_dir, limit=limit,
-                                            marker=marker)
+                                            marker=marker, fields=fields)
 
 
 def instance_get_active_by_window(context, begin, end=None, project_id=None,
@@ -869,9 +887,14 @@ def network_in_use_on_host(context, network_id, host=None):
     return IMPL.network_in_use_on_host(context, network_id, host)
 
 
-def network_get_associated_fixed_ips(context, network_id, host=None):
-    """Get all network's ips that have been associated."""
-    return IMPL.network_get_associated_fixed_ips(context, network_id, host)
+def network_get_associated_fixed_ips(context, network_id, host=None,
+                                     address=None):
+    """Get all network's ips that have been associated, ordered by id.
+
+    If address is given, only that ip is returned, if it is associated.
+    """
+    return IMPL.network_get_associated_fixed_ips(context, network_id, host,
+                                                 address)
 
 
 def network_get_by_bridge(context, bridge):
@@ -1031,6 +1054,25 @@ def quota_reserve(context, resources, quotas, deltas, expire,
                               until_refresh, max_age, project_id=project_id)
 
 
+def quota_reserve_batch(context, resources, quotas, batch, expire,
+                        until_refresh, max_age, project_id=None,
+                        defer_refresh=False, stats=None):
+    """Check quotas and create reservations for a list of deltas."""
+    return IMPL.quota_reserve_batch(context, resources, quotas, batch,
+                                    expire, until_refresh, max_age,
+                                    project_id=project_id,
+                                    defer_refresh=defer_refresh,
+                                    stats=stats)
+
+
+def quota_usage_refresh(context, resources, keys, until_refresh, max_age,
+                        project_id=None, force=False):
+    """Resync the quota usages which are due for a refresh."""
+    return IMPL.quota_usage_refresh(context, resources, keys, until_refresh,
+                                    max_age, project_id=project_id,
+                                    force=force)
+
+
 def reservation_commit(context, reservations, project_id=None):
     """Commit quota reservations."""
     return IMPL.reservation_commit(context, reservations,
@@ -28,6 +28,10 @@ import uuid
 from sqlalchemy import and_
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy import or_
+from sqlalchemy.orm import class_mapper
+from sqlalchemy.orm import ColumnProperty
+from sqlalchemy.orm import contains_eager
+from sqlalchemy.orm import defer
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm import joinedload_all
 from sqlalchemy.sql.expression import asc
@@ -46,6 +50,7 @@ from nova.openstack.common import cfg
 from nova.openstack.common import log as logging
 from nova.openstack.common import timeutils
 from nova.openstack.common import uuidutils
+from nova import utils
 
 db_opts = [
     cfg.StrOpt('osapi_compute_unique_server_name_scope',
@@ -349,11 +354,15 @@ def service_get(context, service_id, session=None):
 
 
 @require_admin_context
-def service_get_all(context, disabled=None):
+def service_get_all(context, disabled=None, updated_since=None):
     query = model_query(context, models.Service)
 
     if disabled is not None:
         query = query.filter_by(disabled=disabled)
+    if updated_since is not None:
+        query = query.filter(or_(
+                models.Service.updated_at >= updated_since,
+                models.Service.created_at >= updated_since))
 
     return query.all()
 
@@ -488,11 +497,15 @@ def _compute_node_get(context, compute_id, session=None):
 
 
 @require_admin_context
-def compute_node_get_all(context):
-    return model_query(context, models.ComputeNode).\
+def compute_node_get_all(context, updated_since=None):
+    query = model_query(context, models.ComputeNode).\
             options(joinedload('service')).\
-            options(joinedload('stats')).\
-            all()
+            options(joinedload('stats'))
+    if updated_since is not None:
+        query = query.filter(or_(
+                models.ComputeNode.updated_at >= updated_since,
+                models.ComputeNode.created_at >= updated_since))
+    return query.all()
 
 
 @require_admin_context
@@ -587,6 +600,22 @@ def compute_node_get_by_host(context, host):
     return result
 
 
+def compute_node_get_by_hosts(context, hosts):
+    """Get the capacity entry of each of hosts, by host."""
+    if not hosts:
+        return {}
+    result = model_query(context, models.ComputeNode, read_deleted="no").\
+            join('service').\
+            options(contains_eager('service')).\
+            filter(models.Service.host.in_(hosts)).\
+            all()
+    compute_nodes = {}
+    for compute_node in result:
+        compute_nodes.setdefault(compute_node['service']['host'],
+                                 compute_node)
+    return compute_nodes
+
+
 def compute_node_statistics(context):
     """Compute statistics over all compute nodes."""
     result = model_query(context,
@@ -1579,12 +1608,38 @@ def instance_get_all(context, columns_to_join=None):
     return query.all()
 
 
+def _instance_fields_options(fields):
+    """Return the query options which load only the given Instance fields.
+
+    fields may name both columns and relationships.  Relationships which
+    aren't listed are left unloaded and columns which aren't listed are
+    deferred, except for id and uuid which are always loaded.  If fields
+    is None, every column and the usual relationships are loaded.
+    """
+    joins = ['info_cache', 'security_groups', 'system_metadata', 'metadata',
+             'instance_type']
+    if fields is None:
+        return [joinedload(join) for join in joins]
+
+    fields = set(fields)
+    options = [joinedload(join) for join in joins if join in fields]
+    for prop in class_mapper(models.Instance).iterate_properties:
+        if (isinstance(prop, ColumnProperty) and
+                prop.key not in fields and prop.key not in ('id', 'uuid')):
+            options.append(defer(prop.key))
+    return options
+
+
 @require_context
 def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
-                                limit=None, marker=None, session=None):
+                                limit=None, marker=None, session=None,
+                                fields=None):
     """Return instances that match all filters.  Deleted instances
     will be returned by default, unless there's a filter that says
-    otherwise"""
+    otherwise.
+
+    If fields is given, only those columns and relationships of the
+    instances are loaded."""
 
     sort_fn = {'desc': desc, 'asc': asc}
 
@@ -1592,11 +1647,7 @@ def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
         session = get_session()
 
     query_prefix = session.query(models.Instance).\
-            options(joinedload('info_cache')).\
-            options(joinedload('security_groups')).\
-            options(joinedload('system_metadata')).\
-            options(joinedload('metadata')).\
-            options(joinedload('instance_type')).\
+            options(*_instance_fields_options(fields)).\
             order_by(sort_fn[sort_dir](getattr(models.Instance, sort_key)))
 
     # Make a copy of the filters dictionary to use going forward, as we'll
@@ -1640,14 +1691,15 @@ def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
     query_prefix = regex_filter(query_prefix, models.Instance, filters)
 
     # paginate query
+    # NOTE: Ties are broken on uuid rather than id, so that the sort key
+    #       values handed out in pagination cursors are all public.
+    sort_keys = [sort_key, 'created_at', 'uuid']
     if marker is not None:
-        try:
-            marker = _instance_get_by_uuid(context, marker, session=session)
-        except exception.InstanceNotFound:
-            raise exception.MarkerNotFound(marker)
+        marker = _instance_pagination_marker(context, session, marker,
+                                             sort_keys)
     query_prefix = sqlalchemyutils.paginate_query(query_prefix,
                            models.Instance, limit,
-                           [sort_key, 'created_at', 'id'],
+                           sort_keys,
                            marker=marker,
                            sort_dir=sort_dir)
 
@@ -1655,6 +1707,33 @@ def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
     return instances
 
 
+def _instance_pagination_marker(context, session, marker, sort_keys):
+    """Return the sort key values of a pagination marker.
+
+    The marker is either the uuid of an instance, whose sort key values
+    are looked up, or a cursor carrying them made by
+    utils.encode_pagination_cursor().
+    """
+    if uuidutils.is_uuid_like(marker):
+        columns = [getattr(models.Instance, key) for key in sort_keys]
+        values = model_query(context, models.Instance, session=session,
+                             project_only=True).\
+                        filter_by(uuid=marker).\
+                        with_entities(*columns).\
+                        first()
+        if values is None:
+            raise exception.MarkerNotFound(marker)
+        return dict(zip(sort_keys, values))
+
+    try:
+        values = utils.decode_pagination_cursor(marker)
+    except ValueError:
+        raise exception.MarkerNotFound(marker)
+    if not set(sort_keys).issubset(values):
+        raise exception.MarkerNotFound(marker)
+    return values
+
+
 def regex_filter(query, model, filters):
     """Applies regular expression filtering to a query.
 
@@ -2227,7 +2306,8 @@ def network_get_all_by_uuids(context, network_uuids,
 
 
 @require_admin_context
-def network_get_associated_fixed_ips(context, network_id, host=None):
+def network_get_associated_fixed_ips(context, network_id, host=None,
+                                     address=None):
     # FIXME(sirp): since this returns fixed_ips, this would be better named
     # fixed_ip_get_all_by_network.
     # NOTE(vish): The ugly joins here are to solve a performance issue and
@@ -2246,7 +2326,8 @@ def network_get_associated_fixed_ips(context, network_id, host=None):
                           models.VirtualInterface.address,
                           models.Instance.hostname,
                           models.Instance.updated_at,
-                          models.Instance.created_at).\
+                          models.Instance.created_at,
+                          models.FixedIp.id).\
                           filter(models.FixedIp.deleted == 0).\
                           filter(models.FixedIp.network_id == network_id).\
                           filter(models.FixedIp.allocated == True).\
@@ -2256,7 +2337,9 @@ def network_get_associated_fixed_ips(context, network_id, host=None):
                           filter(models.FixedIp.virtual_interface_id != None)
     if host:
         query = query.filter(models.Instance.host == host)
-    result = query.all()
+    if address:
+        query = query.filter(models.FixedIp.address == address)
+    result = query.order_by(models.FixedIp.id).all()
     data = []
     for datum in result:
         cleaned = {}
@@ -2268,6 +2351,7 @@ def network_get_associated_fixed_ips(context, network_id, host=None):
         cleaned['instance_hostname'] = datum[5]
         cleaned['instance_updated'] = datum[6]
         cleaned['instance_created'] = datum[7]
+        cleaned['id'] = datum[8]
         data.append(cleaned)
     return data
 
@@ -2637,15 +2721,20 @@ def reservation_destroy(context, uuid):
 # code always acquires the lock on quota_usages before acquiring the lock
 # on reservations.
 
-def _get_quota_usages(context, session, project_id):
+def _get_quota_usages(context, session, project_id, resources=None,
+                      lock=True):
     # Broken out for testability
-    rows = model_query(context, models.QuotaUsage,
-                       read_deleted="no",
-                       session=session).\
-                   filter_by(project_id=project_id).\
-                   with_lockmode('update').\
-                   all()
-    return dict((row.resource, row) for row in rows)
+    query = model_query(context, models.QuotaUsage,
+                        read_deleted="no",
+                        session=session).\
+                    filter_by(project_id=project_id)
+    if resources is not None:
+        if not resources:
+            return {}
+        query = query.filter(models.QuotaUsage.resource.in_(resources))
+    if lock:
+        query = query.with_lockmode('update')
+    return dict((row.resource, row) for row in query.all())
 
 
 @require_context
@@ -2784,6 +2873,215 @@ def quota_reserve(context, resources, quotas, deltas, expire,
     return reservations
 
 
+def _quota_usage_needs_refresh(usage, max_age, pending=0):
+    if usage.in_use < 0:
+        # Negative in_use count indicates a desync, so try to
+        # heal from that...
+        return True
+    if usage.until_refresh is not None:
+        # pending reservations are about to take the count down
+        return usage.until_refresh - pending <= 0
+    if max_age:
+        return timeutils.is_older_than(usage.updated_at or usage.created_at,
+                                       max_age)
+    return False
+
+
+def _refresh_quota_usages(context, session, resources, project_id,
+                          refresh, usages, until_refresh):
+    """Run the sync routines for the resources in refresh.
+
+    Only the usage rows being refreshed are locked; usages is updated
+    in place with any rows created or refreshed along the way.
+    """
+    elevated = context.elevated()
+    usages.update(_get_quota_usages(context, session, project_id,
+                                    resources=sorted(refresh)))
+    work = set(refresh)
+    while work:
+        resource = work.pop()
+        updates = resources[resource].sync(elevated, project_id, session)
+        for res, in_use in updates.items():
+            if res not in usages:
+                usages[res] = _quota_usage_create(elevated, project_id, res,
+                                                  0, 0, until_refresh or None,
+                                                  session=session)
+            usages[res].in_use = in_use
+            usages[res].until_refresh = until_refresh or None
+            usages[res].save(session=session)
+            work.discard(res)
+            refresh.add(res)
+
+
+@require_context
+def quota_usage_refresh(context, resources, keys, until_refresh, max_age,
+                        project_id=None, force=False):
+    """Refresh the usages of keys which until_refresh or max_age say are
+    due, or all of them if force is True.
+
+    The usages are read without locks to find those due; only their
+    rows are then locked for the refresh.  Returns a dictionary of the
+    in_use counts of the refreshed usages.
+    """
+    if project_id is None:
+        project_id = context.project_id
+
+    session = get_session()
+    with session.begin():
+        usages = _get_quota_usages(context, session, project_id,
+                                   resources=sorted(keys), lock=False)
+        refresh = set(resource for resource in keys
+                      if force or resource not in usages or
+                      _quota_usage_needs_refresh(usages[resource], max_age))
+        if refresh:
+            _refresh_quota_usages(context, session, resources, project_id,
+                                  refresh, usages, until_refresh)
+        return dict((resource, usages[resource].in_use)
+                    for resource in refresh)
+
+
+@require_context
+def quota_reserve_batch(context, resources, quotas, batch, expire,
+                        until_refresh, max_age, project_id=None,
+                        defer_refresh=False, stats=None):
+    """Reserve the deltas of several requests in one transaction.
+
+    Unlike quota_reserve(), this does not lock every usage row of the
+    project.  The rows of the resources being reserved are bumped with
+    conditional UPDATE statements that only match while the new total
+    fits within the quota, so concurrent reservations serialize on the
+    touched rows only and for no longer than a single statement.  Rows
+    are only locked for reading when a usage refresh is due.
+
+    If defer_refresh is True, the caller takes care of the refreshes
+    until_refresh and max_age call for, with quota_usage_refresh(), and
+    only missing or desynced usages are synced here.
+
+    Either every request in batch is reserved or, if the combined
+    deltas go over quota for any resource, none of them are and
+    OverQuota is raised.  Returns a list with the reservation UUIDs of
+    each request, in the order of batch.
+
+    If stats is given, the number of usage rows refreshed, updated,
+    missed by their conditional update and handed back after a miss are
+    added to its rows_refreshed, rows_updated, update_misses and
+    rows_handed_back keys.
+    """
+    elevated = context.elevated()
+    if project_id is None:
+        project_id = context.project_id
+
+    increments = {}
+    decrements = {}
+    for deltas in batch:
+        for resource, delta in deltas.items():
+            if delta >= 0:
+                increments[resource] = increments.get(resource, 0) + delta
+            else:
+                decrements[resource] = decrements.get(resource, 0) + delta
+    # NOTE: Rows are always updated in the same order so that two
+    #       batches touching the same resources can't deadlock.
+    touched = sorted(set(increments) | set(decrements))
+
+    session = get_session()
+    with session.begin():
+        usages = _get_quota_usages(context, session, project_id,
+                                   resources=touched, lock=False)
+
+        refresh = set()
+        for resource in touched:
+            if resource not in usages:
+                usages[resource] = _quota_usage_create(elevated,
+                                                      project_id,
+                                                      resource,
+                                                      0, 0,
+                                                      until_refresh or None,
+                                                      session=session)
+                refresh.add(resource)
+            elif defer_refresh:
+                if usages[resource].in_use < 0:
+                    refresh.add(resource)
+            elif _quota_usage_needs_refresh(usages[resource], max_age,
+                                            pending=1):
+                refresh.add(resource)
+        if refresh:
+            _refresh_quota_usages(context, session, resources, project_id,
+                                  refresh, usages, until_refresh)
+
+        overs = []
+        applied = []
+        for resource in touched:
+            usage = usages[resource]
+            values = {'updated_at': timeutils.utcnow()}
+            if resource not in refresh:
+                values['until_refresh'] = models.QuotaUsage.until_refresh - 1
+            query = model_query(context, models.QuotaUsage,
+                                read_deleted="no", session=session).\
+                            filter_by(id=usage.id)
+
+            # NOTE(Vek): We're only concerned about positive increments.
+            #            If a project has gone over quota, we want them to
+            #            be able to reduce their usage without any
+            #            problems.
+            increment = increments.get(resource)
+            if increment is not None:
+                values['reserved'] = models.QuotaUsage.reserved + increment
+                if quotas[resource] >= 0:
+                    query = query.filter(models.QuotaUsage.in_use +
+                                         models.QuotaUsage.reserved +
+                                         increment <= quotas[resource])
+            if query.update(values, synchronize_session=False):
+                if increment:
+                    applied.append((usage.id, increment))
+            else:
+                overs.append(resource)
+
+        if stats is not None:
+            for key, count in (('rows_refreshed', len(refresh)),
+                               ('rows_updated', len(touched) - len(overs)),
+                               ('update_misses', len(overs))):
+                stats[key] = stats.get(key, 0) + count
+
+        if overs:
+            if stats is not None:
+                stats['rows_handed_back'] = (stats.get('rows_handed_back', 0)
+                                             + len(applied))
+            # Hand back what the other resources got, so the
+            # transaction still commits the usage refreshes.
+            for usage_id, increment in applied:
+                model_query(context, models.QuotaUsage, read_deleted="no",
+                            session=session).\
+                        filter_by(id=usage_id).\
+                        update({'reserved': models.QuotaUsage.reserved -
+                                            increment},
+                               synchronize_session=False)
+        else:
+            result = []
+            for deltas in batch:
+                reservations = []
+                for resource, delta in deltas.items():
+                    reservation = reservation_create(elevated,
+                                                     str(uuid.uuid4()),
+                                                     usages[resource],
+                                                     project_id,
+                                                     resource, delta, expire,
+                                                     session=session)
+                    reservations.append(reservation.uuid)
+                result.append(reservations)
+
+    unders = [resource for resource, delta in decrements.items()
+              if delta + usages[resource].in_use < 0]
+    if unders:
+        LOG.warning(_("Change will make usage less than 0 for the following "
+                      "resources: %(unders)s") % locals())
+    if overs:
+        usages = dict((k, dict(in_use=v['in_use'], reserved=v['reserved']))
+                      for k, v in usages.items())
+        raise exception.OverQuota(overs=overs, quotas=quotas, usages=usages)
+
+    return result
+
+
 def _quota_reservations_query(session, context, reservations):
     """Return the relevant reservations."""
 
@@ -2795,11 +3093,25 @@ def _quota_reservations_query(session, context, reservations):
                    with_lockmode('update')
 
 
+def _quota_reservations_resources(session, context, reservations):
+    """Return the resources the reservations are for, without locking."""
+    rows = model_query(context, models.Reservation.resource,
+                       base_model=models.Reservation,
+                       read_deleted="no",
+                       session=session).\
+                   filter(models.Reservation.uuid.in_(reservations)).\
+                   distinct().\
+                   all()
+    return sorted(row[0] for row in rows)
+
+
 @require_context
 def reservation_commit(context, reservations, project_id=None):
     session = get_session()
     with session.begin():
-        usages = _get_quota_usages(context, session, project_id)
+        usages = _get_quota_usages(context, session, project_id,
+                resources=_quota_reservations_resources(session, context,
+                                                        reservations))
         reservation_query = _quota_reservations_query(session, context,
                                                       reservations)
         for reservation in reservation_query.all():
@@ -2814,7 +3126,9 @@ def reservation_commit(context, reservations, project_id=None):
 def reservation_rollback(context, reservations, project_id=None):
     session = get_session()
     with session.begin():
-        usages = _get_quota_usages(context, session, project_id)
+        usages = _get_quota_usages(context, session, project_id,
+                resources=_quota_reservations_resources(session, context,
+                                                        reservations))
         reservation_query = _quota_reservations_query(session, context,
                                                       reservations)
         for reservation in reservation_query.all():
@@ -0,0 +1,44 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import Index, MetaData, Table
+
+
+def _indexes(t):
+    # Based on the default created_at, uuid ordering of
+    # instance_get_all_by_filters from: nova/db/sqlalchemy/api.py
+    return [Index('instances_project_id_created_at_uuid_idx',
+                  t.c.project_id, t.c.created_at, t.c.uuid),
+            Index('instances_created_at_uuid_idx', t.c.created_at, t.c.uuid)]
+
+
+def upgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    t = Table('instances', meta, autoload=True)
+    for i in _indexes(t):
+        i.create(migrate_engine)
+
+
+def downgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    t = Table('instances', meta, autoload=True)
+    for i in _indexes(t):
+        i.drop(migrate_engine)
@@ -201,6 +201,10 @@ class GlanceConnectionFailed(NovaException):
         "%(reason)s")
 
 
+class ImageDownloadFailed(NovaException):
+    message = _("Download of image data from %(url)s failed: %(reason)s")
+
+
 class NotAuthorized(NovaException):
     message = _("Not authorized.")
     code = 403
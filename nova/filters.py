@@ -39,6 +39,15 @@ class BaseFilter(object):
             if self._filter_one(obj, filter_properties):
                 yield obj
 
+    def filter_columns(self, columns, filter_properties):
+        """Return a boolean array marking the objects which pass the
+        filter, or None if the filter can only be run one object at a time.
+
+        columns holds the numeric fields of all objects as arrays.  Override
+        this in a subclass to support columnar evaluation.
+        """
+        return None
+
 
 class BaseFilterHandler(loadables.BaseLoader):
     """Base class to handle loading filter classes.
@@ -0,0 +1,348 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Download image data in chunks with concurrent range requests.
+
+When the image server accepts range requests, an image is fetched in
+chunks by several greenthreads, each writing its chunks at their offset
+in the file.  The chunks completed so far are recorded in a state file
+next to the image, so an interrupted download, even one interrupted by
+a restart of the service, resumes where it stopped.  The finished
+file is checked against the checksum the image server gives for it.
+
+The number of requests in flight and the rate image data is read at
+are limited for all the downloads of the host together.
+"""
+
+import hashlib
+import httplib
+import os
+import socket
+import sys
+import time
+import urlparse
+
+from eventlet import greenpool
+from eventlet import greenthread
+from eventlet import semaphore
+from glanceclient.common import http as glance_http
+
+from nova import exception
+from nova.openstack.common import cfg
+from nova.openstack.common import jsonutils
+from nova.openstack.common import log as logging
+
+download_opts = [
+    cfg.IntOpt('image_download_chunk_size',
+               default=0,
+               help='Size in MB of the chunks images are downloaded in '
+                    'when the image server accepts range requests. '
+                    'The glance v1 API does not advertise range support, '
+                    'so only set this when glance is fronted by a server '
+                    'that does. Set to 0 to always download images in '
+                    'one stream'),
+    cfg.IntOpt('image_download_concurrency',
+               default=4,
+               help='Maximum number of requests for image data in flight '
+                    'at once on this host'),
+    cfg.IntOpt('image_download_max_rate',
+               default=0,
+               help='Maximum rate in KB/s at which this host downloads '
+                    'images, all downloads together. 0 means no limit'),
+    ]
+
+CONF = cfg.CONF
+CONF.register_opts(download_opts)
+CONF.import_opt('glance_api_insecure', 'nova.image.glance')
+CONF.import_opt('glance_num_retries', 'nova.image.glance')
+
+LOG = logging.getLogger(__name__)
+
+BLOCK_SIZE = 65536
+ZERO_BLOCK = '\0' * BLOCK_SIZE
+
+
+class RateLimiter(object):
+    """Spread a budget of bytes per second over the readers sharing it."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.next_time = 0
+
+    def consume(self, nbytes):
+        """Account for nbytes read, sleeping as long as they take at the
+        rate allowed.
+        """
+        if not self.rate:
+            return
+        now = time.time()
+        self.next_time = max(self.next_time, now) + float(nbytes) / self.rate
+        greenthread.sleep(self.next_time - now)
+
+
+class Throttle(object):
+    """The limits shared by all the image downloads of the host."""
+
+    def __init__(self, concurrency, max_rate):
+        self.concurrency = concurrency
+        self.max_rate = max_rate
+        self.semaphore = semaphore.Semaphore(concurrency)
+        self.limiter = RateLimiter(max_rate * 1024)
+
+
+_throttle = None
+
+
+def get_throttle():
+    global _throttle
+    settings = (max(CONF.image_download_concurrency, 1),
+                CONF.image_download_max_rate)
+    if (_throttle is None or
+        (_throttle.concurrency, _throttle.max_rate) != settings):
+        _throttle = Throttle(*settings)
+    return _throttle
+
+
+class ThrottledWriter(object):
+    """File object writing no faster than the rate limit of the host."""
+
+    def __init__(self, image_file):
+        self.image_file = image_file
+        self.limiter = get_throttle().limiter
+
+    def write(self, data):
+        self.limiter.consume(len(data))
+        self.image_file.write(data)
+
+
+def _request(url, method, headers):
+    o = urlparse.urlparse(url)
+    if o.scheme == 'https':
+        # NOTE: the connection glanceclient uses, so the certificate of
+        #       the server is checked the same way
+        conn = glance_http.VerifiedHTTPSConnection(
+            o.hostname, o.port, insecure=CONF.glance_api_insecure)
+    else:
+        conn = httplib.HTTPConnection(o.hostname, o.port)
+    path = o.path
+    if o.query:
+        path += '?' + o.query
+    conn.request(method, path, headers=headers)
+    return conn.getresponse()
+
+
+class RangedDownload(object):
+    """Download the data at url to path in chunks.
+
+    Call probe() first to find out whether the server allows it.
+    """
+
+    def __init__(self, url, path, headers=None):
+        self.url = url
+        self.path = path
+        self.headers = headers or {}
+        self.state_path = '%s.state' % path
+        self.chunk_size = CONF.image_download_chunk_size * 1024 * 1024
+        self.size = None
+        self.identity = None
+        self.checksum = None
+        self.done = set()
+
+    def probe(self):
+        """Find out the size of the data and whether the server accepts
+        range requests for it.
+
+        Returns False if the data has to be downloaded in one stream,
+        which includes when the server could not be asked.
+        """
+        if not self.chunk_size:
+            return False
+        try:
+            response = _request(self.url, 'HEAD', self.headers)
+            response.read()
+        except Exception as e:
+            LOG.warn(_("Could not find out whether %(url)s can be "
+                       "downloaded in chunks, downloading it in one "
+                       "stream: %(e)s"), {'url': self.url, 'e': e})
+            return False
+        if response.status != httplib.OK:
+            return False
+        if 'bytes' not in response.getheader('accept-ranges', ''):
+            return False
+        size = (response.getheader('x-image-meta-size') or
+                response.getheader('content-length'))
+        if size is None:
+            return False
+        self.size = int(size)
+        self.checksum = response.getheader('x-image-meta-checksum')
+        # NOTE: what tells whether a partial download is of the same data
+        self.identity = self.checksum or response.getheader('etag')
+        return True
+
+    def discard_state(self):
+        if os.path.exists(self.state_path):
+            os.unlink(self.state_path)
+
+    def _verify(self):
+        """Check the downloaded file against the MD5 checksum the image
+        server gave, removing the file and its state if they differ.
+        """
+        if not self.checksum:
+            return
+        md5 = hashlib.md5()
+        with open(self.path, 'rb') as f:
+            for data in iter(lambda: f.read(BLOCK_SIZE), ''):
+                md5.update(data)
+        if md5.hexdigest() != self.checksum:
+            os.unlink(self.path)
+            self.discard_state()
+            raise exception.ImageDownloadFailed(url=self.url,
+                reason=_("checksum %(actual)s does not match %(expected)s") %
+                       {'actual': md5.hexdigest(),
+                        'expected': self.checksum})
+
+    def _load_state(self):
+        """Return the chunks an earlier download of the same data to the
+        same file completed.
+        """
+        if not os.path.exists(self.path) or not self.identity:
+            return set()
+        try:
+            with open(self.state_path) as f:
+                state = jsonutils.loads(f.read())
+        except (IOError, ValueError):
+            return set()
+        if (state.get('identity') != self.identity or
+            state.get('size') != self.size or
+            state.get('chunk_size') != self.chunk_size):
+            return set()
+        return set(state['done'])
+
+    def _save_state(self):
+        state = {'identity': self.identity,
+                 'size': self.size,
+                 'chunk_size': self.chunk_size,
+                 'done': sorted(self.done)}
+        staged = '%s.tmp' % self.state_path
+        with open(staged, 'w') as f:
+            f.write(jsonutils.dumps(state))
+        os.rename(staged, self.state_path)
+
+    def _chunk_count(self):
+        return (self.size + self.chunk_size - 1) // self.chunk_size
+
+    def fetch(self):
+        """Download the chunks of the data that are not on disk yet.
+
+        The finished file is checked against the checksum of the data.
+        """
+        self.done = self._load_state()
+        resumed = bool(self.done)
+        if resumed:
+            LOG.info(_("Resuming download of %(url)s to %(path)s, "
+                       "%(done)d of %(count)d chunks already done"),
+                     {'url': self.url, 'path': self.path,
+                      'done': len(self.done), 'count': self._chunk_count()})
+
+        flags = os.O_WRONLY | os.O_CREAT
+        if not resumed:
+            flags |= os.O_TRUNC
+        fd = os.open(self.path, flags, 0644)
+        try:
+            os.ftruncate(fd, self.size)
+            self._save_state()
+            self._fetch_chunks(fd, sparse=not resumed)
+        finally:
+            os.close(fd)
+        self._verify()
+        self.discard_state()
+
+    def _fetch_chunks(self, fd, sparse):
+        errors = []
+
+        def fetch_chunk(index):
+            if errors:
+                return
+            try:
+                self._fetch_chunk(fd, index, sparse)
+            except Exception:
+                errors.append(sys.exc_info())
+
+        pool = greenpool.GreenPool(get_throttle().concurrency)
+        for index in xrange(self._chunk_count()):
+            if index not in self.done:
+                pool.spawn_n(fetch_chunk, index)
+        pool.waitall()
+        if errors:
+            exc_type, exc_value, exc_trace = errors[0]
+            raise exc_type, exc_value, exc_trace
+
+    def _fetch_chunk(self, fd, index, sparse):
+        start = index * self.chunk_size
+        end = min(start + self.chunk_size, self.size) - 1
+        throttle = get_throttle()
+        num_attempts = 1 + CONF.glance_num_retries
+
+        for attempt in xrange(1, num_attempts + 1):
+            try:
+                with throttle.semaphore:
+                    self._read_range(fd, start, end, sparse)
+                break
+            except (socket.error, httplib.HTTPException,
+                    exception.ImageDownloadFailed) as e:
+                if attempt == num_attempts:
+                    raise
+                LOG.warn(_("Error downloading bytes %(start)d-%(end)d of "
+                           "%(url)s, retrying: %(e)s"),
+                         {'start': start, 'end': end, 'url': self.url,
+                          'e': e})
+                # NOTE: zero blocks are skipped only where nothing was
+                #       written yet, which a failed attempt may have
+                sparse = False
+
+        os.fsync(fd)
+        self.done.add(index)
+        self._save_state()
+
+    def _read_range(self, fd, start, end, sparse):
+        headers = dict(self.headers)
+        headers['Range'] = 'bytes=%d-%d' % (start, end)
+        response = _request(self.url, 'GET', headers)
+        content_range = response.getheader('content-range', '')
+        if (response.status != httplib.PARTIAL_CONTENT or
+            not content_range.startswith('bytes %d-%d/' % (start, end))):
+            raise exception.ImageDownloadFailed(url=self.url,
+                reason=_("range %(range)s answered with %(status)d "
+                         "%(content_range)s") %
+                       {'range': headers['Range'],
+                        'status': response.status,
+                        'content_range': content_range})
+
+        limiter = get_throttle().limiter
+        offset = start
+        while offset <= end:
+            data = response.read(min(BLOCK_SIZE, end + 1 - offset))
+            if not data:
+                raise exception.ImageDownloadFailed(url=self.url,
+                    reason=_("connection closed at byte %d") % offset)
+            limiter.consume(len(data))
+            if not sparse or data != ZERO_BLOCK[:len(data)]:
+                os.lseek(fd, offset, os.SEEK_SET)
+                written = 0
+                while written < len(data):
+                    written += os.write(fd, data[written:])
+            offset += len(data)
@@ -165,6 +165,14 @@ class GlanceClientWrapper(object):
                                      self.host, self.port,
                                      self.use_ssl, version)
 
+    def get_endpoint(self):
+        """Return the host, port and use_ssl of the server to call."""
+        if self.client is not None:
+            return self.host, self.port, self.use_ssl
+        if self.api_servers is None:
+            self.api_servers = get_api_servers()
+        return self.api_servers.next()
+
     def call(self, context, version, method, *args, **kwargs):
         """
         Call a glance client method.  If we get a connection error,
@@ -280,6 +288,24 @@ class GlanceImageService(object):
         for chunk in image_chunks:
             data.write(chunk)
 
+    def get_data_request(self, context, image_id):
+        """Returns the url and the headers of a request for the data of an
+        image, for downloads which do not go through glanceclient, or None
+        if the data is to be read from its direct url.
+        """
+        if 'file' in CONF.allowed_direct_url_schemes:
+            return None
+        host, port, use_ssl = self._client.get_endpoint()
+        if use_ssl:
+            scheme = 'https'
+        else:
+            scheme = 'http'
+        url = '%s://%s:%s/v1/images/%s' % (scheme, host, port, image_id)
+        headers = {}
+        if CONF.auth_strategy == 'keystone' and context.auth_token:
+            headers['X-Auth-Token'] = context.auth_token
+        return url, headers
+
     def create(self, context, image_meta, data=None):
         """Store the image data and return the new image object."""
         sent_service_image_meta = self._translate_to_glance(image_meta)
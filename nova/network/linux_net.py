@@ -20,9 +20,12 @@
 """Implements vlans, bridges, and iptables rules using linux utilities."""
 
 import calendar
+import collections
 import inspect
 import netaddr
 import os
+import stat
+import tempfile
 
 from nova import db
 from nova import exception
@@ -31,6 +34,7 @@ from nova.openstack.common import fileutils
 from nova.openstack.common import importutils
 from nova.openstack.common import lockutils
 from nova.openstack.common import log as logging
+from nova.openstack.common import timeutils
 from nova import paths
 from nova import utils
 
@@ -91,6 +95,18 @@ linux_net_opts = [
     cfg.IntOpt('metadata_port',
                default=8775,
                help='the port for the metadata api port'),
+    cfg.IntOpt('iptables_full_resync_interval',
+               default=300,
+               help='Seconds between rewriting all iptables tables on '
+                    'apply.  In between, only the changed chains of this '
+                    'service are rewritten, with iptables-restore '
+                    '--noflush.  0 always rewrites all tables'),
+    cfg.IntOpt('dhcp_hosts_resync_interval',
+               default=600,
+               help='Seconds between reloading all fixed ips of a network '
+                    'from the database when updating dnsmasq files.  In '
+                    'between, only the fixed ips allocated or deallocated '
+                    'are looked up again.  0 always reloads all of them'),
     ]
 
 CONF = cfg.CONF
@@ -294,6 +310,11 @@ class IptablesManager(object):
 
         self.iptables_apply_deferred = False
 
+        # The chains last written to each table, and when each command
+        # last rewrote all of its tables, for applying changes only.
+        self._applied = {}
+        self._last_full_apply = {}
+
         # Add a nova-filter-top chain. It's intended to be shared
         # among the various nova components. It sits at the very top
         # of FORWARD and OUTPUT.
@@ -365,25 +386,138 @@ class IptablesManager(object):
         same component of Nova, and replace them with our current set of
         rules. This happens atomically, thanks to iptables-restore.
 
+        Between full rewrites, every iptables_full_resync_interval
+        seconds, only the wrapped chains that changed since the last apply
+        are rewritten, leaving the rest of the tables alone.
+
         """
         s = [('iptables', self.ipv4)]
         if CONF.use_ipv6:
             s += [('ip6tables', self.ipv6)]
 
         for cmd, tables in s:
-            all_tables, _err = self.execute('%s-save' % (cmd,), '-c',
-                                                run_as_root=True,
-                                                attempts=5)
-            all_lines = all_tables.split('\n')
-            for table in tables:
-                start, end = self._find_table(all_lines, table)
-                all_lines[start:end] = self._modify_rules(
-                        all_lines[start:end], tables[table])
-            self.execute('%s-restore' % (cmd,), '-c', run_as_root=True,
-                         process_input='\n'.join(all_lines),
-                         attempts=5)
+            if not self._apply_changed_chains(cmd, tables):
+                self._apply_all(cmd, tables)
         LOG.debug(_("IPTablesManager.apply completed with success"))
 
+    def _apply_all(self, cmd, tables):
+        all_tables, _err = self.execute('%s-save' % (cmd,), '-c',
+                                            run_as_root=True,
+                                            attempts=5)
+        all_lines = all_tables.split('\n')
+        for table in tables:
+            start, end = self._find_table(all_lines, table)
+            all_lines[start:end] = self._modify_rules(
+                    all_lines[start:end], tables[table])
+        self.execute('%s-restore' % (cmd,), '-c', run_as_root=True,
+                     process_input='\n'.join(all_lines),
+                     attempts=5)
+
+        for table in tables:
+            self._applied[(cmd, table)] = self._chain_state(tables[table])
+        self._last_full_apply[cmd] = timeutils.utcnow()
+
+    def _apply_changed_chains(self, cmd, tables):
+        """Rewrite the wrapped chains changed since the last apply.
+
+        Returns False, having changed nothing, when all tables need to be
+        rewritten instead: nothing was applied yet, the resync interval
+        passed, rules outside our wrapped chains changed, or
+        iptables-restore failed because the tables drifted from what we
+        last wrote.
+
+        """
+        last_full_apply = self._last_full_apply.get(cmd)
+        if (not CONF.iptables_full_resync_interval or
+                last_full_apply is None or
+                timeutils.is_older_than(last_full_apply,
+                                        CONF.iptables_full_resync_interval)):
+            return False
+
+        states = {}
+        lines = []
+        for name, table in tables.iteritems():
+            if table.remove_rules or table.remove_chains:
+                return False
+            applied = self._applied.get((cmd, name))
+            state = self._chain_state(table)
+            if applied is None or applied[0] != state[0]:
+                return False
+            states[name] = state
+            lines.extend(self._changed_chains_lines(name, applied[1],
+                                                    state[1]))
+
+        if lines:
+            try:
+                self.execute('%s-restore' % (cmd,), '-c', '--noflush',
+                             run_as_root=True,
+                             process_input='\n'.join(lines),
+                             attempts=5)
+            except Exception:
+                LOG.warn(_('Failed to apply changed %s chains, rewriting '
+                           'all tables'), cmd)
+                return False
+
+        for name, state in states.iteritems():
+            self._applied[(cmd, name)] = state
+        return True
+
+    @staticmethod
+    def _chain_state(table):
+        """Return the rules of a table as _modify_rules() writes them.
+
+        This is a tuple of what lives outside our wrapped chains, the
+        unwrapped chains and their rules, and a dict of the lines of each
+        wrapped chain.
+
+        """
+        shared = []
+        chains = dict((name, []) for name in table.chains)
+        for rule in ([rule for rule in table.rules if rule.top] +
+                     [rule for rule in table.rules if not rule.top]):
+            if rule.wrap:
+                chains[rule.chain].append(str(rule))
+            else:
+                shared.append(str(rule))
+
+        # Duplicates are dropped, letting the *last* occurrence take
+        # precedence.
+        for name, rules in chains.iteritems():
+            seen_rules = set()
+            weeded = []
+            for rule in reversed(rules):
+                if rule not in seen_rules:
+                    seen_rules.add(rule)
+                    weeded.append(rule)
+            weeded.reverse()
+            chains[name] = weeded
+
+        return (sorted(table.unwrapped_chains), sorted(shared)), chains
+
+    @staticmethod
+    def _changed_chains_lines(table_name, applied, wanted):
+        """Return iptables-restore --noflush input updating a table.
+
+        Declaring a chain creates it or flushes its rules, so changed
+        chains are declared and refilled, and removed chains declared and
+        then deleted, once nothing jumps to them anymore.
+
+        """
+        changed = sorted(name for name in wanted
+                         if wanted[name] != applied.get(name))
+        removed = sorted(name for name in applied if name not in wanted)
+        if not changed and not removed:
+            return []
+
+        lines = ['*%s' % table_name]
+        lines += [':%s-%s - [0:0]' % (binary_name, name)
+                  for name in changed + removed]
+        for name in changed:
+            lines += wanted[name]
+        lines += ['-X %s-%s' % (binary_name, name) for name in removed]
+        lines.append('COMMIT')
+        return lines
+
     def _find_table(self, lines, table_name):
         if len(lines) < 3:
             # length only <2 when fake iptables
@@ -404,9 +538,26 @@ class IptablesManager(object):
         rules = table.rules
         remove_rules = table.remove_rules
 
+        # rule.top == True means we want this rule to be at the top.
+        # Current lines that duplicate a top rule are dropped here and
+        # take its place, as we don't want to replace an entry that has
+        # non-zero [packet:byte] counts with [0:0].  Lines are matched by
+        # their counter-stripped text, hashed so that this is one pass
+        # whatever the number of rules.
+        top_keys = set(_rule_key(str(rule)) for rule in rules if rule.top)
+        top_dups = {}
+
         # Remove any trace of our rules
-        new_filter = filter(lambda line: binary_name not in line,
-                            current_lines)
+        new_filter = []
+        for line in current_lines:
+            if binary_name in line:
+                continue
+            key = _rule_key(line)
+            if key in top_keys:
+                # grab the last entry, if there is one
+                top_dups[key] = line
+                continue
+            new_filter.append(line)
 
         seen_chains = False
         rules_index = 0
@@ -423,110 +574,161 @@ class IptablesManager(object):
         for rule in rules:
             rule_str = str(rule)
             if rule.top:
-                # rule.top == True means we want this rule to be at the top.
-                # Further down, we weed out duplicates from the bottom of the
-                # list, so here we remove the dupes ahead of time.
-
-                # We don't want to remove an entry if it has non-zero
-                # [packet:byte] counts and replace it with [0:0], so let's
-                # go look for a duplicate, and over-ride our table rule if
-                # found.
-
-                # ignore [packet:byte] counts at beginning of line
-                if rule_str.startswith('['):
-                    rule_str = rule_str.split(']', 1)[1]
-                dup_filter = filter(lambda s: rule_str.strip() in s.strip(),
-                                    new_filter)
-
-                new_filter = filter(lambda s:
-                                    rule_str.strip() not in s.strip(),
-                                    new_filter)
                 # if no duplicates, use original rule
-                if dup_filter:
-                    # grab the last entry, if there is one
-                    dup = dup_filter[-1]
-                    rule_str = str(dup)
-                else:
-                    rule_str = str(rule)
-                rule_str.strip()
-
-                our_rules += [rule_str]
+                our_rules.append(top_dups.pop(_rule_key(rule_str), rule_str))
             else:
-                bot_rules += [rule_str]
-
-        our_rules += bot_rules
+                bot_rules.append(rule_str)
 
-        new_filter[rules_index:rules_index] = our_rules
+        our_chains = ([':%s-%s - [0:0]' % (binary_name, name,)
+                       for name in chains] +
+                      [':%s - [0:0]' % (name,) for name in unwrapped_chains])
+        new_filter[rules_index:rules_index] = (our_chains + our_rules +
+                                               bot_rules)
 
-        new_filter[rules_index:rules_index] = [':%s - [0:0]' % (name,)
-                                               for name in unwrapped_chains]
-        new_filter[rules_index:rules_index] = [':%s-%s - [0:0]' %
-                                               (binary_name, name,)
-                                               for name in chains]
+        # We filter duplicates, letting the *last* occurrence take
+        # precendence.  We also filter out anything in the "remove"
+        # lists, each entry of which removes one line.
+        chains_to_remove = set(remove_chains)
+        rules_to_remove = collections.defaultdict(int)
+        for rule in remove_rules:
+            rules_to_remove[_rule_key(str(rule))] += 1
 
         seen_lines = set()
+        weeded = []
+        for line in reversed(new_filter):
+            key = _rule_key(line)
+            if key in seen_lines:
+                continue
+            seen_lines.add(key)
 
-        def _weed_out_duplicates(line):
-            # ignore [packet:byte] counts at beginning of lines
-            if line.startswith('['):
-                line = line.split(']', 1)[1]
-            line = line.strip()
-            if line in seen_lines:
-                return False
-            else:
-                seen_lines.add(line)
-                return True
-
-        def _weed_out_removes(line):
             # We need to find exact matches here
             if line.startswith(':'):
                 # it's a chain, for example, ":nova-billing - [0:0]"
                 # strip off everything except the chain name
-                line = line.split(':')[1]
-                line = line.split('- [')[0]
-                line = line.strip()
-                for chain in remove_chains:
-                    if chain == line:
-                        remove_chains.remove(chain)
-                        return False
+                chain = line.split(':')[1].split('- [')[0].strip()
+                if chain in chains_to_remove:
+                    chains_to_remove.remove(chain)
+                    continue
             elif line.startswith('['):
                 # it's a rule
-                # ignore [packet:byte] counts at beginning of lines
-                line = line.split(']', 1)[1]
-                line = line.strip()
-                for rule in remove_rules:
-                    # ignore [packet:byte] counts at beginning of rules
-                    rule_str = str(rule)
-                    rule_str = rule_str.split(' ', 1)[1]
-                    rule_str = rule_str.strip()
-                    if rule_str == line:
-                        remove_rules.remove(rule)
-                        return False
+                if rules_to_remove.get(key):
+                    rules_to_remove[key] -= 1
+                    continue
 
             # Leave it alone
-            return True
-
-        # We filter duplicates, letting the *last* occurrence take
-        # precendence.  We also filter out anything in the "remove"
-        # lists.
-        new_filter.reverse()
-        new_filter = filter(_weed_out_duplicates, new_filter)
-        new_filter = filter(_weed_out_removes, new_filter)
-        new_filter.reverse()
+            weeded.append(line)
+        weeded.reverse()
 
         # flush lists, just in case we didn't find something
         remove_chains.clear()
-        for rule in remove_rules:
-            remove_rules.remove(rule)
+        del remove_rules[:]
+
+        return weeded
+
+
+def _rule_key(line):
+    """Return an iptables-save line without its [packet:byte] counts."""
+    if line.startswith('['):
+        line = line.split(']', 1)[1]
+    return line.strip()
+
+
+class IpsetManager(object):
+    """Wrapper for ipset hash:ip sets.
+
+    The members of every set are remembered after they are written, so
+    that a later change only adds and deletes the addresses that differ.
+    Sets are flushed the first time they are seen by this process, in
+    case they were left behind by a previous run.
+    """
+
+    def __init__(self, execute=None):
+        if not execute:
+            self.execute = _execute
+        else:
+            self.execute = execute
+
+        self.sets = {}
+
+    def set_members(self, name, version, addresses):
+        """Make addresses the members of the set called name.
+
+        The set is created for the given ip version if needed.
+        """
+        wanted = set(addresses)
+        current = self.sets.get(name)
+        if current is None:
+            family = version == 6 and 'inet6' or 'inet'
+            self.execute('ipset', 'create', '-exist', name, 'hash:ip',
+                         'family', family, run_as_root=True)
+            self.execute('ipset', 'flush', name, run_as_root=True)
+            current = set()
+
+        for address in sorted(current - wanted):
+            self.execute('ipset', 'del', '-exist', name, address,
+                         run_as_root=True)
+        added = sorted(wanted - current)
+        if added:
+            self.execute('ipset', 'restore', '-exist',
+                         process_input=''.join('add %s %s\n' % (name, address)
+                                               for address in added),
+                         run_as_root=True)
+        self.sets[name] = wanted
 
-        return new_filter
+    def destroy(self, name):
+        """Remove the set called name, unless iptables still uses it."""
+        try:
+            self.execute('ipset', 'destroy', name, run_as_root=True)
+        except exception.ProcessExecutionError:
+            LOG.warn(_("Could not destroy ipset %s, it may still be in "
+                       "use"), name)
+            return False
+        self.sets.pop(name, None)
+        return True
 
 
 # NOTE(jkoelker) This is just a nice little stub point since mocking
 #                builtins with mox is a nightmare
 def write_to_file(file, data, mode='w'):
-    with open(file, mode) as f:
-        f.write(data)
+    if mode != 'w':
+        with open(file, mode) as f:
+            f.write(data)
+        return
+
+    # NOTE: dnsmasq may reread the file at any time, so the new contents
+    #       are written next to it and renamed into place.
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(file),
+                                    prefix=os.path.basename(file) + '.')
+    with utils.remove_path_on_error(tmp_file):
+        os.fchmod(fd, _file_mode(file))
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        os.rename(tmp_file, file)
+
+
+def _file_mode(file):
+    """Return the mode open() would leave file with after writing it."""
+    try:
+        return stat.S_IMODE(os.stat(file).st_mode)
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0666 & ~umask
+
+
+def _write_if_changed(file, data):
+    """Write data to file unless it holds data already.
+
+    Returns whether the file was written.
+    """
+    try:
+        with open(file) as f:
+            if f.read() == data:
+                return False
+    except IOError:
+        pass
+    write_to_file(file, data)
+    return True
 
 
 def metadata_forward():
@@ -726,6 +928,111 @@ def initialize_gateway_device(dev, network_ref):
                  'dev', dev, run_as_root=True)
 
 
+class FixedIpTable(object):
+    """The associated fixed ips of a network, kept in memory.
+
+    The table is loaded with network_get_associated_fixed_ips.  After
+    that, only the addresses reported through changed() are looked up
+    again, until dhcp_hosts_resync_interval passes or a change to the
+    whole network is reported, and the table is reloaded.  The fixed ips
+    are kept in id order, the order of a reload, so the files written
+    from them do not change just because an address was looked up again.
+    """
+
+    def __init__(self, network_id, host=None):
+        self.network_id = network_id
+        self.host = host
+        # address -> fixed ip
+        self.fixed_ips = {}
+        self.ordered = []
+        # instance uuid -> id of the vif getting the default gateway
+        self.default_gw_vifs = {}
+        self.changed_addresses = None
+        self.synced_at = None
+
+    def changed(self, addresses=None):
+        """Look up addresses again on the next get, or all if None."""
+        if addresses is None or self.changed_addresses is None:
+            self.changed_addresses = addresses and set(addresses)
+        else:
+            self.changed_addresses.update(addresses)
+
+    def get(self, context):
+        """Return the associated fixed ips, in the database's format."""
+        addresses, self.changed_addresses = self.changed_addresses, set()
+        if (addresses is None or self.synced_at is None or
+                not CONF.dhcp_hosts_resync_interval or
+                timeutils.is_older_than(self.synced_at,
+                                        CONF.dhcp_hosts_resync_interval)):
+            self._load(context)
+        else:
+            for address in sorted(addresses):
+                self._reload(context, address)
+            if addresses:
+                self._sort()
+        return self.ordered
+
+    def default_gw_vif(self, context, instance_uuid):
+        """Return the id of the first vif of an instance, if it has any."""
+        if instance_uuid not in self.default_gw_vifs:
+            vifs = db.virtual_interface_get_by_instance(context,
+                                                        instance_uuid)
+            self.default_gw_vifs[instance_uuid] = None
+            if vifs:
+                self.default_gw_vifs[instance_uuid] = vifs[0]['id']
+        return self.default_gw_vifs[instance_uuid]
+
+    def _load(self, context):
+        data = db.network_get_associated_fixed_ips(context, self.network_id,
+                                                   host=self.host)
+        self.fixed_ips = dict((datum['address'], datum) for datum in data)
+        self._sort()
+        self.default_gw_vifs = {}
+        self.synced_at = timeutils.utcnow()
+
+    def _sort(self):
+        self.ordered = sorted(self.fixed_ips.itervalues(),
+                              key=lambda datum: datum['id'])
+
+    def _reload(self, context, address):
+        old = self.fixed_ips.pop(address, None)
+        if old:
+            self.default_gw_vifs.pop(old['instance_uuid'], None)
+        for datum in db.network_get_associated_fixed_ips(
+                context, self.network_id, host=self.host, address=address):
+            self.fixed_ips[address] = datum
+            self.default_gw_vifs.pop(datum['instance_uuid'], None)
+
+
+# (network id, host) -> FixedIpTable
+_fixed_ip_tables = {}
+
+
+def _fixed_ip_table(network_ref, host=None):
+    key = (network_ref['id'], host)
+    if key not in _fixed_ip_tables:
+        _fixed_ip_tables[key] = FixedIpTable(network_ref['id'], host)
+    return _fixed_ip_tables[key]
+
+
+def fixed_ips_changed(network_id, addresses=None):
+    """Note fixed ips of a network were allocated or deallocated.
+
+    The next update of the network's dnsmasq files looks up only these
+    addresses again, or all of the network's if addresses is None.
+    """
+    for key, table in _fixed_ip_tables.items():
+        if key[0] == network_id:
+            table.changed(addresses)
+
+
+def _dhcp_fixed_ip_table(network_ref):
+    host = None
+    if network_ref['multi_host']:
+        host = CONF.host
+    return _fixed_ip_table(network_ref, host)
+
+
 def get_dhcp_leases(context, network_ref):
     """Return a network's hosts config in dnsmasq leasefile format."""
     hosts = []
@@ -742,12 +1049,7 @@ def get_dhcp_leases(context, network_ref):
 def get_dhcp_hosts(context, network_ref):
     """Get network's hosts config in dhcp-host format."""
     hosts = []
-    host = None
-    if network_ref['multi_host']:
-        host = CONF.host
-    for data in db.network_get_associated_fixed_ips(context,
-                                                    network_ref['id'],
-                                                    host=host):
+    for data in _dhcp_fixed_ip_table(network_ref).get(context):
         hosts.append(_host_dhcp(data))
     return '\n'.join(hosts)
 
@@ -755,8 +1057,7 @@ def get_dhcp_hosts(context, network_ref):
 def get_dns_hosts(context, network_ref):
     """Get network's DNS hosts in hosts format."""
     hosts = []
-    for data in db.network_get_associated_fixed_ips(context,
-                                                    network_ref['id']):
+    for data in _fixed_ip_table(network_ref).get(context):
         hosts.append(_host_dns(data))
     return '\n'.join(hosts)
 
@@ -806,29 +1107,14 @@ def _remove_dhcp_mangle_rule(dev):
 def get_dhcp_opts(context, network_ref):
     """Get network's hosts config in dhcp-opts format."""
     hosts = []
-    host = None
-    if network_ref['multi_host']:
-        host = CONF.host
-    data = db.network_get_associated_fixed_ips(context,
-                                               network_ref['id'],
-                                               host=host)
-
-    if data:
-        instance_set = set([datum['instance_uuid'] for datum in data])
-        default_gw_vif = {}
-        for instance_uuid in instance_set:
-            vifs = db.virtual_interface_get_by_instance(context,
-                                                        instance_uuid)
-            if vifs:
-                #offer a default gateway to the first virtual interface
-                default_gw_vif[instance_uuid] = vifs[0]['id']
-
-        for datum in data:
-            instance_uuid = datum['instance_uuid']
-            if instance_uuid in default_gw_vif:
-                # we don't want default gateway for this fixed ip
-                if default_gw_vif[instance_uuid] != datum['vif_id']:
-                    hosts.append(_host_dhcp_opts(datum))
+    table = _dhcp_fixed_ip_table(network_ref)
+    for datum in table.get(context):
+        #offer a default gateway to the first virtual interface
+        default_gw_vif = table.default_gw_vif(context,
+                                              datum['instance_uuid'])
+        if default_gw_vif is not None and default_gw_vif != datum['vif_id']:
+            # we don't want default gateway for this fixed ip
+            hosts.append(_host_dhcp_opts(datum))
     return '\n'.join(hosts)
 
 
@@ -838,14 +1124,16 @@ def release_dhcp(dev, address, mac_address):
 
 def update_dhcp(context, dev, network_ref):
     conffile = _dhcp_file(dev, 'conf')
-    write_to_file(conffile, get_dhcp_hosts(context, network_ref))
-    restart_dhcp(context, dev, network_ref)
+    changed = _write_if_changed(conffile,
+                                get_dhcp_hosts(context, network_ref))
+    restart_dhcp(context, dev, network_ref, files_changed=changed)
 
 
 def update_dns(context, dev, network_ref):
     hostsfile = _dhcp_file(dev, 'hosts')
-    write_to_file(hostsfile, get_dns_hosts(context, network_ref))
-    restart_dhcp(context, dev, network_ref)
+    changed = _write_if_changed(hostsfile,
+                                get_dns_hosts(context, network_ref))
+    restart_dhcp(context, dev, network_ref, files_changed=changed)
 
 
 def update_dhcp_hostfile_with_text(dev, hosts_text):
@@ -872,20 +1160,21 @@ def kill_dhcp(dev):
 #           configuration options (like dchp-range, vlan, ...)
 #           aren't reloaded.
 @lockutils.synchronized('dnsmasq_start', 'nova-')
-def restart_dhcp(context, dev, network_ref):
+def restart_dhcp(context, dev, network_ref, files_changed=True):
     """(Re)starts a dnsmasq server for a given network.
 
     If a dnsmasq instance is already running then send a HUP
     signal causing it to reload, otherwise spawn a new instance.
+    A running dnsmasq is not signalled when files_changed is False
+    and the opts file did not change either.
 
     """
     conffile = _dhcp_file(dev, 'conf')
 
     if CONF.use_single_default_gateway:
-        # NOTE(vish): this will have serious performance implications if we
-        #             are not in multi_host mode.
         optsfile = _dhcp_file(dev, 'opts')
-        write_to_file(optsfile, get_dhcp_opts(context, network_ref))
+        if _write_if_changed(optsfile, get_dhcp_opts(context, network_ref)):
+            files_changed = True
         os.chmod(optsfile, 0644)
 
     if network_ref['multi_host']:
@@ -904,7 +1193,8 @@ def restart_dhcp(context, dev, network_ref):
         # of the file itself
         if conffile.split('/')[-1] in out:
             try:
-                _execute('kill', '-HUP', pid, run_as_root=True)
+                if files_changed:
+                    _execute('kill', '-HUP', pid, run_as_root=True)
                 _add_dnsmasq_accept_rules(dev)
                 return
             except Exception as exc:  # pylint: disable=W0703
@@ -1613,3 +1903,5 @@ class QuantumLinuxBridgeInterfaceDriver(LinuxNetInterfaceDriver):
         return bridge
 
 iptables_manager = IptablesManager()
+
+ipset_manager = IpsetManager()
@@ -1474,6 +1474,8 @@ class NetworkManager(manager.SchedulerDependentManager):
             self.instance_dns_manager.create_entry(uuid, address,
                                                    "A",
                                                    self.instance_dns_domain)
+        if address:
+            self.driver.fixed_ips_changed(network['id'], [address])
         self._setup_network_on_host(context, network)
         return address
 
@@ -1499,6 +1501,7 @@ class NetworkManager(manager.SchedulerDependentManager):
         self.db.fixed_ip_update(context, address,
                                 {'allocated': False,
                                  'virtual_interface_id': None})
+        self.driver.fixed_ips_changed(fixed_ip_ref['network_id'], [address])
 
         if teardown:
             network = self._get_network_by_id(context,
@@ -1853,6 +1856,9 @@ class NetworkManager(manager.SchedulerDependentManager):
             if self.host == host or host is None:
                 # at this point i am the correct host, or host doesn't
                 # matter -> FlatManager
+                self.driver.fixed_ips_changed(
+                    network['id'],
+                    [fixed_ip['address'] for fixed_ip in fixed_ips])
                 call_func(context, network)
             else:
                 # i'm not the right host, run call on correct host
@@ -1871,6 +1877,7 @@ class NetworkManager(manager.SchedulerDependentManager):
 
         # subcall from original setup_networks_on_host
         network = self.db.network_get(context, network_id)
+        self.driver.fixed_ips_changed(network_id)
         call_func(context, network)
 
     def _setup_network_on_host(self, context, network):
@@ -1977,6 +1984,7 @@ class NetworkManager(manager.SchedulerDependentManager):
         networks = self.db.network_get_all_by_host(context, self.host)
         for network in networks:
             dev = self.driver.get_dev(network)
+            self.driver.fixed_ips_changed(network['id'])
             self.driver.update_dns(context, dev, network)
 
     def update_dns(self, context, network_ids):
@@ -1992,6 +2000,7 @@ class NetworkManager(manager.SchedulerDependentManager):
             for host_network in host_networks:
                 if host_network['id'] == network_id:
                     dev = self.driver.get_dev(network)
+                    self.driver.fixed_ips_changed(network_id)
                     self.driver.update_dns(context, dev, network)
 
 
@@ -2245,6 +2254,7 @@ class VlanManager(RPCAllocateFixedIP, FloatingIP, NetworkManager):
                                                    "A",
                                                    self.instance_dns_domain)
 
+        self.driver.fixed_ips_changed(network['id'], [address])
         self._setup_network_on_host(context, network)
         return address
 
@@ -17,7 +17,9 @@
 
 """Policy Engine For Nova."""
 
+import datetime
 import os.path
+import re
 
 from nova import exception
 from nova.openstack.common import cfg
@@ -40,6 +42,8 @@ CONF.register_opts(policy_opts)
 _POLICY_PATH = None
 _POLICY_CACHE = {}
 
+_MISSING = object()
+
 
 def reset():
     global _POLICY_PATH
@@ -64,7 +68,30 @@ def init():
 
 def _set_rules(data):
     default_rule = CONF.policy_default_rule
-    policy.set_rules(policy.Rules.load_json(data, default_rule))
+    policy.set_rules(Rules.load_json(data, default_rule))
+
+
+def _get_rules():
+    """Return the rules in use for policy checks."""
+    # NOTE: openstack.common.policy has no accessor for them
+    return policy._rules
+
+
+def _check(action, target, credentials):
+    """Like policy.check(), through the compiled rule if the rules in
+    use are compiled.
+    """
+    rules = _get_rules()
+    if not isinstance(rules, Rules):
+        return policy.check(action, target, credentials)
+    if not rules:
+        # No rules to reference means we're going to fail closed
+        return False
+    try:
+        return rules.compiled(action)(target, credentials)
+    except KeyError:
+        # If the rule doesn't exist, fail closed
+        return False
 
 
 def enforce(context, action, target, do_raise=True):
@@ -93,12 +120,72 @@ def enforce(context, action, target, do_raise=True):
 
     credentials = context.to_dict()
 
-    # Add the exception arguments if asked to do a raise
-    extra = {}
-    if do_raise:
-        extra.update(exc=exception.PolicyNotAuthorized, action=action)
+    decisions = _cached_decisions(context)
+    key = _decision_key(action, target, credentials)
+    if key is not None and key in decisions:
+        result = decisions[key]
+    else:
+        result = _check(action, target, credentials)
+        if key is not None:
+            decisions[key] = result
+
+    if do_raise and result is False:
+        raise exception.PolicyNotAuthorized(action=action)
+
+    return result
 
-    return policy.check(action, target, credentials, **extra)
+
+def _cached_decisions(context):
+    """Return the policy decisions cached in context.
+
+    The decisions are for the rules in use when they were made, they are
+    dropped when other rules are loaded.
+    """
+    rules = _get_rules()
+    cached = getattr(context, '_policy_decisions', None)
+    if cached is None or cached[0] is not rules:
+        cached = (rules, {})
+        context._policy_decisions = cached
+    return cached[1]
+
+
+def _freeze(value):
+    """Return a hashable copy of value, or raise TypeError."""
+    if value is _MISSING:
+        return value
+    elif isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.iteritems()))
+    elif isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    elif value is None or isinstance(value, (basestring, int, long, float,
+                                             datetime.datetime)):
+        return value
+    raise TypeError(value)
+
+
+def _frozen_inputs(values, keys):
+    if keys is None:
+        return _freeze(values)
+    return tuple((key, _freeze(values.get(key, _MISSING)))
+                 for key in sorted(keys))
+
+
+def _decision_key(action, target, credentials):
+    """Return what the decision for action depends on, in a hashable
+    form, or None if it can't be told.
+    """
+    rules = _get_rules()
+    if not isinstance(rules, Rules) or not isinstance(target, dict):
+        return None
+    try:
+        target_keys, cred_keys = rules.inputs(action)
+    except KeyError:
+        return None
+    try:
+        return (action, _frozen_inputs(target, target_keys),
+                _frozen_inputs(credentials, cred_keys))
+    except TypeError:
+        return None
 
 
 def check_is_admin(roles):
@@ -110,7 +197,7 @@ def check_is_admin(roles):
     target = {}
     credentials = {'roles': roles}
 
-    return policy.check('context_is_admin', target, credentials)
+    return _check('context_is_admin', target, credentials)
 
 
 @policy.register('is_admin')
@@ -128,3 +215,295 @@ class IsAdminCheck(policy.Check):
         """Determine whether is_admin matches the requested value."""
 
         return creds['is_admin'] == self.expected
+
+
+class Rules(policy.Rules):
+    """Policy rules which are compiled into plain functions.
+
+    A compiled rule evaluates the same as its Check tree, without
+    walking the tree: nested and/or checks are flattened, rule
+    references are inlined, and role and generic matches are prepared
+    once.  Checks that can't be compiled, like http checks, are called
+    as they are.  Changing the rules drops what was compiled.
+    """
+
+    @classmethod
+    def load_json(cls, data, default_rule=None):
+        """Load the rules from JSON data and compile them."""
+        rules = super(Rules, cls).load_json(data, default_rule)
+        for name in rules:
+            rules.compiled(name)
+        return rules
+
+    def __init__(self, rules=None, default_rule=None):
+        super(Rules, self).__init__(rules, default_rule)
+        self._reset()
+
+    def _reset(self):
+        self._compiled = {}
+        self._inputs = {}
+        self._compiling = set()
+
+    def __setitem__(self, key, value):
+        super(Rules, self).__setitem__(key, value)
+        self._reset()
+
+    def __delitem__(self, key):
+        super(Rules, self).__delitem__(key)
+        self._reset()
+
+    def compiled(self, name):
+        """Return the named rule compiled into a function of the target
+        and credentials.  Raises KeyError if there is no such rule.
+        """
+        try:
+            return self._compiled[name]
+        except KeyError:
+            pass
+
+        rule = self[name]
+        if name in self._compiling:
+            # The rule refers to itself; leave the reference to the tree
+            return rule
+
+        self._compiling.add(name)
+        try:
+            func = _compile(rule, self)
+        finally:
+            self._compiling.discard(name)
+        self._compiled[name] = func
+        return func
+
+    def inputs(self, name):
+        """Return the keys of the target and of the credentials the named
+        rule depends on, as a pair of frozensets.  Either is None if the
+        rule may depend on any key.  Raises KeyError if there is no such
+        rule.
+        """
+        try:
+            return self._inputs[name]
+        except KeyError:
+            pass
+
+        rule = self[name]
+        if name in self._compiling:
+            return None, None
+
+        self._compiling.add(name)
+        try:
+            inputs = _inputs(rule, self)
+        finally:
+            self._compiling.discard(name)
+        self._inputs[name] = inputs
+        return inputs
+
+
+_NO_KEYS = frozenset()
+
+
+def _accept(target, creds):
+    return True
+
+
+def _reject(target, creds):
+    return False
+
+
+def _flatten(check):
+    """Return the checks of an and/or check, with those of the nested
+    checks of the same type in their place.
+    """
+    checks = []
+    for rule in check.rules:
+        if type(rule) is type(check):
+            checks.extend(_flatten(rule))
+        else:
+            checks.append(rule)
+    return checks
+
+
+def _union_inputs(checks, rules):
+    target_keys = cred_keys = _NO_KEYS
+    for check in checks:
+        check_target_keys, check_cred_keys = _inputs(check, rules)
+        if target_keys is not None:
+            if check_target_keys is None:
+                target_keys = None
+            else:
+                target_keys = target_keys | check_target_keys
+        if cred_keys is not None:
+            if check_cred_keys is None:
+                cred_keys = None
+            else:
+                cred_keys = cred_keys | check_cred_keys
+    return target_keys, cred_keys
+
+
+def _single_key_match(match):
+    """Return key if match is exactly %(key)s, None otherwise."""
+    m = re.match(r'^%\((\w+)\)s$', match)
+    return m and m.group(1)
+
+
+def _compile_false(check, rules):
+    return _reject
+
+
+def _compile_true(check, rules):
+    return _accept
+
+
+def _compile_not(check, rules):
+    rule = _compile(check.rule, rules)
+
+    def not_check(target, creds):
+        return not rule(target, creds)
+
+    return not_check
+
+
+def _compile_and(check, rules):
+    checks = tuple(_compile(rule, rules) for rule in _flatten(check))
+
+    def and_check(target, creds):
+        for rule in checks:
+            if not rule(target, creds):
+                return False
+        return True
+
+    return and_check
+
+
+def _compile_or(check, rules):
+    checks = tuple(_compile(rule, rules) for rule in _flatten(check))
+
+    def or_check(target, creds):
+        for rule in checks:
+            if rule(target, creds):
+                return True
+        return False
+
+    return or_check
+
+
+def _compile_rule(check, rules):
+    try:
+        return rules.compiled(check.match)
+    except KeyError:
+        # We don't have any matching rule; fail closed
+        return _reject
+
+
+def _compile_role(check, rules):
+    role = check.match.lower()
+
+    def role_check(target, creds):
+        return role in [x.lower() for x in creds['roles']]
+
+    return role_check
+
+
+def _compile_generic(check, rules):
+    kind = check.kind
+    if '%' not in check.match:
+        match = check.match
+
+        def generic_check(target, creds):
+            if kind in creds:
+                return match == unicode(creds[kind])
+            return False
+
+        return generic_check
+
+    # NOTE: matches of a single target key, like tenant:%(tenant_id)s,
+    #       are interpolated without a format string
+    key = _single_key_match(check.match)
+    if key is None:
+        return check
+
+    def key_check(target, creds):
+        match = '%s' % (target[key],)
+        if kind in creds:
+            return match == unicode(creds[kind])
+        return False
+
+    return key_check
+
+
+def _compile_is_admin(check, rules):
+    expected = check.expected
+
+    def is_admin_check(target, creds):
+        return creds['is_admin'] == expected
+
+    return is_admin_check
+
+
+def _inputs_none(check, rules):
+    return _NO_KEYS, _NO_KEYS
+
+
+def _inputs_not(check, rules):
+    return _inputs(check.rule, rules)
+
+
+def _inputs_and_or(check, rules):
+    return _union_inputs(check.rules, rules)
+
+
+def _inputs_rule(check, rules):
+    try:
+        return rules.inputs(check.match)
+    except KeyError:
+        return _NO_KEYS, _NO_KEYS
+
+
+def _inputs_role(check, rules):
+    return _NO_KEYS, frozenset(['roles'])
+
+
+def _inputs_generic(check, rules):
+    if '%' not in check.match:
+        return _NO_KEYS, frozenset([check.kind])
+    key = _single_key_match(check.match)
+    if key is None:
+        return None, frozenset([check.kind])
+    return frozenset([key]), frozenset([check.kind])
+
+
+def _inputs_is_admin(check, rules):
+    return _NO_KEYS, frozenset(['is_admin'])
+
+
+# How checks are compiled and what they read, by exact type of check.
+# The checks of other types, like http checks, are called as they are and
+# may read any key.
+_COMPILERS = {
+    policy.FalseCheck: (_compile_false, _inputs_none),
+    policy.TrueCheck: (_compile_true, _inputs_none),
+    policy.NotCheck: (_compile_not, _inputs_not),
+    policy.AndCheck: (_compile_and, _inputs_and_or),
+    policy.OrCheck: (_compile_or, _inputs_and_or),
+    policy.RuleCheck: (_compile_rule, _inputs_rule),
+    policy.RoleCheck: (_compile_role, _inputs_role),
+    policy.GenericCheck: (_compile_generic, _inputs_generic),
+    IsAdminCheck: (_compile_is_admin, _inputs_is_admin),
+}
+
+
+def _compile(check, rules):
+    """Compile a check, or return it if it can't be compiled."""
+    try:
+        compile_check = _COMPILERS[type(check)][0]
+    except KeyError:
+        return check
+    return compile_check(check, rules)
+
+
+def _inputs(check, rules):
+    """Return the keys of the target and credentials check depends on."""
+    try:
+        find_inputs = _COMPILERS[type(check)][1]
+    except KeyError:
+        return None, None
+    return find_inputs(check, rules)
@@ -18,8 +18,13 @@
 
 """Quotas for instances, and floating ips."""
 
+import collections
 import datetime
+import time
 
+import eventlet
+
+from nova import context as nova_context
 from nova import db
 from nova import exception
 from nova.openstack.common import cfg
@@ -76,12 +81,88 @@ quota_opts = [
     cfg.StrOpt('quota_driver',
                default='nova.quota.DbQuotaDriver',
                help='default driver to use for quota checks'),
+    cfg.BoolOpt('quota_conditional_reservations',
+                default=True,
+                help='reserve quota with conditional updates of the usages '
+                     'being reserved instead of locking all of the '
+                     'project\'s usages'),
+    cfg.BoolOpt('quota_usage_refresh_async',
+                default=True,
+                help='run the usage refreshes asked for by until_refresh '
+                     'and max_age in the background rather than while '
+                     'making the reservation'),
+    cfg.IntOpt('quota_stats_log_interval',
+               default=60,
+               help='number of seconds between debug logs of the quota '
+                    'reservation counters, 0 to disable them'),
     ]
 
 CONF = cfg.CONF
 CONF.register_opts(quota_opts)
 
 
+class QuotaUsageReconciler(object):
+    """Refreshes quota usages in a background greenthread.
+
+    Refresh requests are queued per project and merged with any still
+    waiting for that project, so a burst of reservations leads to a
+    single refresh instead of one per reservation.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._resources = {}
+        self._running = False
+        self._stats = collections.defaultdict(int)
+
+    def request_refresh(self, resources, project_id, keys):
+        """Queue a refresh of the usages of keys for a project."""
+        self._stats['requested'] += 1
+        if project_id in self._pending:
+            self._stats['coalesced'] += 1
+        self._pending.setdefault(project_id, set()).update(keys)
+        self._resources.update(resources)
+        if not self._running:
+            self._running = True
+            eventlet.spawn_n(self._run)
+
+    def _run(self):
+        context = nova_context.get_admin_context()
+        try:
+            while self._pending:
+                project_id, keys = self._pending.popitem()
+                self._refresh(context, project_id, keys)
+        finally:
+            self._running = False
+
+    def _refresh(self, context, project_id, keys):
+        try:
+            usages = db.quota_usage_refresh(context, self._resources,
+                                            sorted(keys), CONF.until_refresh,
+                                            CONF.max_age,
+                                            project_id=project_id)
+        except Exception:
+            self._stats['failed'] += 1
+            LOG.exception(_("Failed to refresh quota usages for project "
+                            "%(project_id)s") % locals())
+            return
+        if usages:
+            self._stats['refreshed'] += 1
+            LOG.debug(_("Refreshed quota usages for project %(project_id)s: "
+                        "%(usages)s") % locals())
+
+    def get_stats(self):
+        """Return counters of the refreshes requested and made.
+
+        coalesced counts the requests merged into one already waiting
+        for the same project, and pending the projects still waiting.
+        """
+        stats = dict(requested=0, coalesced=0, refreshed=0, failed=0)
+        stats.update(self._stats)
+        stats['pending'] = len(self._pending)
+        return stats
+
+
 class DbQuotaDriver(object):
     """
     Driver to perform necessary checks to enforce quotas and obtain
@@ -89,6 +170,12 @@ class DbQuotaDriver(object):
     database.
     """
 
+    def __init__(self):
+        self._stats = collections.defaultdict(int)
+        self._over_quota_resources = collections.defaultdict(int)
+        self._stats_logged_at = time.time()
+        self._reconciler = QuotaUsageReconciler()
+
     def get_by_project(self, context, project_id, resource):
         """Get a specific quota by project."""
 
@@ -320,14 +407,7 @@ class DbQuotaDriver(object):
         """
 
         # Set up the reservation expiration
-        if expire is None:
-            expire = CONF.reservation_expire
-        if isinstance(expire, (int, long)):
-            expire = datetime.timedelta(seconds=expire)
-        if isinstance(expire, datetime.timedelta):
-            expire = timeutils.utcnow() + expire
-        if not isinstance(expire, datetime.datetime):
-            raise exception.InvalidReservationExpiration(expire=expire)
+        expire = self._get_expire(expire)
 
         # If project_id is None, then we use the project_id in context
         if project_id is None:
@@ -345,10 +425,119 @@ class DbQuotaDriver(object):
         #            which means access to the session.  Since the
         #            session isn't available outside the DBAPI, we
         #            have to do the work there.
+        if CONF.quota_conditional_reservations:
+            return self._reserve_batch(context, resources, quotas,
+                                       [deltas], expire, project_id)[0]
         return db.quota_reserve(context, resources, quotas, deltas, expire,
                                 CONF.until_refresh, CONF.max_age,
                                 project_id=project_id)
 
+    def reserve_batch(self, context, resources, batch, expire=None,
+                      project_id=None):
+        """Check quotas and reserve resources for several requests.
+
+        Works like reserve(), but takes a list of deltas dictionaries
+        and reserves all of them in a single database transaction.  If
+        their combined deltas are over quota, an OverQuota exception is
+        raised and nothing is reserved.  Otherwise, the method returns
+        a list with the reservation UUIDs of each request, in order.
+
+        :param context: The request context, for access checks.
+        :param resources: A dictionary of the registered resources.
+        :param batch: A list of dictionaries of proposed delta changes.
+        :param expire: An optional expiration time for the
+                       reservations, as taken by reserve().
+        :param project_id: Specify the project_id if current context
+                           is admin and admin wants to impact on
+                           common user's tenant.
+        """
+        expire = self._get_expire(expire)
+        if project_id is None:
+            project_id = context.project_id
+
+        keys = set()
+        for deltas in batch:
+            keys.update(deltas.keys())
+        quotas = self._get_quotas(context, resources, keys,
+                                  has_sync=True, project_id=project_id)
+
+        return self._reserve_batch(context, resources, quotas, batch,
+                                   expire, project_id)
+
+    def _reserve_batch(self, context, resources, quotas, batch, expire,
+                       project_id):
+        # NOTE: With deferred refreshes the reservation never runs the
+        #       sync routines itself (other than for usages which don't
+        #       exist yet), the reconciler looks at the usages once the
+        #       reservation is made.
+        defer_refresh = (CONF.quota_usage_refresh_async and
+                         bool(CONF.until_refresh or CONF.max_age))
+        start = time.time()
+        try:
+            return db.quota_reserve_batch(context, resources, quotas, batch,
+                                          expire, CONF.until_refresh,
+                                          CONF.max_age,
+                                          project_id=project_id,
+                                          defer_refresh=defer_refresh,
+                                          stats=self._stats)
+        except exception.OverQuota as exc:
+            self._stats['over_quota'] += 1
+            for resource in exc.kwargs['overs']:
+                self._over_quota_resources[resource] += 1
+            raise
+        finally:
+            if defer_refresh:
+                self._reconciler.request_refresh(resources, project_id,
+                                                 quotas.keys())
+            elapsed = time.time() - start
+            self._stats['reserve_calls'] += 1
+            self._stats['reserve_requests'] += len(batch)
+            self._stats['reserve_time'] += elapsed
+            self._stats['reserve_time_max'] = max(
+                    self._stats['reserve_time_max'], elapsed)
+            self._log_stats()
+
+    def _log_stats(self):
+        interval = CONF.quota_stats_log_interval
+        now = time.time()
+        if interval > 0 and now - self._stats_logged_at >= interval:
+            self._stats_logged_at = now
+            LOG.debug(_("Quota reservation stats: %s") % self.get_stats())
+
+    def _get_expire(self, expire):
+        if expire is None:
+            expire = CONF.reservation_expire
+        if isinstance(expire, (int, long)):
+            expire = datetime.timedelta(seconds=expire)
+        if isinstance(expire, datetime.timedelta):
+            expire = timeutils.utcnow() + expire
+        if not isinstance(expire, datetime.datetime):
+            raise exception.InvalidReservationExpiration(expire=expire)
+        return expire
+
+    def get_stats(self):
+        """Return counters describing reservation contention.
+
+        reserve_calls and reserve_requests count the transactions made
+        and the requests reserved through them, over_quota the
+        transactions refused, and over_quota_resources how often each
+        resource was the one refused.  rows_updated and update_misses
+        count the conditional usage updates which matched and missed,
+        rows_handed_back the updates undone after a miss, and
+        rows_refreshed the usages synced during reservations.
+        reserve_time and reserve_time_max are the total and longest
+        seconds spent in reservation transactions.  usage_refresh holds
+        the counters of the background usage refreshes.
+        """
+        stats = dict(reserve_calls=0, reserve_requests=0, over_quota=0,
+                     rows_updated=0, update_misses=0, rows_handed_back=0,
+                     rows_refreshed=0, reserve_time=0.0,
+                     reserve_time_max=0.0)
+        stats.update(self._stats)
+        stats['over_quota_resources'] = dict(self._over_quota_resources)
+        stats['usage_refresh'] = self._reconciler.get_stats()
+        return stats
+
     def commit(self, context, reservations, project_id=None):
         """Commit reservations.
 
@@ -564,6 +753,25 @@ class NoopQuotaDriver(object):
         """
         return []
 
+    def reserve_batch(self, context, resources, batch, expire=None,
+                      project_id=None):
+        """Check quotas and reserve resources for several requests.
+
+        :param context: The request context, for access checks.
+        :param resources: A dictionary of the registered resources.
+        :param batch: A list of dictionaries of proposed delta changes.
+        :param expire: An optional expiration time for the
+                       reservations, as taken by reserve().
+        :param project_id: Specify the project_id if current context
+                           is admin and admin wants to impact on
+                           common user's tenant.
+        """
+        return [[] for deltas in batch]
+
+    def get_stats(self):
+        """Return counters describing reservation contention."""
+        return {}
+
     def commit(self, context, reservations):
         """Commit reservations.
 
@@ -945,6 +1153,32 @@ class QuotaEngine(object):
 
         return reservations
 
+    def reserve_batch(self, context, batch, expire=None, project_id=None):
+        """Check quotas and reserve resources for several requests.
+
+        Works like reserve(), but takes a list of dictionaries of
+        deltas and reserves them all at once: either every request
+        fits within the quotas and a list with the reservation UUIDs
+        of each request is returned, or an OverQuota exception is
+        raised and nothing is reserved.
+
+        :param context: The request context, for access checks.
+        :param batch: A list of dictionaries of proposed delta changes.
+        :param expire: An optional expiration time for the
+                       reservations, as taken by reserve().
+        :param project_id: Specify the project_id if current context
+                           is admin and admin wants to impact on
+                           common user's tenant.
+        """
+
+        reservations = self._driver.reserve_batch(context, self._resources,
+                                                  batch, expire=expire,
+                                                  project_id=project_id)
+
+        LOG.debug(_("Created reservations %(reservations)s") % locals())
+
+        return reservations
+
     def commit(self, context, reservations, project_id=None):
         """Commit reservations.
 
@@ -1028,6 +1262,11 @@ class QuotaEngine(object):
 
         self._driver.expire(context)
 
+    def get_stats(self):
+        """Return the driver's reservation contention counters."""
+
+        return self._driver.get_stats()
+
     @property
     def resources(self):
         return sorted(self._resources.keys())
@@ -0,0 +1,104 @@
+# Copyright (c) 2013 OpenStack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Columnar view of host states for vectorized filtering and weighing.
+
+Filters and weighers may implement filter_columns() and weigh_columns()
+to evaluate every host at once using NumPy arrays instead of one host at
+a time.  Those which don't are run through their per-object methods.
+"""
+
+from nova.openstack.common import cfg
+from nova.openstack.common import log as logging
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+columns_opts = [
+    cfg.BoolOpt('scheduler_columnar_evaluation',
+                default=False,
+                help='Evaluate the filters and weighers that support it '
+                     'over arrays of host state fields rather than one '
+                     'host at a time.  Requires NumPy.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(columns_opts)
+
+LOG = logging.getLogger(__name__)
+
+
+def enabled():
+    """Return True if columnar evaluation is configured and available."""
+    if not CONF.scheduler_columnar_evaluation:
+        return False
+    if numpy is None:
+        LOG.warn(_("scheduler_columnar_evaluation is set but NumPy could "
+                   "not be imported, evaluating hosts one at a time."))
+        return False
+    return True
+
+
+class HostColumns(object):
+    """Numeric HostState fields stored as parallel NumPy arrays.
+
+    hosts[i] is the HostState whose values are at index i of every array.
+    """
+
+    fields = ('free_ram_mb', 'total_usable_ram_mb', 'free_disk_mb',
+              'total_usable_disk_gb', 'vcpus_total', 'vcpus_used',
+              'num_io_ops', 'num_instances')
+
+    def __init__(self, hosts, arrays=None):
+        self.hosts = list(hosts)
+        if arrays is None:
+            arrays = dict((field, numpy.array(
+                                [getattr(host, field, 0) or 0
+                                 for host in self.hosts],
+                                dtype=numpy.float64))
+                          for field in self.fields)
+        self.arrays = arrays
+
+    def __len__(self):
+        return len(self.hosts)
+
+    def __getitem__(self, field):
+        return self.arrays[field]
+
+    def full(self, value):
+        """Return an array of len(self) elements set to value."""
+        return numpy.repeat(value, len(self.hosts))
+
+    def select(self, mask):
+        """Return the HostColumns for the hosts where mask is True."""
+        indexes = numpy.flatnonzero(mask)
+        return HostColumns([self.hosts[i] for i in indexes],
+                           dict((field, array[indexes])
+                                for field, array in self.arrays.iteritems()))
+
+    def select_hosts(self, hosts):
+        """Return the HostColumns for the given subset of self.hosts."""
+        wanted = set(id(host) for host in hosts)
+        return self.select(numpy.array([id(host) in wanted
+                                        for host in self.hosts],
+                                       dtype=bool))
+
+    def set_limits(self, key, mask, values):
+        """Set limits[key] to values[i] for every host where mask is True."""
+        for i in numpy.flatnonzero(mask):
+            self.hosts[i].limits[key] = float(values[i])
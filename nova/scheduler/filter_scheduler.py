@@ -19,6 +19,8 @@ You can customize this scheduler by specifying your own Host Filters and
 Weighing Functions.
 """
 
+import heapq
+
 from nova import exception
 from nova.openstack.common import cfg
 from nova.openstack.common import log as logging
@@ -26,7 +28,18 @@ from nova.openstack.common.notifier import api as notifier
 from nova.scheduler import driver
 from nova.scheduler import scheduler_options
 
+filter_scheduler_opts = [
+    cfg.BoolOpt('scheduler_incremental_selection',
+                default=True,
+                help='When scheduling several instances in one request, '
+                     'filter and weigh all hosts only once and afterwards '
+                     'only re-evaluate the host chosen for the previous '
+                     'instance.  Disable this if filters or weighers judge '
+                     'hosts relative to each other.'),
+]
+
 CONF = cfg.CONF
+CONF.register_opts(filter_scheduler_opts)
 LOG = logging.getLogger(__name__)
 
 
@@ -276,11 +289,15 @@ class FilterScheduler(driver.Scheduler):
         # are being scanned in a filter or weighing function.
         hosts = self.host_manager.get_all_host_states(elevated)
 
-        selected_hosts = []
         if instance_uuids:
             num_instances = len(instance_uuids)
         else:
             num_instances = request_spec.get('num_instances', 1)
+        if CONF.scheduler_incremental_selection:
+            return self._select_hosts(hosts, filter_properties,
+                                      instance_properties, num_instances)
+
+        selected_hosts = []
         for num in xrange(num_instances):
             # Filter local hosts based on requirements ...
             hosts = self.host_manager.get_filtered_hosts(hosts,
@@ -300,3 +317,46 @@ class FilterScheduler(driver.Scheduler):
             # will change for the next instance.
             best_host.obj.consume_from_instance(instance_properties)
         return selected_hosts
+
+    def _select_hosts(self, hosts, filter_properties, instance_properties,
+                      num_instances):
+        """Returns up to num_instances weighed hosts, best first.
+
+        All hosts are filtered and weighed once and kept in a priority
+        queue.  Choosing a host only consumes resources on that host, so
+        only it is filtered and weighed again before going back into the
+        queue.  Ties are broken by the original host order, which gives the
+        same placements as filtering and weighing every host for each
+        instance when filters and weighers judge each host on its own.
+        """
+        hosts = self.host_manager.get_filtered_hosts(hosts,
+                filter_properties)
+        if not hosts:
+            return []
+
+        LOG.debug(_("Filtered %(hosts)s") % locals())
+
+        host_order = dict((id(host), index)
+                          for index, host in enumerate(hosts))
+        queue = [(-weighed_host.weight, host_order[id(weighed_host.obj)],
+                  weighed_host)
+                 for weighed_host in self.host_manager.get_weighed_hosts(
+                         hosts, filter_properties)]
+        heapq.heapify(queue)
+
+        selected_hosts = []
+        while queue and len(selected_hosts) < num_instances:
+            _weight, index, best_host = heapq.heappop(queue)
+            LOG.debug(_("Choosing host %(best_host)s") % locals())
+            selected_hosts.append(best_host)
+            # Now consume the resources so the filter/weights
+            # will change for the next instance.
+            host_state = best_host.obj
+            host_state.consume_from_instance(instance_properties)
+            if self.host_manager.get_filtered_hosts([host_state],
+                                                    filter_properties):
+                weighed_host = self.host_manager.get_weighed_hosts(
+                        [host_state], filter_properties)[0]
+                heapq.heappush(queue,
+                               (-weighed_host.weight, index, weighed_host))
+        return selected_hosts
@@ -19,6 +19,7 @@ Scheduler host filters
 
 from nova import filters
 from nova.openstack.common import log as logging
+from nova.scheduler import columns
 
 LOG = logging.getLogger(__name__)
 
@@ -40,6 +41,26 @@ class HostFilterHandler(filters.BaseFilterHandler):
     def __init__(self):
         super(HostFilterHandler, self).__init__(BaseHostFilter)
 
+    def get_filtered_objects(self, filter_classes, objs,
+            filter_properties):
+        if not columns.enabled():
+            return super(HostFilterHandler, self).get_filtered_objects(
+                    filter_classes, objs, filter_properties)
+
+        host_columns = columns.HostColumns(objs)
+        for filter_cls in filter_classes:
+            if not host_columns:
+                break
+            filter_obj = filter_cls()
+            mask = filter_obj.filter_columns(host_columns, filter_properties)
+            if mask is None:
+                passed = filter_obj.filter_all(host_columns.hosts,
+                                               filter_properties)
+                host_columns = host_columns.select_hosts(passed)
+            else:
+                host_columns = host_columns.select(mask)
+        return host_columns.hosts
+
 
 def all_filters():
     """Return a list of filter classes found in this directory.
@@ -53,3 +53,21 @@ class CoreFilter(filters.BaseHostFilter):
             host_state.limits['vcpu'] = vcpus_total
 
         return (vcpus_total - host_state.vcpus_used) >= instance_vcpus
+
+    def filter_columns(self, columns, filter_properties):
+        """Return True for hosts with sufficient CPU cores."""
+        instance_type = filter_properties.get('instance_type')
+        if not instance_type:
+            return columns.full(True)
+
+        # Fail safe for hosts without VCPU information
+        unknown = columns['vcpus_total'] == 0
+        if unknown.any():
+            LOG.warning(_("VCPUs not set; assuming CPU collection broken"))
+
+        instance_vcpus = instance_type['vcpus']
+        vcpus_total = columns['vcpus_total'] * CONF.cpu_allocation_ratio
+        columns.set_limits('vcpu', ~unknown & (vcpus_total > 0), vcpus_total)
+
+        return unknown | (
+                (vcpus_total - columns['vcpus_used']) >= instance_vcpus)
@@ -41,3 +41,6 @@ class IoOpsFilter(filters.BaseHostFilter):
             LOG.debug(_("%(host_state)s fails I/O ops check: Max IOs per host "
                         "is set to %(max_io_ops)s"), locals())
         return passes
+
+    def filter_columns(self, columns, filter_properties):
+        return columns['num_io_ops'] < CONF.max_io_ops_per_host
@@ -17,6 +17,7 @@
 Manage hosts in the current zone.
 """
 
+import datetime
 import UserDict
 
 from nova.compute import task_states
@@ -50,6 +51,22 @@ host_manager_opts = [
     cfg.ListOpt('scheduler_weight_classes',
                 default=['nova.scheduler.weights.all_weighers'],
                 help='Which weight class names to use for weighing hosts'),
+    cfg.IntOpt('scheduler_host_state_max_age',
+               default=0,
+               help='Number of seconds cached host states may be used '
+                    'without checking the database for updated compute '
+                    'nodes. 0 checks on every scheduling request.'),
+    cfg.IntOpt('scheduler_host_state_full_sync_interval',
+               default=600,
+               help='Number of seconds between full reloads of all compute '
+                    'nodes. In between, only compute nodes updated since '
+                    'the last sync are reloaded.'),
+    cfg.IntOpt('scheduler_host_state_sync_window',
+               default=10,
+               help='Number of seconds before the last sync that compute '
+                    'nodes and services are reloaded from, allowing for '
+                    'clock differences between hosts and rows committed '
+                    'some time after being stamped.'),
     ]
 
 CONF = cfg.CONF
@@ -90,6 +107,43 @@ class ReadOnlyDict(UserDict.IterableUserDict):
             raise TypeError
 
 
+class HostStats(object):
+    """Compute node stats rows decoded into typed counters.
+
+    The rows are scanned once, each key being dispatched on its prefix.
+    """
+
+    __slots__ = ('num_instances', 'num_io_ops', 'num_instances_by_project',
+                 'vm_states', 'task_states', 'num_instances_by_os_type')
+
+    # Stat key prefix and the attribute holding the counters it names
+    prefixes = (('num_proj_', 'num_instances_by_project'),
+                ('num_vm_', 'vm_states'),
+                ('num_task_', 'task_states'),
+                ('num_os_type_', 'num_instances_by_os_type'))
+
+    def __init__(self, stats):
+        self.num_instances = 0
+        self.num_io_ops = 0
+        self.num_instances_by_project = {}
+        self.vm_states = {}
+        self.task_states = {}
+        self.num_instances_by_os_type = {}
+
+        for stat in stats:
+            key = stat['key']
+            if key == 'num_instances':
+                self.num_instances = int(stat['value'])
+            elif key == 'io_workload':
+                self.num_io_ops = int(stat['value'])
+            else:
+                for prefix, attr in self.prefixes:
+                    if key.startswith(prefix):
+                        getattr(self, attr)[key[len(prefix):]] = int(
+                                stat['value'])
+                        break
+
+
 class HostState(object):
     """Mutable and immutable information tracked for a host.
     This is an attempt to remove the ad-hoc data structures
@@ -127,6 +181,9 @@ class HostState(object):
         self.limits = {}
 
         self.updated = None
+        # Stats rows last decoded, and what they were decoded into
+        self._stats_digest = None
+        self._stats = None
 
     def update_capabilities(self, capabilities=None, service=None):
         # Read-only capability dicts
@@ -139,7 +196,12 @@ class HostState(object):
         self.service = ReadOnlyDict(service)
 
     def update_from_compute_node(self, compute):
-        """Update information about a host from its compute_node info."""
+        """Update information about a host from its compute_node info.
+
+        Nothing is done if the compute_node info is older than what this
+        host state already reflects.  Info as old is applied again, as
+        updated_at may not tell apart two updates made in the same second.
+        """
         if (self.updated and compute['updated_at']
             and self.updated > compute['updated_at']):
             return
@@ -162,38 +224,18 @@ class HostState(object):
         self.updated = compute['updated_at']
 
         stats = compute.get('stats', [])
-        statmap = self._statmap(stats)
-
-        # Track number of instances on host
-        self.num_instances = int(statmap.get('num_instances', 0))
-
-        # Track number of instances by project_id
-        project_id_keys = [k for k in statmap.keys() if
-                k.startswith("num_proj_")]
-        for key in project_id_keys:
-            project_id = key[9:]
-            self.num_instances_by_project[project_id] = int(statmap[key])
-
-        # Track number of instances in certain vm_states
-        vm_state_keys = [k for k in statmap.keys() if k.startswith("num_vm_")]
-        for key in vm_state_keys:
-            vm_state = key[7:]
-            self.vm_states[vm_state] = int(statmap[key])
-
-        # Track number of instances in certain task_states
-        task_state_keys = [k for k in statmap.keys() if
-                k.startswith("num_task_")]
-        for key in task_state_keys:
-            task_state = key[9:]
-            self.task_states[task_state] = int(statmap[key])
-
-        # Track number of instances by host_type
-        os_keys = [k for k in statmap.keys() if k.startswith("num_os_type_")]
-        for key in os_keys:
-            os = key[12:]
-            self.num_instances_by_os_type[os] = int(statmap[key])
-
-        self.num_io_ops = int(statmap.get('io_workload', 0))
+        digest = tuple((stat['key'], stat['value']) for stat in stats)
+        if digest != self._stats_digest:
+            self._stats = HostStats(stats)
+            self._stats_digest = digest
+        stats = self._stats
+        # The counters are copied, as consume_from_instance() changes them
+        self.num_instances = stats.num_instances
+        self.num_io_ops = stats.num_io_ops
+        self.num_instances_by_project = dict(stats.num_instances_by_project)
+        self.vm_states = dict(stats.vm_states)
+        self.task_states = dict(stats.task_states)
+        self.num_instances_by_os_type = dict(stats.num_instances_by_os_type)
 
     def consume_from_instance(self, instance):
         """Incrementally update host state from an instance."""
@@ -240,9 +282,6 @@ class HostState(object):
                 task_states.IMAGE_BACKUP]:
             self.num_io_ops += 1
 
-    def _statmap(self, stats):
-        return dict((st['key'], st['value']) for st in stats)
-
     def __repr__(self):
         return ("(%s, %s) ram:%s disk:%s io_ops:%s instances:%s vm_type:%s" %
                 (self.host, self.nodename, self.free_ram_mb, self.free_disk_mb,
@@ -259,6 +298,12 @@ class HostManager(object):
         # { (host, hypervisor_hostname) : { <service> : { cap k : v }}}
         self.service_states = {}
         self.host_state_map = {}
+        # Bookkeeping for incremental refreshes of host_state_map
+        self.last_sync = None
+        self.last_full_sync = None
+        self.synced_at = None
+        # { (host, hypervisor_hostname) : (compute node id, updated_at) }
+        self.applied_compute_nodes = {}
         self.filter_handler = filters.HostFilterHandler()
         self.filter_classes = self.filter_handler.get_matching_classes(
                 CONF.scheduler_available_filters)
@@ -358,32 +403,117 @@ class HostManager(object):
         capab_copy["timestamp"] = timeutils.utcnow()  # Reported time
         self.service_states[state_key] = capab_copy
 
+    def _update_host_state(self, compute, stable_before):
+        """Creates or updates the HostState for a compute node row and
+        returns its state key, or None if the row has no service.
+
+        A row already applied is not applied again.  Rows are only known
+        to be applied once updated before stable_before, as updated_at may
+        not tell apart two updates made close together.
+        """
+        service = compute['service']
+        if not service:
+            LOG.warn(_("No service for compute ID %s") % compute['id'])
+            return None
+        host = service['host']
+        node = compute.get('hypervisor_hostname')
+        state_key = (host, node)
+        capabilities = self.service_states.get(state_key, None)
+        host_state = self.host_state_map.get(state_key)
+        if host_state:
+            host_state.update_capabilities(capabilities,
+                                           dict(service.iteritems()))
+        else:
+            host_state = self.host_state_cls(host, node,
+                    capabilities=capabilities,
+                    service=dict(service.iteritems()))
+            self.host_state_map[state_key] = host_state
+
+        applied = (compute['id'], compute.get('updated_at'))
+        if self.applied_compute_nodes.get(state_key) == applied:
+            return state_key
+        host_state.update_from_compute_node(compute)
+        updated_at = applied[1]
+        if updated_at and updated_at < stable_before:
+            self.applied_compute_nodes[state_key] = applied
+        else:
+            self.applied_compute_nodes.pop(state_key, None)
+        return state_key
+
+    def _sync_all_host_states(self, context):
+        """Reloads every compute node and drops host states for compute
+        nodes which no longer exist.
+        """
+        synced_at = timeutils.utcnow()
+        stable_before = synced_at - datetime.timedelta(
+                seconds=CONF.scheduler_host_state_sync_window)
+        seen = set()
+        for compute in db.compute_node_get_all(context):
+            state_key = self._update_host_state(compute, stable_before)
+            if state_key:
+                seen.add(state_key)
+        for state_key in self.host_state_map.keys():
+            if state_key not in seen:
+                del self.host_state_map[state_key]
+                self.applied_compute_nodes.pop(state_key, None)
+        self.synced_at = synced_at
+        self.last_full_sync = synced_at
+
+    def _sync_changed_host_states(self, context):
+        """Reloads only the compute nodes and services updated since the
+        last sync.
+
+        Rows updated up to scheduler_host_state_sync_window seconds before
+        the last sync started are reloaded too, as their updated_at comes
+        from another host's clock and is set before they are committed.
+        """
+        synced_at = timeutils.utcnow()
+        window = datetime.timedelta(
+                seconds=CONF.scheduler_host_state_sync_window)
+        updated_since = self.synced_at - window
+        updated = set()
+        for compute in db.compute_node_get_all(context,
+                updated_since=updated_since):
+            state_key = self._update_host_state(compute, synced_at - window)
+            if state_key:
+                updated.add(state_key)
+
+        # Service heartbeats are needed to tell whether a host is up
+        services = dict((service['id'], service)
+                        for service in db.service_get_all(context,
+                                updated_since=updated_since))
+        for state_key, host_state in self.host_state_map.iteritems():
+            if state_key in updated:
+                continue
+            service = services.get(host_state.service.get('id'))
+            if service is None:
+                service = host_state.service
+            host_state.update_capabilities(
+                    self.service_states.get(state_key, None),
+                    dict(service.iteritems()))
+        self.synced_at = synced_at
+
     def get_all_host_states(self, context):
         """Returns a list of HostStates that represents all the hosts
         the HostManager knows about. Also, each of the consumable resources
         in HostState are pre-populated and adjusted based on data in the db.
-        """
 
-        # Get resource usage across the available compute nodes:
-        compute_nodes = db.compute_node_get_all(context)
-        for compute in compute_nodes:
-            service = compute['service']
-            if not service:
-                LOG.warn(_("No service for compute ID %s") % compute['id'])
-                continue
-            host = service['host']
-            node = compute.get('hypervisor_hostname')
-            state_key = (host, node)
-            capabilities = self.service_states.get(state_key, None)
-            host_state = self.host_state_map.get(state_key)
-            if host_state:
-                host_state.update_capabilities(capabilities,
-                                               dict(service.iteritems()))
-            else:
-                host_state = self.host_state_cls(host, node,
-                        capabilities=capabilities,
-                        service=dict(service.iteritems()))
-                self.host_state_map[state_key] = host_state
-            host_state.update_from_compute_node(compute)
+        Host states are kept between calls.  They are reused as is for up
+        to scheduler_host_state_max_age seconds, after which only compute
+        nodes updated since the last sync are reloaded.  All compute nodes
+        are reloaded every scheduler_host_state_full_sync_interval seconds.
+        """
+        max_age = CONF.scheduler_host_state_max_age
+        if (max_age > 0 and self.last_sync is not None and
+                not timeutils.is_older_than(self.last_sync, max_age)):
+            return self.host_state_map.itervalues()
+
+        if (self.last_full_sync is None or timeutils.is_older_than(
+                self.last_full_sync,
+                CONF.scheduler_host_state_full_sync_interval)):
+            self._sync_all_host_states(context)
+        else:
+            self._sync_changed_host_states(context)
+        self.last_sync = timeutils.utcnow()
 
         return self.host_state_map.itervalues()
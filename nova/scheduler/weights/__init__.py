@@ -20,6 +20,7 @@ Scheduler host weights
 
 from nova.openstack.common import cfg
 from nova.openstack.common import log as logging
+from nova.scheduler import columns
 from nova.scheduler.weights import least_cost
 from nova import weights
 
@@ -49,6 +50,38 @@ class HostWeightHandler(weights.BaseWeightHandler):
     def __init__(self):
         super(HostWeightHandler, self).__init__(BaseHostWeigher)
 
+    def get_weighed_objects(self, weigher_classes, obj_list,
+            weighing_properties):
+        """Return a sorted (highest score first) list of WeighedHosts."""
+        if not columns.enabled():
+            return super(HostWeightHandler, self).get_weighed_objects(
+                    weigher_classes, obj_list, weighing_properties)
+
+        if not obj_list:
+            return []
+
+        host_columns = columns.HostColumns(obj_list)
+        host_weights = host_columns.full(0.0)
+        for weigher_cls in weigher_classes:
+            weigher = weigher_cls()
+            result = weigher.weigh_columns(host_columns, weighing_properties)
+            if result is None:
+                weighed_objs = [self.object_class(host, float(weight))
+                                for host, weight in zip(host_columns.hosts,
+                                                        host_weights)]
+                weigher.weigh_objects(weighed_objs, weighing_properties)
+                host_weights = host_columns.full(0.0)
+                host_weights[:] = [obj.weight for obj in weighed_objs]
+            else:
+                host_weights = host_weights + result
+
+        # A stable sort on the negated weights keeps hosts with equal
+        # weights in their original order, as sorted() does.
+        order = (-host_weights).argsort(kind='mergesort')
+        return [self.object_class(host_columns.hosts[i],
+                                  float(host_weights[i]))
+                for i in order]
+
 
 def all_weighers():
     """Return a list of weight plugin classes found in this directory."""
@@ -40,8 +40,8 @@ def fake_compute_get_all(*args, **kwargs):
     ]
 
 
-def fake_cn_get(context, host):
-    return {"hypervisor_hostname": host}
+def fake_cn_get_by_hosts(context, hosts):
+    return dict((host, {"hypervisor_hostname": host}) for host in hosts)
 
 
 class ExtendedServerAttributesTest(test.TestCase):
@@ -53,7 +53,13 @@ class ExtendedServerAttributesTest(test.TestCase):
         fakes.stub_out_nw_api(self.stubs)
         self.stubs.Set(compute.api.API, 'get', fake_compute_get)
         self.stubs.Set(compute.api.API, 'get_all', fake_compute_get_all)
-        self.stubs.Set(db, 'compute_node_get_by_host', fake_cn_get)
+        self.cn_lookups = []
+
+        def fake_cn_get(context, hosts):
+            self.cn_lookups.append(sorted(hosts))
+            return fake_cn_get_by_hosts(context, hosts)
+
+        self.stubs.Set(db, 'compute_node_get_by_hosts', fake_cn_get)
         self.flags(
             osapi_compute_extension=[
                 'nova.api.openstack.compute.contrib.select_extensions'],
@@ -96,6 +102,7 @@ class ExtendedServerAttributesTest(test.TestCase):
             self.assertServerAttributes(server,
                                     host='host-%s' % (i + 1),
                                     instance_name='instance-%s' % (i + 1))
+        self.assertEqual(self.cn_lookups, [['host-1', 'host-2']])
 
     def test_no_instance_passthrough_404(self):
 
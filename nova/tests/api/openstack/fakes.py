@@ -389,6 +389,7 @@ def fake_instance_get_all_by_filters(num_servers=5, **kwargs):
         marker = None
         limit = None
         found_marker = False
+        kwargs.pop("fields", None)
         if "marker" in kwargs:
             marker = kwargs["marker"]
         if "limit" in kwargs:
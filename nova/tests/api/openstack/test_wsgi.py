@@ -5,6 +5,7 @@ import webob
 
 from nova.api.openstack import wsgi
 from nova import exception
+from nova.openstack.common import jsonutils
 from nova import test
 from nova.tests.api.openstack import fakes
 
@@ -96,6 +97,31 @@ class RequestTest(test.TestCase):
                  'uuid1': instances[1],
                  'uuid2': instances[2]})
 
+    def test_prefetch_db_items(self):
+        request = wsgi.Request.blank('/foo')
+        request.cache_db_items('nodes', [{'host': 'host0'}], 'host')
+        fetched = []
+
+        def fetch(hosts):
+            fetched.append(sorted(hosts))
+            return dict((host, {'host': host}) for host in hosts
+                        if host != 'host3')
+
+        request.prefetch_db_items('nodes', ['host0', 'host1'], fetch)
+        request.prefetch_db_items('nodes', ['host1', 'host2', 'host3'],
+                                  fetch)
+        request.fetch_db_items()
+        request.fetch_db_items()
+
+        self.assertEqual(fetched, [['host1', 'host2', 'host3']])
+        self.assertEqual(request.get_db_item('nodes', 'host2'),
+                         {'host': 'host2'})
+        self.assertEqual(request.get_db_items('nodes'),
+                         {'host0': {'host': 'host0'},
+                          'host1': {'host': 'host1'},
+                          'host2': {'host': 'host2'},
+                          'host3': None})
+
 
 class ActionDispatcherTest(test.TestCase):
     def test_dispatch(self):
@@ -492,6 +518,56 @@ class ResourceTest(test.TestCase):
         self.assertEqual({'fooAction': [extended._action_foo]},
                          resource.wsgi_action_extensions)
 
+    def test_register_prefetches(self):
+        class Controller(object):
+            def index(self, req, pants=None):
+                return pants
+
+        class ControllerExtended(wsgi.Controller):
+            @wsgi.prefetch('index', 'show')
+            def _prefetch(self, req, resp_obj, **kwargs):
+                return None
+
+        resource = wsgi.Resource(Controller())
+        extended = ControllerExtended()
+        resource.register_extensions(extended)
+        self.assertEqual({'index': [extended._prefetch],
+                          'show': [extended._prefetch]},
+                         resource.wsgi_prefetches)
+        self.assertEqual({}, resource.wsgi_extensions)
+
+    def test_prefetch_before_post_process_extensions(self):
+        class Controller(object):
+            def index(self, req):
+                return {'items': ['a', 'b']}
+
+        called = []
+
+        class ControllerExtended(wsgi.Controller):
+            @wsgi.prefetch('index')
+            def _prefetch(self, req, resp_obj):
+                req.prefetch_db_items('things', resp_obj.obj['items'],
+                                      self._fetch)
+
+            def _fetch(self, keys):
+                called.append(sorted(keys))
+                return dict((key, key.upper()) for key in keys)
+
+            @wsgi.extends
+            def index(self, req, resp_obj):
+                resp_obj.obj['items'] = [req.get_db_item('things', key)
+                                         for key in resp_obj.obj['items']]
+
+        resource = wsgi.Resource(Controller())
+        resource.register_extensions(ControllerExtended())
+        req = webob.Request.blank('/tests')
+        req.environ['wsgiorg.routing_args'] = (None, {'action': 'index'})
+        response = req.get_response(resource)
+
+        self.assertEqual(called, [['a', 'b']])
+        self.assertEqual(jsonutils.loads(response.body),
+                         {'items': ['A', 'B']})
+
     def test_get_method_extensions(self):
         class Controller(object):
             def index(self, req, pants=None):
@@ -0,0 +1,80 @@
+# Copyright 2013 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Command line harness shared by nova's benchmarks.
+
+Every benchmark is a module named in BENCHMARKS, providing:
+
+    add_arguments(parser)  adds the benchmark's options to an argparse
+                           parser.
+    run(args)              runs the benchmark with the parsed options and
+                           returns a list of report dicts.
+    format_report(report)  returns a human readable version of a report.
+
+main() runs the benchmark named by its first argument.  Arguments not
+recognized by the benchmark are handed to nova's configuration parser,
+so options for a run can be set with --config-file.  See
+tools/benchmark.py for the command line front end.
+"""
+
+import argparse
+import json
+
+from nova import config
+from nova.openstack.common import importutils
+
+
+# Benchmark name -> module
+BENCHMARKS = {
+    'iptables': 'nova.tests.network.iptables_benchmark',
+    'jsonutils': 'nova.tests.jsonutils_benchmark',
+    'scheduler': 'nova.tests.scheduler.benchmark',
+}
+
+
+def int_list(value):
+    """argparse type for a comma separated list of integers."""
+    return [int(item) for item in value.split(',')]
+
+
+def parse_args(argv):
+    """Return the benchmark module, its options and the other arguments.
+
+    argv[0] is the program name.
+    """
+    parser = argparse.ArgumentParser(
+            description="Run one of nova's benchmarks.")
+    subparsers = parser.add_subparsers(dest='benchmark')
+    for name in sorted(BENCHMARKS):
+        module = importutils.import_module(BENCHMARKS[name])
+        subparser = subparsers.add_parser(
+                name, help=module.__doc__.strip().split('\n')[0])
+        module.add_arguments(subparser)
+        subparser.add_argument('--json', action='store_true',
+                               help='print the raw reports as JSON')
+    args, remaining = parser.parse_known_args(argv[1:])
+    return (importutils.import_module(BENCHMARKS[args.benchmark]), args,
+            [argv[0]] + remaining)
+
+
+def main(argv):
+    module, args, remaining = parse_args(argv)
+    config.parse_args(remaining)
+    reports = module.run(args)
+    if args.json:
+        print json.dumps(reports, indent=2, sort_keys=True)
+    else:
+        print '\n\n'.join(module.format_report(report)
+                          for report in reports)
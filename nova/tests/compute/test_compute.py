@@ -5186,6 +5186,18 @@ class ComputeAPITestCase(BaseTestCase):
         db.instance_destroy(c, instance2['uuid'])
         db.instance_destroy(c, instance3['uuid'])
 
+    def test_get_all_with_fields(self):
+        c = context.get_admin_context()
+        instance = self._create_fake_instance({'display_name': 'woot'})
+
+        instances = self.compute_api.get_all(
+                c, search_opts={'name': '^woot$'}, fields=['display_name'])
+        self.assertEqual(instances, [dict(id=instance['id'],
+                                          uuid=instance['uuid'],
+                                          display_name='woot')])
+
+        db.instance_destroy(c, instance['uuid'])
+
     def test_get_all_by_flavor(self):
         # Test searching instances by image.
 
@@ -0,0 +1,163 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Fake iptables, ip6tables and ipset commands keeping their state in memory.
+
+Use FakeIptables.execute in place of the execute of IptablesManager and
+IpsetManager.  Like the real commands, restoring a rule that matches on
+a missing ipset and destroying an ipset that a rule matches on fail.
+"""
+
+from nova import exception
+
+
+BUILTIN_CHAINS = {
+    'filter': ['INPUT', 'FORWARD', 'OUTPUT'],
+    'nat': ['PREROUTING', 'INPUT', 'OUTPUT', 'POSTROUTING'],
+    'mangle': ['PREROUTING', 'INPUT', 'FORWARD', 'OUTPUT', 'POSTROUTING'],
+}
+
+
+def _rule_chain(rule):
+    return rule.split('-A ', 1)[1].split()[0]
+
+
+def _match_set(rule):
+    if '--match-set ' in rule:
+        return rule.split('--match-set ', 1)[1].split()[0]
+
+
+class FakeIptables(object):
+
+    def __init__(self):
+        # command -> table name -> chain name -> list of rules
+        self.tables = {'iptables': {}, 'ip6tables': {}}
+        # ipset name -> (family, set of addresses)
+        self.sets = {}
+        self.commands = []
+
+    def execute(self, *cmd, **kwargs):
+        self.commands.append(cmd)
+        process_input = kwargs.get('process_input')
+        if cmd[0] in ('iptables-save', 'ip6tables-save'):
+            return self._save(cmd[0][:-len('-save')]), ''
+        elif cmd[0] in ('iptables-restore', 'ip6tables-restore'):
+            self._restore(cmd[0][:-len('-restore')], process_input,
+                          '--noflush' in cmd)
+        elif cmd[0] == 'ipset':
+            self._ipset(list(cmd[1:]), process_input)
+        else:
+            raise exception.ProcessExecutionError(cmd=' '.join(cmd),
+                                                  exit_code=127)
+        return '', ''
+
+    def _error(self, command, message):
+        raise exception.ProcessExecutionError(cmd=command, exit_code=1,
+                                              stderr=message)
+
+    def rules(self, command='iptables', table='filter'):
+        """Return all rules of a table, without their counters."""
+        chains = self.tables[command].get(table, {})
+        return [rule.split(']', 1)[-1].strip()
+                for name in sorted(chains) for rule in chains[name]]
+
+    def _table(self, command, table):
+        tables = self.tables[command]
+        if table not in tables:
+            tables[table] = dict((name, [])
+                                 for name in BUILTIN_CHAINS[table])
+        return tables[table]
+
+    def _save(self, command):
+        lines = []
+        for table in sorted(BUILTIN_CHAINS):
+            chains = self._table(command, table)
+            lines.append('# Generated by %s-save' % command)
+            lines.append('*%s' % table)
+            for name in sorted(chains):
+                policy = name in BUILTIN_CHAINS[table] and 'ACCEPT' or '-'
+                lines.append(':%s %s [0:0]' % (name, policy))
+            for name in sorted(chains):
+                lines.extend(chains[name])
+            lines.append('COMMIT')
+            lines.append('# Completed')
+        return '\n'.join(lines) + '\n'
+
+    def _restore(self, command, process_input, noflush):
+        chains = None
+        for line in process_input.split('\n'):
+            line = line.strip()
+            if not line or line.startswith('#') or line == 'COMMIT':
+                continue
+            elif line.startswith('*'):
+                table = line[1:]
+                if not noflush:
+                    self.tables[command].pop(table, None)
+                chains = self._table(command, table)
+            elif line.startswith(':'):
+                chains[line[1:].split()[0]] = []
+            elif line.startswith('-X '):
+                chains.pop(line.split()[1], None)
+            else:
+                chain = _rule_chain(line)
+                if chain not in chains:
+                    self._error(command + '-restore',
+                                "chain %s does not exist" % chain)
+                set_name = _match_set(line)
+                if set_name and set_name not in self.sets:
+                    self._error(command + '-restore',
+                                "set %s does not exist" % set_name)
+                chains[chain].append(line)
+
+    def _ipset(self, args, process_input):
+        exist = '-exist' in args
+        if exist:
+            args.remove('-exist')
+        action, args = args[0], args[1:]
+        if action == 'restore':
+            for line in process_input.split('\n'):
+                if line.strip():
+                    self._ipset(line.split() + (exist and ['-exist'] or []),
+                                None)
+        elif action == 'create':
+            if args[0] in self.sets and not exist:
+                self._error('ipset', "set %s already exists" % args[0])
+            self.sets.setdefault(args[0], (args[args.index('family') + 1],
+                                           set()))
+        elif args[0] not in self.sets:
+            self._error('ipset', "set %s does not exist" % args[0])
+        elif action == 'flush':
+            self.sets[args[0]][1].clear()
+        elif action == 'add':
+            if args[1] in self.sets[args[0]][1] and not exist:
+                self._error('ipset', "%s is already in %s" % (args[1],
+                                                              args[0]))
+            self.sets[args[0]][1].add(args[1])
+        elif action == 'del':
+            if args[1] not in self.sets[args[0]][1] and not exist:
+                self._error('ipset', "%s is not in %s" % (args[1], args[0]))
+            self.sets[args[0]][1].discard(args[1])
+        elif action == 'destroy':
+            for command in self.tables:
+                for table in self.tables[command]:
+                    for rule in self.rules(command, table):
+                        if _match_set(rule) == args[0]:
+                            self._error('ipset', "set %s is in use" %
+                                        args[0])
+            del self.sets[args[0]]
+        else:
+            self._error('ipset', "unknown command %s" % action)
@@ -0,0 +1,225 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import hashlib
+import os
+
+import fixtures
+import webob
+
+from nova import exception
+from nova.image import download
+from nova import test
+from nova.virt import images
+from nova import wsgi
+
+MB = 1024 * 1024
+
+
+class FakeGlanceApp(object):
+    """Serves the data of one image, like glance does on /v1/images/<id>."""
+
+    def __init__(self, data, accept_ranges=True):
+        self.data = data
+        self.accept_ranges = accept_ranges
+        self.ranges = []
+        self.fail_ranges = set()
+        self.checksum = hashlib.md5(data).hexdigest()
+
+    def __call__(self, environ, start_response):
+        request = webob.Request(environ)
+        byte_range = request.headers.get('Range')
+        if request.method == 'GET':
+            self.ranges.append(byte_range)
+        if byte_range in self.fail_ranges:
+            self.fail_ranges.remove(byte_range)
+            response = webob.Response(status=500)
+        else:
+            response = webob.Response(body=self.data,
+                                      conditional_response=self.accept_ranges)
+            response.headers['x-image-meta-size'] = str(len(self.data))
+            response.headers['x-image-meta-checksum'] = self.checksum
+            if self.accept_ranges:
+                response.headers['Accept-Ranges'] = 'bytes'
+        return response(environ, start_response)
+
+
+class FakeImageService(object):
+    def __init__(self, url):
+        self.url = url
+
+    def get_data_request(self, context, image_id):
+        return '%s/v1/images/%s' % (self.url, image_id), {}
+
+    def download(self, context, image_id, data):
+        raise AssertionError('image downloaded in one stream')
+
+
+class RangedDownloadTestCase(test.TestCase):
+    def setUp(self):
+        super(RangedDownloadTestCase, self).setUp()
+        self.flags(image_download_chunk_size=1,
+                   image_download_concurrency=2)
+        self.path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                 'image.part')
+        # 2.5 chunks, the middle one all zeros
+        self.data = 'a' * MB + '\0' * MB + 'b' * (MB / 2)
+
+    def _start_server(self, **kwargs):
+        self.app = FakeGlanceApp(self.data, **kwargs)
+        server = wsgi.Server('fake_glance', self.app,
+                             host='127.0.0.1', port=0)
+        server.start()
+        self.addCleanup(server.stop)
+        return 'http://127.0.0.1:%d' % server.port
+
+    def _download(self, url):
+        ranged = download.RangedDownload(url + '/v1/images/fake', self.path)
+        self.assertTrue(ranged.probe())
+        return ranged
+
+    def _read(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def test_download_in_chunks(self):
+        url = self._start_server()
+        self._download(url).fetch()
+
+        self.assertEqual(self._read(), self.data)
+        self.assertEqual(sorted(self.app.ranges),
+                         ['bytes=0-1048575', 'bytes=1048576-2097151',
+                          'bytes=2097152-2621439'])
+        self.assertFalse(os.path.exists(self.path + '.state'))
+        # the zero chunk was left a hole
+        self.assertTrue(os.stat(self.path).st_blocks * 512 < len(self.data))
+
+    def test_no_ranges(self):
+        url = self._start_server(accept_ranges=False)
+        ranged = download.RangedDownload(url + '/v1/images/fake', self.path)
+        self.assertFalse(ranged.probe())
+
+    def test_disabled(self):
+        self.flags(image_download_chunk_size=0)
+        ranged = download.RangedDownload('http://127.0.0.1:1/', self.path)
+        self.assertFalse(ranged.probe())
+
+    def test_probe_error_downloads_in_one_stream(self):
+        ranged = download.RangedDownload('http://127.0.0.1:1/', self.path)
+        self.assertFalse(ranged.probe())
+
+    def test_https_verifies_certificate(self):
+        self.flags(glance_api_insecure=False)
+        connections = []
+
+        class FakeConnection(object):
+            def __init__(self, host, port, insecure):
+                connections.append((host, port, insecure))
+
+            def request(self, method, path, headers):
+                pass
+
+            def getresponse(self):
+                return 'response'
+
+        self.stubs.Set(download.glance_http, 'VerifiedHTTPSConnection',
+                       FakeConnection)
+        self.assertEqual(download._request('https://glance:9292/v1/images/x',
+                                           'HEAD', {}), 'response')
+        self.assertEqual(connections, [('glance', 9292, False)])
+
+    def test_checksum_mismatch(self):
+        url = self._start_server()
+        self.app.checksum = hashlib.md5('other image').hexdigest()
+        self.assertRaises(exception.ImageDownloadFailed,
+                          self._download(url).fetch)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(self.path + '.state'))
+
+    def test_resume(self):
+        url = self._start_server()
+        self.app.fail_ranges.add('bytes=2097152-2621439')
+        self.assertRaises(exception.ImageDownloadFailed,
+                          self._download(url).fetch)
+        self.assertTrue(os.path.exists(self.path + '.state'))
+
+        self.app.ranges = []
+        self._download(url).fetch()
+
+        self.assertEqual(self.app.ranges, ['bytes=2097152-2621439'])
+        self.assertEqual(self._read(), self.data)
+        self.assertFalse(os.path.exists(self.path + '.state'))
+
+    def test_resume_other_image_starts_over(self):
+        url = self._start_server()
+        self.app.fail_ranges.add('bytes=2097152-2621439')
+        self.assertRaises(exception.ImageDownloadFailed,
+                          self._download(url).fetch)
+
+        self.app.data = self.data = 'c' * (MB * 5 / 2)
+        self.app.checksum = hashlib.md5(self.data).hexdigest()
+        self.app.ranges = []
+        self._download(url).fetch()
+
+        self.assertEqual(len(self.app.ranges), 3)
+        self.assertEqual(self._read(), self.data)
+
+    def test_retry_chunk(self):
+        self.flags(glance_num_retries=1)
+        url = self._start_server()
+        self.app.fail_ranges.add('bytes=0-1048575')
+        self._download(url).fetch()
+
+        self.assertEqual(self.app.ranges.count('bytes=0-1048575'), 2)
+        self.assertEqual(self._read(), self.data)
+
+    def test_fetch_image_in_chunks(self):
+        url = self._start_server()
+        self.stubs.Set(images.glance, 'get_remote_image_service',
+                       lambda context, href: (FakeImageService(url), href))
+
+        fetched = images.fetch(None, 'fake', self.path, None, None)
+
+        self.assertEqual(fetched.checksum, None)
+        self.assertEqual(self._read(), self.data)
+
+
+class RateLimiterTestCase(test.TestCase):
+    def test_consume(self):
+        sleeps = []
+        self.stubs.Set(download.time, 'time', lambda: 100.0)
+        self.stubs.Set(download.greenthread, 'sleep', sleeps.append)
+
+        limiter = download.RateLimiter(1000)
+        limiter.consume(500)
+        limiter.consume(1000)
+
+        self.assertEqual(sleeps, [0.5, 1.5])
+
+    def test_no_limit(self):
+        self.stubs.Set(download.greenthread, 'sleep', self.fail)
+        download.RateLimiter(0).consume(500)
+
+    def test_throttle_follows_flags(self):
+        self.flags(image_download_concurrency=3, image_download_max_rate=2)
+        throttle = download.get_throttle()
+        self.assertEqual(throttle.concurrency, 3)
+        self.assertEqual(throttle.limiter.rate, 2048)
+        self.assertTrue(download.get_throttle() is throttle)
+
+        self.flags(image_download_max_rate=0)
+        self.assertFalse(download.get_throttle() is throttle)
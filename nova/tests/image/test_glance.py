@@ -505,6 +505,18 @@ class TestGlanceImageService(test.TestCase):
         os.remove(client.s_tmpfname)
         os.remove(tmpfname)
 
+    def test_get_data_request(self):
+        self.flags(auth_strategy='keystone')
+        ctxt = context.RequestContext('fake', 'fake', auth_token='token')
+        url, headers = self.service.get_data_request(ctxt, 'fake-id')
+        self.assertEqual(url, 'http://fake_host:9292/v1/images/fake-id')
+        self.assertEqual(headers, {'X-Auth-Token': 'token'})
+
+    def test_get_data_request_file_url(self):
+        self.flags(allowed_direct_url_schemes=['file'])
+        self.assertEqual(self.service.get_data_request(self.context, 1),
+                         None)
+
     def test_client_forbidden_converts_to_imagenotauthed(self):
         class MyGlanceStubClient(glance_stubs.StubGlanceClient):
             """A client that raises a Forbidden exception."""
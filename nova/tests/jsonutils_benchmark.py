@@ -0,0 +1,156 @@
+# Copyright 2013 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Instance payloads for benchmarking jsonutils.to_primitive().
+
+run_benchmark() builds the payloads nova serializes most: the payload of
+an instance notification, built by notifications.info_from_instance(),
+and a compute RPC message carrying an instance model and its network
+info, and times their conversion by to_primitive().
+
+Run it with tools/benchmark.py jsonutils.
+"""
+
+import datetime
+import time
+
+from nova import context
+from nova.db.sqlalchemy import models
+from nova.network import model as network_model
+from nova import notifications
+from nova.openstack.common import jsonutils
+from nova.tests import fake_network_cache_model
+
+
+def _metadata(model, items):
+    return [model(key=key, value=value) for key, value in items]
+
+
+def fake_instance(index=0, metadata_items=10):
+    """Return an instance model with the relations a compute host sees."""
+    now = datetime.datetime(2013, 1, 1, 12, 0, 0)
+    uuid = '00000000-0000-0000-0000-%012d' % index
+    instance_type = models.InstanceTypes(
+        id=1, name='m1.small', memory_mb=2048, vcpus=1, root_gb=20,
+        ephemeral_gb=0, flavorid='2', swap=0, rxtx_factor=1.0,
+        vcpu_weight=None, disabled=False, is_public=True,
+        created_at=now, updated_at=None, deleted_at=None, deleted=False)
+    system_metadata = [('instance_type_%s' % key, value) for key, value in
+                       (('name', 'm1.small'), ('memory_mb', '2048'),
+                        ('vcpus', '1'), ('root_gb', '20'))]
+    system_metadata += [('image_%s' % key, value) for key, value in
+                        (('kernel_id', 'kernel'), ('ramdisk_id', 'ramdisk'),
+                         ('os_type', 'linux'), ('min_disk', '20'))]
+    instance = models.Instance(
+        id=index, uuid=uuid, user_id='fake-user', project_id='fake-project',
+        image_ref='155d900f-4e14-4e4c-a73d-069cbf4541e6',
+        kernel_id='kernel', ramdisk_id='ramdisk', hostname='server-%d' % index,
+        host='compute-1', node='compute-1', launch_index=0,
+        reservation_id='r-%08d' % index, display_name='server-%d' % index,
+        display_description='', memory_mb=2048, vcpus=1, root_gb=20,
+        ephemeral_gb=0, instance_type_id=1, architecture='x86_64',
+        os_type='linux', vm_mode=None, power_state=1, vm_state='active',
+        task_state=None, availability_zone='nova', access_ip_v4=None,
+        access_ip_v6=None, config_drive='', key_name='default',
+        key_data='ssh-rsa AAAA', root_device_name='/dev/vda',
+        default_ephemeral_device=None, default_swap_device=None,
+        progress=0, locked=False, cell_name=None, shutdown_terminate=False,
+        disable_terminate=False, user_data=None, launched_on='compute-1',
+        scheduled_at=now, launched_at=now, terminated_at=None,
+        created_at=now, updated_at=now, deleted_at=None, deleted=False)
+    instance.instance_type = instance_type
+    instance.metadata = _metadata(
+        models.InstanceMetadata,
+        [('key%d' % i, 'value%d' % i) for i in xrange(metadata_items)])
+    instance.system_metadata = _metadata(models.InstanceSystemMetadata,
+                                         system_metadata)
+    return instance
+
+
+def fake_network_info(num_vifs=1):
+    return network_model.NetworkInfo(
+        [fake_network_cache_model.new_vif({'id': i})
+         for i in xrange(num_vifs)])
+
+
+def notification_payload(instance, network_info):
+    """Return the payload of a compute.instance notification."""
+    ctxt = context.get_admin_context()
+    return notifications.info_from_instance(
+        ctxt, instance, network_info,
+        dict((item['key'], item['value'])
+             for item in instance['system_metadata']))
+
+
+def rpc_message(instance, network_info):
+    """Return a compute RPC message, the way rpcapi casts them."""
+    ctxt = context.get_admin_context()
+    msg = {'method': 'reboot_instance',
+           'args': {'instance': instance,
+                    'network_info': network_info,
+                    'block_device_info': None,
+                    'reboot_type': 'SOFT'},
+           'version': '2.23'}
+    msg.update(dict(('_context_%s' % key, value)
+                    for key, value in ctxt.to_dict().iteritems()))
+    return msg
+
+
+def _time(payloads, iterations):
+    start = time.time()
+    for i in xrange(iterations):
+        for payload in payloads:
+            jsonutils.to_primitive(payload)
+    return time.time() - start
+
+
+def run_benchmark(iterations=100, metadata_items=10, num_vifs=1):
+    """Time converting instance payloads and return a report dict.
+
+    The report holds the number of payloads converted, the seconds
+    to_primitive() took and the milliseconds it took per payload.
+    """
+    instance = fake_instance(metadata_items=metadata_items)
+    network_info = fake_network_info(num_vifs)
+    payloads = [notification_payload(instance, network_info),
+                rpc_message(instance, network_info)]
+
+    seconds = _time(payloads, iterations)
+    count = len(payloads) * iterations
+    return {
+        'payloads': count,
+        'seconds': seconds,
+        'ms_per_payload': seconds * 1000 / count if count else 0.0,
+    }
+
+
+def format_report(report):
+    """Return a human readable version of a run_benchmark() report."""
+    return ('%(payloads)8d payloads: %(seconds)8.3fs '
+            '(%(ms_per_payload).3fms per payload)' % report)
+
+
+def add_arguments(parser):
+    parser.add_argument('--iterations', type=int, default=100,
+                        help='number of times each payload is converted')
+    parser.add_argument('--metadata', type=int, default=10,
+                        help='number of metadata items of the instance')
+    parser.add_argument('--vifs', type=int, default=1,
+                        help='number of network interfaces of the instance')
+
+
+def run(args):
+    return [run_benchmark(args.iterations, metadata_items=args.metadata,
+                          num_vifs=args.vifs)]
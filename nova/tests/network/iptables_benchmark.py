@@ -0,0 +1,216 @@
+# Copyright 2013 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Synthetic rule sets for benchmarking IptablesManager.apply().
+
+run_benchmark() fills an IptablesManager with per-instance chains of
+rules, the way the firewall drivers do, and times applying them against
+a fake iptables-save/iptables-restore that keeps what was last restored.
+The first apply starts from a host with no nova rules; later ones find
+the previous rules in place, each after an instance chain was replaced.
+Those are timed both rewriting only the changed chains and rewriting
+all tables.
+
+Run it with tools/benchmark.py iptables.
+"""
+
+import time
+
+from nova.network import linux_net
+from nova.openstack.common import cfg
+from nova.tests import benchmarks
+
+CONF = cfg.CONF
+
+
+BUILTIN_CHAINS = [
+    ('filter', ['INPUT', 'FORWARD', 'OUTPUT']),
+    ('nat', ['PREROUTING', 'INPUT', 'OUTPUT', 'POSTROUTING']),
+    ('mangle', ['PREROUTING', 'INPUT', 'FORWARD', 'OUTPUT', 'POSTROUTING']),
+]
+
+
+FOREIGN_CHAIN = 'nova-other-local'
+
+
+class FakeIptables(object):
+    """iptables-save and iptables-restore keeping the tables in memory.
+
+    The tables start with num_foreign_rules rules of another service in
+    the filter table, like those of nova-network on a host where
+    nova-compute runs too.
+    """
+
+    def __init__(self, num_foreign_rules=0):
+        lines = []
+        for table, chains in BUILTIN_CHAINS:
+            lines.append('# Generated by iptables-save')
+            lines.append('*%s' % table)
+            lines.extend(':%s ACCEPT [0:0]' % chain for chain in chains)
+            if table == 'filter' and num_foreign_rules:
+                lines.append(':%s - [0:0]' % FOREIGN_CHAIN)
+                lines.append('[0:0] -A INPUT -j %s' % FOREIGN_CHAIN)
+                lines.extend('[%d:%d] -A %s -s 172.16.%d.%d/32 -j ACCEPT' %
+                             (i, i * 64, FOREIGN_CHAIN, i >> 8 & 255,
+                              i & 255)
+                             for i in xrange(num_foreign_rules))
+            lines.append('COMMIT')
+            lines.append('# Completed')
+        self.tables = '\n'.join(lines)
+        self.restores = 0
+        self.noflush_restores = 0
+
+    def execute(self, *cmd, **kwargs):
+        # Changed chains restored with --noflush are only counted, what
+        # they change is rewritten by the next full restore anyway.
+        if cmd[0] == 'iptables-save':
+            return self.tables, ''
+        elif cmd[0] == 'iptables-restore' and '--noflush' in cmd:
+            self.noflush_restores += 1
+        elif cmd[0] == 'iptables-restore':
+            self.tables = kwargs['process_input']
+            self.restores += 1
+        return '', ''
+
+
+def _instance_rules(index, rules_per_chain):
+    address = '10.%d.%d.%d' % (index >> 16 & 255, index >> 8 & 255,
+                               index & 255)
+    rules = ['-m state --state INVALID -j DROP',
+             '-m state --state ESTABLISHED,RELATED -j ACCEPT']
+    for port in xrange(rules_per_chain - len(rules)):
+        rules.append('-s %s/32 -p tcp -m tcp --dport %d -j ACCEPT' %
+                     (address, 1024 + port))
+    return address, rules
+
+
+def add_instance(manager, index, rules_per_chain):
+    """Add the chain and rules of a fake instance, like the firewall."""
+    table = manager.ipv4['filter']
+    chain = 'inst-%08d' % index
+    address, rules = _instance_rules(index, rules_per_chain)
+    table.add_chain(chain)
+    table.add_rule('local', '-d %s -j $%s' % (address, chain))
+    for rule in rules:
+        table.add_rule(chain, rule)
+
+
+def remove_instance(manager, index):
+    """Remove the chain of a fake instance and the jump to it."""
+    manager.ipv4['filter'].remove_chain('inst-%08d' % index)
+
+
+def add_network(manager, index):
+    """Add the rules kept at the top of FORWARD for a fake network."""
+    table = manager.ipv4['filter']
+    interface = 'br%d' % index
+    for direction in ('-i', '-o'):
+        table.add_rule('FORWARD', '%s %s -p udp --dport 67 -j DROP' %
+                       (direction, interface), top=True)
+
+
+def run_benchmark(num_rules, rules_per_chain=20, applies=3,
+                  top_rules_per_cent=1, foreign_rules_per_cent=50):
+    """Time applying num_rules rules and return a report dict.
+
+    top_rules_per_cent of the rules are kept at the top of their chain,
+    like those nova-network adds for each of its networks, and
+    foreign_rules_per_cent of them belong to another service.
+
+    The report holds the number of rules and iptables-save lines, and
+    the seconds taken by the first apply and the fastest and mean of the
+    following ones of each kind.
+    """
+    num_foreign_rules = num_rules * foreign_rules_per_cent // 100
+    fake = FakeIptables(num_foreign_rules)
+    manager = linux_net.IptablesManager(execute=fake.execute)
+    for index in xrange(num_rules * top_rules_per_cent // 200):
+        add_network(manager, index)
+    num_rules -= num_foreign_rules
+    num_instances = max(num_rules // rules_per_chain, 1)
+    for index in xrange(num_instances):
+        add_instance(manager, index, rules_per_chain)
+
+    start = time.time()
+    manager.apply()
+    first = time.time() - start
+
+    def timed_applies():
+        timings = []
+        for i in xrange(applies):
+            index = i % num_instances
+            remove_instance(manager, index)
+            add_instance(manager, index, rules_per_chain)
+            start = time.time()
+            manager.apply()
+            timings.append(time.time() - start)
+        return timings or [first]
+
+    changed_chains = timed_applies()
+    CONF.set_override('iptables_full_resync_interval', 0)
+    try:
+        full = timed_applies()
+    finally:
+        CONF.clear_override('iptables_full_resync_interval')
+
+    return {
+        'rules': sum(len(table.rules) for table in manager.ipv4.values()),
+        'foreign_rules': num_foreign_rules,
+        'lines': fake.tables.count('\n') + 1,
+        'restores': fake.restores,
+        'noflush_restores': fake.noflush_restores,
+        'first_apply_seconds': first,
+        'min_apply_seconds': min(changed_chains),
+        'mean_apply_seconds': sum(changed_chains) / len(changed_chains),
+        'min_full_apply_seconds': min(full),
+        'mean_full_apply_seconds': sum(full) / len(full),
+    }
+
+
+def format_report(report):
+    """Return a human readable version of a run_benchmark() report."""
+    return ('%(rules)8d rules %(foreign_rules)8d foreign rules '
+            '%(lines)8d lines: first apply %(first_apply_seconds)8.3fs, '
+            'changed chains min %(min_apply_seconds)8.3fs mean '
+            '%(mean_apply_seconds)8.3fs, full min '
+            '%(min_full_apply_seconds)8.3fs mean '
+            '%(mean_full_apply_seconds)8.3fs' % report)
+
+
+def add_arguments(parser):
+    parser.add_argument('--rules', type=benchmarks.int_list,
+                        default=[1000, 10000, 100000],
+                        help='comma separated rule counts to benchmark')
+    parser.add_argument('--rules-per-chain', type=int, default=20,
+                        help='number of rules in each instance chain')
+    parser.add_argument('--applies', type=int, default=3,
+                        help='number of applies to time after the first')
+    parser.add_argument('--top-rules', type=int, default=1,
+                        help='per cent of the rules kept at the top of '
+                             'their chain')
+    parser.add_argument('--foreign-rules', type=int, default=50,
+                        help='per cent of the rules belonging to another '
+                             'service')
+
+
+def run(args):
+    # Take the iptables lock in a temporary directory of its own unless
+    # a lock_path is configured.
+    CONF.set_default('lock_path', None)
+    return [run_benchmark(num_rules, rules_per_chain=args.rules_per_chain,
+                          applies=args.applies,
+                          top_rules_per_cent=args.top_rules,
+                          foreign_rules_per_cent=args.foreign_rules)
+            for num_rules in args.rules]
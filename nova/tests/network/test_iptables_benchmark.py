@@ -0,0 +1,31 @@
+# Copyright 2013 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For the iptables benchmark harness.
+"""
+
+from nova import test
+from nova.tests.network import iptables_benchmark
+
+
+class IptablesBenchmarkTestCase(test.TestCase):
+    def test_run_benchmark(self):
+        report = iptables_benchmark.run_benchmark(400, applies=2)
+        self.assertEqual(report['foreign_rules'], 200)
+        self.assertEqual(report['restores'], 3)
+        self.assertEqual(report['noflush_restores'], 2)
+        self.assertTrue(report['rules'] > 200)
+        self.assertTrue(report['lines'] > report['rules'] + 200)
+        self.assertTrue(iptables_benchmark.format_report(report))
@@ -17,6 +17,7 @@
 
 import os
 
+import fixtures
 import mox
 
 from nova import context
@@ -25,6 +26,7 @@ from nova.network import driver
 from nova.network import linux_net
 from nova.openstack.common import fileutils
 from nova.openstack.common import log as logging
+from nova.openstack.common import timeutils
 from nova import test
 from nova import utils
 
@@ -184,7 +186,7 @@ vifs = [{'id': 0,
          'instance_uuid': '00000000-0000-0000-0000-0000000000000001'}]
 
 
-def get_associated(context, network_id, host=None):
+def get_associated(context, network_id, host=None, address=None):
     result = []
     for datum in fixed_ips:
         if (datum['network_id'] == network_id and datum['allocated']
@@ -193,6 +195,8 @@ def get_associated(context, network_id, host=None):
             instance = instances[datum['instance_uuid']]
             if host and host != instance['host']:
                 continue
+            if address and address != datum['address']:
+                continue
             cleaned = {}
             cleaned['address'] = datum['address']
             cleaned['instance_uuid'] = datum['instance_uuid']
@@ -203,6 +207,7 @@ def get_associated(context, network_id, host=None):
             cleaned['instance_hostname'] = instance['hostname']
             cleaned['instance_updated'] = instance['updated_at']
             cleaned['instance_created'] = instance['created_at']
+            cleaned['id'] = datum['id']
             result.append(cleaned)
     return result
 
@@ -226,6 +231,7 @@ class LinuxNetworkTestCase(test.TestCase):
         self.stubs.Set(db, 'virtual_interface_get_by_instance', get_vifs)
         self.stubs.Set(db, 'instance_get', get_instance)
         self.stubs.Set(db, 'network_get_associated_fixed_ips', get_associated)
+        self.stubs.Set(linux_net, '_fixed_ip_tables', {})
 
     def test_update_dhcp_for_nw00(self):
         self.flags(use_single_default_gateway=True)
@@ -333,6 +339,97 @@ class LinuxNetworkTestCase(test.TestCase):
 
         self.assertEquals(actual_opts, expected_opts)
 
+    def test_fixed_ip_table_reloads_changed_addresses(self):
+        queries = []
+
+        def fake_get_associated(context, network_id, host=None,
+                                address=None):
+            queries.append(address)
+            return get_associated(context, network_id, host, address)
+
+        self.stubs.Set(db, 'network_get_associated_fixed_ips',
+                       fake_get_associated)
+        self.addCleanup(fixed_ips[3].__setitem__, 'allocated', True)
+        expected = (
+                "192.168.0.100\tfake_instance00.novalocal\n"
+                "192.168.1.101\tfake_instance01.novalocal\n"
+                "192.168.0.102\tfake_instance00.novalocal"
+        )
+        self.assertEquals(self.driver.get_dns_hosts(self.context,
+                                                    networks[0]), expected)
+        self.assertEquals(self.driver.get_dns_hosts(self.context,
+                                                    networks[0]), expected)
+        self.assertEquals(queries, [None])
+
+        fixed_ips[3]['allocated'] = False
+        self.driver.fixed_ips_changed(0, ['192.168.1.101'])
+        self.assertEquals(self.driver.get_dns_hosts(self.context,
+                                                    networks[0]),
+                          "192.168.0.100\tfake_instance00.novalocal\n"
+                          "192.168.0.102\tfake_instance00.novalocal")
+        self.assertEquals(queries, [None, '192.168.1.101'])
+
+        fixed_ips[3]['allocated'] = True
+        self.driver.fixed_ips_changed(0, ['192.168.1.101'])
+        self.assertEquals(self.driver.get_dns_hosts(self.context,
+                                                    networks[0]), expected)
+        self.driver.fixed_ips_changed(0)
+        self.assertEquals(self.driver.get_dns_hosts(self.context,
+                                                    networks[0]), expected)
+        self.assertEquals(queries,
+                          [None, '192.168.1.101', '192.168.1.101', None])
+
+    def test_fixed_ip_table_resync_interval(self):
+        self.flags(dhcp_hosts_resync_interval=60)
+        queries = []
+
+        def fake_get_associated(context, network_id, host=None,
+                                address=None):
+            queries.append(address)
+            return get_associated(context, network_id, host, address)
+
+        self.stubs.Set(db, 'network_get_associated_fixed_ips',
+                       fake_get_associated)
+        timeutils.set_time_override(timeutils.utcnow())
+        self.addCleanup(timeutils.clear_time_override)
+
+        self.driver.get_dhcp_hosts(self.context, networks[0])
+        self.driver.fixed_ips_changed(0, ['192.168.0.100'])
+        timeutils.advance_time_seconds(30)
+        self.driver.get_dhcp_hosts(self.context, networks[0])
+        timeutils.advance_time_seconds(31)
+        self.driver.get_dhcp_hosts(self.context, networks[0])
+        self.assertEquals(queries, [None, '192.168.0.100', None])
+
+    def test_update_dhcp_skips_unchanged_hostfile(self):
+        self.flags(networks_path=self.useFixture(
+            fixtures.TempDir()).path)
+        self.mox.StubOutWithMock(self.driver, 'restart_dhcp')
+        self.driver.restart_dhcp(self.context, 'eth0', networks[0],
+                                 files_changed=True)
+        self.driver.restart_dhcp(self.context, 'eth0', networks[0],
+                                 files_changed=False)
+        self.mox.ReplayAll()
+
+        self.driver.update_dhcp(self.context, 'eth0', networks[0])
+        self.driver.update_dhcp(self.context, 'eth0', networks[0])
+
+        conffile = self.driver._dhcp_file('eth0', 'conf')
+        self.assertEquals(open(conffile).read(),
+                          self.driver.get_dhcp_hosts(self.context,
+                                                     networks[0]))
+        self.assertEquals(os.listdir(os.path.dirname(conffile)),
+                          ['nova-eth0.conf'])
+
+    def test_write_to_file_keeps_mode(self):
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                            'nova-eth0.conf')
+        self.driver.write_to_file(path, 'old')
+        os.chmod(path, 0600)
+        self.driver.write_to_file(path, 'new')
+        self.assertEquals(open(path).read(), 'new')
+        self.assertEquals(os.stat(path).st_mode & 0777, 0600)
+
     def test_dhcp_opts_not_default_gateway_network(self):
         expected = "NW-0,3"
         data = get_associated(self.context, 0)[0]
@@ -499,17 +596,16 @@ class LinuxNetworkTestCase(test.TestCase):
                        'remove_bridge', fake_remove)
 
         driver.unplug(network)
+        # Only the wrapped FORWARD chain changed, so only it is rewritten
         expected = [
             ('ebtables', '-D', 'INPUT', '-p', 'ARP', '-i', iface,
              '--arp-ip-dst', dhcp, '-j', 'DROP'),
             ('ebtables', '-D', 'OUTPUT', '-p', 'ARP', '-o', iface,
              '--arp-ip-src', dhcp, '-j', 'DROP'),
-            ('iptables-save', '-c'),
-            ('iptables-restore', '-c'),
-            ('ip6tables-save', '-c'),
-            ('ip6tables-restore', '-c'),
+            ('iptables-restore', '-c', '--noflush'),
         ]
         self.assertEqual(executes, expected)
+        self.assertTrue(':test-FORWARD - [0:0]' in inputs[0])
         for inp in expected_inputs:
             self.assertFalse(inp in inputs[0])
 
@@ -39,6 +39,6 @@ class PolicyFixture(fixtures.Fixture):
         self.addCleanup(nova.policy.reset)
 
     def set_rules(self, rules):
-        common_policy.set_rules(common_policy.Rules(
+        common_policy.set_rules(nova.policy.Rules(
                 dict((k, common_policy.parse_rule(v))
                      for k, v in rules.items())))
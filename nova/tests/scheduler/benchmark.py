@@ -0,0 +1,495 @@
+# Copyright 2013 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Synthetic host fleets and request mixes for benchmarking the scheduler.
+
+A Fleet is a set of fake compute nodes, services, capabilities and
+aggregates.  run_benchmark() drives HostManager.get_all_host_states(),
+get_filtered_hosts(), get_weighed_hosts() and FilterScheduler._schedule()
+against a fleet with a mix of requests, serving the few db calls made on
+that path from the fleet so no database or message bus is needed.
+
+Run it with tools/benchmark.py scheduler.
+"""
+
+import collections
+import contextlib
+import gc
+import resource
+import time
+
+from nova import context
+from nova import db
+from nova import exception
+from nova.openstack.common import jsonutils
+from nova.openstack.common import timeutils
+from nova.scheduler import filter_scheduler
+from nova.scheduler import host_manager
+from nova.tests import benchmarks
+
+
+BENCHMARK_FILTERS = [
+    'RetryFilter',
+    'AvailabilityZoneFilter',
+    'RamFilter',
+    'CoreFilter',
+    'DiskFilter',
+    'ComputeFilter',
+    'ComputeCapabilitiesFilter',
+    'ImagePropertiesFilter',
+    'AggregateInstanceExtraSpecsFilter',
+    'JsonFilter',
+    'SimpleCIDRAffinityFilter',
+    'IoOpsFilter',
+    'NumInstancesFilter',
+]
+
+FLAVORS = [
+    dict(name='m1.tiny', memory_mb=512, vcpus=1, root_gb=1,
+         ephemeral_gb=0),
+    dict(name='m1.small', memory_mb=2048, vcpus=1, root_gb=20,
+         ephemeral_gb=0),
+    dict(name='m1.medium', memory_mb=4096, vcpus=2, root_gb=40,
+         ephemeral_gb=0),
+    dict(name='m1.large', memory_mb=8192, vcpus=4, root_gb=80,
+         ephemeral_gb=0),
+    dict(name='m1.xlarge', memory_mb=16384, vcpus=8, root_gb=160,
+         ephemeral_gb=0),
+]
+
+# Relative frequency of each kind of request in the mix.
+REQUEST_MIX = [
+    ('boot', 40),
+    ('multi_boot', 10),
+    ('availability_zone', 10),
+    ('extra_specs', 10),
+    ('json_query', 10),
+    ('cidr_affinity', 10),
+    ('force_hosts', 5),
+    ('retry', 5),
+]
+
+HOST_SIZES = [
+    dict(memory_mb=65536, vcpus=16, local_gb=1024),
+    dict(memory_mb=131072, vcpus=32, local_gb=2048),
+    dict(memory_mb=262144, vcpus=48, local_gb=4096),
+]
+
+
+class Fleet(object):
+    """A synthetic set of compute nodes with services, capabilities and
+    aggregate membership.
+
+    Uses a fixed seed so that runs against the same fleet size are
+    comparable.
+    """
+
+    def __init__(self, num_hosts, num_aggregates=8, seed=0):
+        # A linear congruential generator keeps fleets identical across
+        # Python versions, unlike the random module.
+        self._seed = seed
+        self.now = timeutils.utcnow()
+        self.num_aggregates = num_aggregates
+        self.compute_nodes = []
+        self.services = []
+        self.service_states = {}
+        self.aggregates = {}
+        for index in xrange(num_hosts):
+            self._add_host(index)
+
+    def randint(self, low, high):
+        """Return a pseudo random integer N such that low <= N <= high."""
+        self._seed = (self._seed * 1103515245 + 12345) & 0x7fffffff
+        return low + self._seed % (high - low + 1)
+
+    def choice(self, seq):
+        return seq[self.randint(0, len(seq) - 1)]
+
+    def host_ip(self, index):
+        return '10.%d.%d.%d' % (index >> 16 & 255, index >> 8 & 255,
+                                index & 255)
+
+    def _add_host(self, index):
+        host = 'host%05d' % index
+        node = 'node%05d' % index
+        size = self.choice(HOST_SIZES)
+        vcpus_used = self.randint(0, size['vcpus'])
+        memory_mb_used = self.randint(0, size['memory_mb'] / 2)
+        local_gb_used = self.randint(0, size['local_gb'] / 2)
+        num_instances = self.randint(0, 40)
+
+        service = dict(id=index + 1, host=host, binary='nova-compute',
+                       topic='compute', disabled=index % 97 == 0,
+                       created_at=self.now, updated_at=self.now)
+        stats = [dict(key='num_instances', value=str(num_instances)),
+                 dict(key='io_workload', value=str(self.randint(0, 10))),
+                 dict(key='num_vm_active', value=str(num_instances)),
+                 dict(key='num_os_type_linux', value=str(num_instances))]
+        for project in xrange(self.randint(1, 5)):
+            stats.append(dict(key='num_proj_project%d' % project,
+                              value=str(self.randint(1, 8))))
+        for task_state in ('spawning', 'resize_migrating', 'image_snapshot'):
+            stats.append(dict(key='num_task_%s' % task_state,
+                              value=str(self.randint(0, 2))))
+
+        self.services.append(service)
+        self.compute_nodes.append(dict(
+                id=index + 1, service_id=service['id'], service=service,
+                hypervisor_hostname=node, hypervisor_type='QEMU',
+                hypervisor_version=1001000, cpu_info='{}',
+                vcpus=size['vcpus'], vcpus_used=vcpus_used,
+                memory_mb=size['memory_mb'],
+                memory_mb_used=memory_mb_used,
+                free_ram_mb=size['memory_mb'] - memory_mb_used,
+                local_gb=size['local_gb'], local_gb_used=local_gb_used,
+                free_disk_gb=size['local_gb'] - local_gb_used,
+                disk_available_least=size['local_gb'] - local_gb_used,
+                current_workload=0, running_vms=num_instances,
+                created_at=self.now, updated_at=self.now, stats=stats))
+
+        self.service_states[(host, node)] = {
+                'enabled': True,
+                'host_ip': self.host_ip(index),
+                'hypervisor_type': 'QEMU',
+                'hypervisor_version': 1001000,
+                'supported_instances': [('x86_64', 'qemu', 'hvm'),
+                                        ('i686', 'qemu', 'hvm')],
+                'cpu_arch': 'x86_64',
+                'gpus': index % 10 == 0 and 'yes' or 'no',
+                'timestamp': self.now,
+        }
+
+        aggregate = index % self.num_aggregates
+        ssd = aggregate % 2 == 0 and 'true' or 'false'
+        # Unscoped extra specs are matched against both capabilities and
+        # aggregate metadata, so hosts report what their aggregate says.
+        self.service_states[(host, node)]['ssd'] = ssd
+        self.aggregates[host] = {
+                'availability_zone': set(['az%d' % (aggregate % 3)]),
+                'ssd': set([ssd]),
+        }
+
+    def compute_node_get_all(self, context, updated_since=None):
+        if updated_since is None:
+            return self.compute_nodes
+        return [compute for compute in self.compute_nodes
+                if compute['updated_at'] >= updated_since]
+
+    def service_get_all(self, context, disabled=None, updated_since=None):
+        # Every compute service keeps sending heartbeats.
+        now = timeutils.utcnow()
+        for service in self.services:
+            service['updated_at'] = now
+        return self.services
+
+    def aggregate_metadata_get_by_host(self, context, host, key=None):
+        metadata = self.aggregates.get(host, {})
+        if key is not None:
+            return dict((k, v) for k, v in metadata.iteritems() if k == key)
+        return metadata
+
+    @contextlib.contextmanager
+    def serving_db(self):
+        """Serve the db calls made while scheduling from this fleet."""
+        names = ['compute_node_get_all', 'service_get_all',
+                 'aggregate_metadata_get_by_host']
+        saved = dict((name, getattr(db, name)) for name in names)
+        try:
+            for name in names:
+                setattr(db, name, getattr(self, name))
+            yield
+        finally:
+            for name, func in saved.iteritems():
+                setattr(db, name, func)
+
+    def make_request(self, kind, index):
+        """Return (request_spec, filter_properties, num_instances) for one
+        request of the given kind.
+        """
+        instance_type = dict(self.choice(FLAVORS))
+        num_instances = 1
+        instance_properties = dict(
+                project_id='project%d' % self.randint(0, 20),
+                user_id='user', os_type='linux',
+                memory_mb=instance_type['memory_mb'],
+                vcpus=instance_type['vcpus'],
+                root_gb=instance_type['root_gb'],
+                ephemeral_gb=instance_type['ephemeral_gb'])
+        image = {'properties': {'architecture': 'x86_64',
+                                'hypervisor_type': 'qemu',
+                                'vm_mode': 'hvm'}}
+        scheduler_hints = {}
+        filter_properties = {'scheduler_hints': scheduler_hints}
+
+        num_hosts = len(self.compute_nodes)
+        if kind == 'multi_boot':
+            num_instances = self.randint(2, 20)
+        elif kind == 'availability_zone':
+            instance_properties['availability_zone'] = 'az%d' % (
+                    index % 3)
+        elif kind == 'extra_specs':
+            instance_type['extra_specs'] = {'ssd': 'true',
+                                            'capabilities:gpus': 'no'}
+        elif kind == 'json_query':
+            scheduler_hints['query'] = jsonutils.dumps(
+                    ['and',
+                     ['>=', '$free_ram_mb', instance_type['memory_mb'] * 2],
+                     ['>=', '$free_disk_mb', 10240],
+                     ['<', '$num_instances', 30]])
+        elif kind == 'cidr_affinity':
+            scheduler_hints['build_near_host_ip'] = self.host_ip(
+                    self.randint(0, num_hosts - 1))
+            scheduler_hints['cidr'] = '/20'
+        elif kind == 'force_hosts':
+            filter_properties['force_hosts'] = [
+                    self.compute_nodes[self.randint(0, num_hosts - 1)][
+                            'service']['host']]
+        elif kind == 'retry':
+            tried = []
+            for i in xrange(2):
+                compute = self.compute_nodes[self.randint(0, num_hosts - 1)]
+                tried.append([compute['service']['host'],
+                              compute['hypervisor_hostname']])
+            filter_properties['retry'] = {'num_attempts': 1,
+                                          'hosts': tried}
+
+        request_spec = {'instance_properties': instance_properties,
+                        'instance_type': instance_type,
+                        'image': image,
+                        'num_instances': num_instances}
+        return request_spec, filter_properties, num_instances
+
+    def request_mix(self, num_requests):
+        """Yield (kind, request_spec, filter_properties, num_instances)."""
+        kinds = []
+        for kind, weight in REQUEST_MIX:
+            kinds.extend([kind] * weight)
+        for index in xrange(num_requests):
+            kind = self.choice(kinds)
+            request = self.make_request(kind, index)
+            yield (kind,) + request
+
+
+class Timings(object):
+    """Accumulates call counts, time spent and objects in and out."""
+
+    def __init__(self):
+        self.data = collections.defaultdict(
+                lambda: dict(calls=0, seconds=0.0, objs_in=0, objs_out=0))
+
+    def add(self, name, seconds, objs_in=0, objs_out=0):
+        entry = self.data[name]
+        entry['calls'] += 1
+        entry['seconds'] += seconds
+        entry['objs_in'] += objs_in
+        entry['objs_out'] += objs_out
+
+    def report(self):
+        return dict((name, dict(entry))
+                    for name, entry in self.data.iteritems())
+
+
+def _timed_filter_class(filter_cls, timings):
+    """Return a subclass of filter_cls recording its cost in timings."""
+
+    class TimedFilter(filter_cls):
+        def filter_all(self, filter_obj_list, filter_properties):
+            filter_obj_list = list(filter_obj_list)
+            start = time.time()
+            passed = list(super(TimedFilter, self).filter_all(
+                    filter_obj_list, filter_properties))
+            timings.add(filter_cls.__name__, time.time() - start,
+                        len(filter_obj_list), len(passed))
+            return passed
+
+        def filter_columns(self, columns, filter_properties):
+            start = time.time()
+            mask = super(TimedFilter, self).filter_columns(
+                    columns, filter_properties)
+            if mask is not None:
+                timings.add(filter_cls.__name__, time.time() - start,
+                            len(columns), int(mask.sum()))
+            return mask
+
+    TimedFilter.__name__ = filter_cls.__name__
+    return TimedFilter
+
+
+def _timed_weigher_class(weigher_cls, timings):
+    """Return a subclass of weigher_cls recording its cost in timings."""
+
+    class TimedWeigher(weigher_cls):
+        def weigh_objects(self, weighed_obj_list, weight_properties):
+            start = time.time()
+            super(TimedWeigher, self).weigh_objects(weighed_obj_list,
+                                                    weight_properties)
+            timings.add(weigher_cls.__name__, time.time() - start,
+                        len(weighed_obj_list), len(weighed_obj_list))
+
+        def weigh_columns(self, columns, weight_properties):
+            start = time.time()
+            result = super(TimedWeigher, self).weigh_columns(
+                    columns, weight_properties)
+            if result is not None:
+                timings.add(weigher_cls.__name__, time.time() - start,
+                            len(columns), len(columns))
+            return result
+
+    TimedWeigher.__name__ = weigher_cls.__name__
+    return TimedWeigher
+
+
+class BenchmarkScheduler(filter_scheduler.FilterScheduler):
+    """FilterScheduler whose host manager records per filter and per
+    weigher timings.
+    """
+
+    def __init__(self, fleet, filter_names=None):
+        super(BenchmarkScheduler, self).__init__()
+        self.host_manager = host_manager.HostManager()
+        self.host_manager.service_states = fleet.service_states
+        self.filter_names = filter_names or BENCHMARK_FILTERS
+        self.filter_timings = Timings()
+        self.weigher_timings = Timings()
+        self.phase_timings = Timings()
+        hm = self.host_manager
+        hm.filter_classes = [_timed_filter_class(cls, self.filter_timings)
+                             for cls in hm.filter_classes]
+        hm.weight_classes = [_timed_weigher_class(cls, self.weigher_timings)
+                             for cls in hm.weight_classes]
+
+        get_filtered_hosts = hm.get_filtered_hosts
+
+        def _get_filtered_hosts(hosts, filter_properties,
+                                filter_class_names=None):
+            return get_filtered_hosts(hosts, filter_properties,
+                    filter_class_names=self.filter_names)
+
+        hm.get_filtered_hosts = _get_filtered_hosts
+        self._wrap_phase('get_all_host_states')
+        self._wrap_phase('get_filtered_hosts')
+        self._wrap_phase('get_weighed_hosts')
+
+    def _wrap_phase(self, name):
+        func = getattr(self.host_manager, name)
+        timings = self.phase_timings
+
+        def _timed(*args, **kwargs):
+            start = time.time()
+            result = func(*args, **kwargs)
+            timings.add(name, time.time() - start)
+            return result
+
+        setattr(self.host_manager, name, _timed)
+
+    def _get_configuration_options(self):
+        return {}
+
+
+def _objects_in_memory():
+    gc.collect()
+    return len(gc.get_objects())
+
+
+def run_benchmark(num_hosts, num_requests, filter_names=None, seed=0):
+    """Schedule num_requests requests from the mix on a fleet of num_hosts
+    hosts and return a report dict.
+
+    The report holds end to end placements per second, time spent in each
+    scheduling phase, filter and weigher, the time per request kind, the
+    number of objects left allocated and the peak resident set size.
+    """
+    fleet = Fleet(num_hosts, seed=seed)
+    sched = BenchmarkScheduler(fleet, filter_names)
+    ctxt = context.get_admin_context()
+    request_timings = Timings()
+    placements = 0
+    failures = 0
+    objects_before = _objects_in_memory()
+    start = time.time()
+    with fleet.serving_db():
+        for kind, request_spec, filter_properties, num_instances in \
+                fleet.request_mix(num_requests):
+            request_start = time.time()
+            instance_uuids = ['%s-%d' % (kind, i)
+                              for i in xrange(num_instances)]
+            try:
+                selected = sched._schedule(ctxt, request_spec,
+                                           filter_properties, instance_uuids)
+            except exception.NoValidHost:
+                selected = []
+            placements += len(selected)
+            failures += num_instances - len(selected)
+            request_timings.add(kind, time.time() - request_start,
+                                num_instances, len(selected))
+    elapsed = time.time() - start
+    objects_after = _objects_in_memory()
+
+    return {
+        'hosts': num_hosts,
+        'requests': num_requests,
+        'placements': placements,
+        'failed_placements': failures,
+        'seconds': elapsed,
+        'placements_per_second': placements / elapsed if elapsed else 0.0,
+        'phases': sched.phase_timings.report(),
+        'filters': sched.filter_timings.report(),
+        'weighers': sched.weigher_timings.report(),
+        'requests_by_kind': request_timings.report(),
+        'objects_retained': objects_after - objects_before,
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def format_report(report):
+    """Return a human readable version of a run_benchmark() report."""
+    lines = ['%(hosts)d hosts, %(requests)d requests: %(placements)d '
+             'placements (%(failed_placements)d failed) in %(seconds).3fs, '
+             '%(placements_per_second).1f placements/s' % report,
+             'objects retained: %(objects_retained)d, max RSS: '
+             '%(max_rss_kb)d KB' % report]
+    for section in ('phases', 'filters', 'weighers', 'requests_by_kind'):
+        lines.append('')
+        lines.append('%-36s %8s %10s %10s %12s %12s' % (
+                section, 'calls', 'total ms', 'ms/call', 'objs in',
+                'objs out'))
+        entries = sorted(report[section].iteritems(),
+                         key=lambda item: item[1]['seconds'], reverse=True)
+        for name, entry in entries:
+            lines.append('%-36s %8d %10.1f %10.3f %12d %12d' % (
+                    name, entry['calls'], entry['seconds'] * 1000,
+                    entry['seconds'] * 1000 / max(entry['calls'], 1),
+                    entry['objs_in'], entry['objs_out']))
+    return '\n'.join(lines)
+
+
+def add_arguments(parser):
+    parser.add_argument('--hosts', type=benchmarks.int_list,
+                        default=[1000, 5000],
+                        help='comma separated fleet sizes to benchmark')
+    parser.add_argument('--requests', type=int, default=100,
+                        help='number of scheduling requests per fleet')
+    parser.add_argument('--filters', default=None,
+                        help='comma separated filter class names to use '
+                             'instead of the benchmark defaults')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed for the synthetic fleet and requests')
+
+
+def run(args):
+    filter_names = args.filters and args.filters.split(',') or None
+    return [run_benchmark(num_hosts, args.requests,
+                          filter_names=filter_names, seed=args.seed)
+            for num_hosts in args.hosts]
@@ -0,0 +1,67 @@
+# Copyright 2013 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For the scheduler benchmark harness.
+"""
+
+from nova import db
+from nova import test
+from nova.tests.scheduler import benchmark
+
+
+class SchedulerBenchmarkTestCase(test.TestCase):
+    def test_fleet_is_deterministic(self):
+        fleet1 = benchmark.Fleet(20, seed=42)
+        fleet2 = benchmark.Fleet(20, seed=42)
+        self.assertEqual(
+                [(c['free_ram_mb'], c['vcpus_used'], c['stats'])
+                 for c in fleet1.compute_nodes],
+                [(c['free_ram_mb'], c['vcpus_used'], c['stats'])
+                 for c in fleet2.compute_nodes])
+
+    def test_serving_db_restores_db_api(self):
+        fleet = benchmark.Fleet(5)
+        original = db.compute_node_get_all
+        with fleet.serving_db():
+            self.assertEqual(len(db.compute_node_get_all(None)), 5)
+            self.assertEqual(
+                    db.aggregate_metadata_get_by_host(
+                            None, 'host00001', key='availability_zone'),
+                    {'availability_zone': set(['az1'])})
+        self.assertEqual(db.compute_node_get_all, original)
+
+    def test_run_benchmark(self):
+        report = benchmark.run_benchmark(50, 40)
+        self.assertEqual(report['hosts'], 50)
+        self.assertEqual(report['requests'], 40)
+        self.assertTrue(report['placements'] > 0)
+        self.assertEqual(
+                sum(entry['objs_out']
+                    for entry in report['requests_by_kind'].values()),
+                report['placements'])
+        self.assertEqual(set(report['filters'].keys()),
+                         set(benchmark.BENCHMARK_FILTERS))
+        self.assertIn('RAMWeigher', report['weighers'])
+        self.assertEqual(report['phases']['get_all_host_states']['calls'],
+                         40)
+        self.assertTrue(benchmark.format_report(report))
+
+    def test_run_benchmark_raises_scheduler_errors(self):
+        def fake_schedule(*args, **kwargs):
+            raise ValueError()
+
+        self.stubs.Set(benchmark.BenchmarkScheduler, '_schedule',
+                       fake_schedule)
+        self.assertRaises(ValueError, benchmark.run_benchmark, 5, 1)
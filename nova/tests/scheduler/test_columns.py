@@ -0,0 +1,132 @@
+# Copyright 2013 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For columnar evaluation of scheduler filters and weighers.
+"""
+
+from nova.scheduler import columns
+from nova.scheduler import filters
+from nova.scheduler import weights
+from nova import test
+from nova.tests.scheduler import fakes
+
+
+class OddHostFilter(filters.BaseHostFilter):
+    """A filter without columnar support."""
+    def host_passes(self, host_state, filter_properties):
+        return int(host_state.host[4:]) % 2 == 1
+
+
+class InstancesWeigher(weights.BaseHostWeigher):
+    """A weigher without columnar support."""
+    def _weigh_object(self, host_state, weight_properties):
+        return -host_state.num_instances
+
+
+class ColumnarEvaluationTestCase(test.TestCase):
+    def setUp(self):
+        super(ColumnarEvaluationTestCase, self).setUp()
+        if columns.numpy is None:
+            self.skipTest("NumPy not available")
+        self.filter_handler = filters.HostFilterHandler()
+        self.weight_handler = weights.HostWeightHandler()
+        self.class_map = dict((cls.__name__, cls)
+                              for cls in filters.all_filters())
+        self.instance_type = {'memory_mb': 1024, 'vcpus': 2,
+                              'root_gb': 10, 'ephemeral_gb': 10}
+        self.flags(ram_allocation_ratio=1.5, cpu_allocation_ratio=2.0,
+                   disk_allocation_ratio=1.0, max_io_ops_per_host=4,
+                   max_instances_per_host=10)
+
+    def _get_hosts(self):
+        hosts = []
+        for i in xrange(40):
+            hosts.append(fakes.FakeHostState('host%s' % i, 'node', {
+                    'free_ram_mb': 128 * (i % 16) - 512,
+                    'total_usable_ram_mb': 2048,
+                    'free_disk_mb': 1024 * (i % 25),
+                    'total_usable_disk_gb': 24,
+                    'vcpus_total': i % 5,
+                    'vcpus_used': i % 7,
+                    'num_io_ops': i % 6,
+                    'num_instances': i % 13}))
+        return hosts
+
+    def _filter(self, filter_names, columnar):
+        self.flags(scheduler_columnar_evaluation=columnar)
+        filter_classes = [self.class_map.get(name, OddHostFilter)
+                          for name in filter_names]
+        hosts = self._get_hosts()
+        filter_properties = {'instance_type': self.instance_type}
+        passed = self.filter_handler.get_filtered_objects(filter_classes,
+                hosts, filter_properties)
+        return [(host.host, host.limits) for host in passed]
+
+    def _weigh(self, weigher_classes, columnar):
+        self.flags(scheduler_columnar_evaluation=columnar)
+        weighed = self.weight_handler.get_weighed_objects(weigher_classes,
+                self._get_hosts(), {})
+        return [(w.obj.host, w.weight) for w in weighed]
+
+    def _assert_filters_match(self, filter_names):
+        expected = self._filter(filter_names, False)
+        self.assertTrue(expected)
+        self.assertEqual(expected, self._filter(filter_names, True))
+
+    def test_ram_filter(self):
+        self._assert_filters_match(['RamFilter'])
+
+    def test_core_filter(self):
+        self._assert_filters_match(['CoreFilter'])
+
+    def test_core_filter_no_instance_type(self):
+        self.instance_type = None
+        self._assert_filters_match(['CoreFilter'])
+
+    def test_disk_filter(self):
+        self._assert_filters_match(['DiskFilter'])
+
+    def test_io_ops_filter(self):
+        self._assert_filters_match(['IoOpsFilter'])
+
+    def test_num_instances_filter(self):
+        self._assert_filters_match(['NumInstancesFilter'])
+
+    def test_mixed_filters_fall_back(self):
+        self._assert_filters_match(['RamFilter',
+                                    'OddHostFilter',
+                                    'DiskFilter',
+                                    'IoOpsFilter'])
+
+    def test_ram_weigher(self):
+        weigher_classes = self.weight_handler.get_matching_classes(
+                ['nova.scheduler.weights.ram.RAMWeigher'])
+        self.flags(ram_weight_multiplier=-1.0)
+        self.assertEqual(self._weigh(weigher_classes, False),
+                         self._weigh(weigher_classes, True))
+
+    def test_mixed_weighers_fall_back(self):
+        weigher_classes = self.weight_handler.get_matching_classes(
+                ['nova.scheduler.weights.ram.RAMWeigher'])
+        weigher_classes.append(InstancesWeigher)
+        expected = self._weigh(weigher_classes, False)
+        self.assertEqual(expected, self._weigh(weigher_classes, True))
+        self.assertEqual(expected[0], ('host15', 1406.0))
+
+    def test_enabled_without_numpy(self):
+        self.flags(scheduler_columnar_evaluation=True)
+        self.assertTrue(columns.enabled())
+        self.stubs.Set(columns, 'numpy', None)
+        self.assertFalse(columns.enabled())
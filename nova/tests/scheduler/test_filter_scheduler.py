@@ -176,6 +176,45 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
         for weighed_host in weighed_hosts:
             self.assertTrue(weighed_host.obj is not None)
 
+    def _schedule_many(self, incremental):
+        self.flags(scheduler_incremental_selection=incremental,
+                   scheduler_default_filters=['RamFilter', 'CoreFilter',
+                                              'NumInstancesFilter'],
+                   ram_allocation_ratio=1.0, cpu_allocation_ratio=1.0,
+                   max_instances_per_host=4)
+        sched = fakes.FakeFilterScheduler()
+        fake_context = context.RequestContext('user', 'project',
+                is_admin=True)
+
+        def _fake_get_all_host_states(context):
+            # Some hosts share free RAM so that ties have to be broken.
+            return [fakes.FakeHostState('host%s' % i, 'node', {
+                            'free_ram_mb': 512 * (i % 7),
+                            'total_usable_ram_mb': 4096,
+                            'vcpus_total': 4, 'vcpus_used': i % 4})
+                    for i in xrange(30)]
+
+        self.stubs.Set(sched.host_manager, 'get_all_host_states',
+                _fake_get_all_host_states)
+
+        request_spec = {'num_instances': 40,
+                        'instance_type': {'memory_mb': 512, 'root_gb': 1,
+                                          'ephemeral_gb': 0, 'vcpus': 1},
+                        'instance_properties': {'project_id': 1,
+                                                'root_gb': 1,
+                                                'memory_mb': 512,
+                                                'ephemeral_gb': 0,
+                                                'vcpus': 1,
+                                                'os_type': 'Linux'}}
+        weighed_hosts = sched._schedule(fake_context, request_spec, {})
+        return [(weighed_host.obj.host, weighed_host.weight)
+                for weighed_host in weighed_hosts]
+
+    def test_schedule_incremental_selection_matches_full(self):
+        expected = self._schedule_many(False)
+        self.assertEqual(len(expected), 40)
+        self.assertEqual(expected, self._schedule_many(True))
+
     def test_schedule_prep_resize_doesnt_update_host(self):
         fake_context = context.RequestContext('user', 'project',
                 is_admin=True)
@@ -15,6 +15,10 @@
 """
 Tests For HostManager
 """
+import datetime
+
+import mox
+
 from nova.compute import task_states
 from nova.compute import vm_states
 from nova import db
@@ -266,6 +270,111 @@ class HostManagerTestCase(test.TestCase):
         self.assertEqual(host_states_map[('host4', 'node4')].free_disk_mb,
                          8388608)
 
+    def test_get_all_host_states_within_max_age(self):
+        self.flags(scheduler_host_state_max_age=60)
+        context = 'fake_context'
+        timeutils.set_time_override()
+
+        self.mox.StubOutWithMock(db, 'compute_node_get_all')
+        db.compute_node_get_all(context).AndReturn(fakes.COMPUTE_NODES)
+
+        self.mox.ReplayAll()
+        self.host_manager.get_all_host_states(context)
+        timeutils.advance_time_seconds(30)
+        host_states = list(self.host_manager.get_all_host_states(context))
+        self.assertEqual(len(host_states), 4)
+
+    def test_get_all_host_states_incremental(self):
+        context = 'fake_context'
+        timeutils.set_time_override()
+        synced_at = timeutils.utcnow()
+
+        compute_nodes = []
+        for i in xrange(4):
+            compute = dict(fakes.COMPUTE_NODES[i], updated_at=synced_at)
+            compute['service'] = dict(compute['service'], id=i + 1)
+            compute_nodes.append(compute)
+        changed = dict(compute_nodes[0], free_ram_mb=256,
+                       updated_at=synced_at + datetime.timedelta(seconds=1))
+        services = [dict(compute_nodes[2]['service'], disabled=True)]
+        updated_since = synced_at - datetime.timedelta(seconds=10)
+
+        self.mox.StubOutWithMock(db, 'compute_node_get_all')
+        self.mox.StubOutWithMock(db, 'service_get_all')
+        db.compute_node_get_all(context).AndReturn(compute_nodes)
+        db.compute_node_get_all(context,
+                updated_since=updated_since).AndReturn([changed])
+        db.service_get_all(context,
+                updated_since=updated_since).AndReturn(services)
+
+        self.mox.ReplayAll()
+        self.host_manager.get_all_host_states(context)
+        timeutils.advance_time_seconds(1)
+        self.host_manager.get_all_host_states(context)
+        host_states_map = self.host_manager.host_state_map
+
+        self.assertEqual(len(host_states_map), 4)
+        self.assertEqual(host_states_map[('host1', 'node1')].free_ram_mb,
+                         256)
+        self.assertEqual(host_states_map[('host2', 'node2')].free_ram_mb,
+                         1024)
+        self.assertTrue(host_states_map[('host3', 'node3')].service[
+                'disabled'])
+        self.assertFalse(host_states_map[('host4', 'node4')].service[
+                'disabled'])
+        self.assertEqual(self.host_manager.synced_at,
+                         synced_at + datetime.timedelta(seconds=1))
+
+    def test_get_all_host_states_skips_unchanged_nodes(self):
+        context = 'fake_context'
+        timeutils.set_time_override()
+        updated_at = timeutils.utcnow()
+        timeutils.advance_time_seconds(60)
+
+        compute_nodes = [dict(compute, updated_at=updated_at)
+                         for compute in fakes.COMPUTE_NODES]
+        # Updated within the window, so not known to be applied yet
+        compute_nodes[1]['updated_at'] = timeutils.utcnow()
+        applied = []
+
+        def fake_update_from_compute_node(host_state, compute):
+            applied.append(compute['id'])
+
+        self.stubs.Set(host_manager.HostState, 'update_from_compute_node',
+                       fake_update_from_compute_node)
+        self.mox.StubOutWithMock(db, 'compute_node_get_all')
+        self.mox.StubOutWithMock(db, 'service_get_all')
+        db.compute_node_get_all(context).AndReturn(compute_nodes)
+        db.compute_node_get_all(context, updated_since=mox.IgnoreArg()
+                ).AndReturn(compute_nodes[:2])
+        db.service_get_all(context, updated_since=mox.IgnoreArg()
+                ).AndReturn([])
+
+        self.mox.ReplayAll()
+        self.host_manager.get_all_host_states(context)
+        timeutils.advance_time_seconds(1)
+        self.host_manager.get_all_host_states(context)
+
+        self.assertEqual(applied, [1, 2, 3, 4, 2])
+
+    def test_get_all_host_states_full_sync_removes_hosts(self):
+        self.flags(scheduler_host_state_full_sync_interval=60)
+        context = 'fake_context'
+        timeutils.set_time_override()
+
+        self.mox.StubOutWithMock(db, 'compute_node_get_all')
+        db.compute_node_get_all(context).AndReturn(fakes.COMPUTE_NODES)
+        db.compute_node_get_all(context).AndReturn(fakes.COMPUTE_NODES[1:])
+
+        self.mox.ReplayAll()
+        self.host_manager.get_all_host_states(context)
+        timeutils.advance_time_seconds(61)
+        self.host_manager.get_all_host_states(context)
+        host_states_map = self.host_manager.host_state_map
+
+        self.assertEqual(len(host_states_map), 3)
+        self.assertFalse(('host1', 'node1') in host_states_map)
+
 
 class HostStateTestCase(test.TestCase):
     """Test case for HostState class."""
@@ -304,6 +413,83 @@ class HostStateTestCase(test.TestCase):
         self.assertEqual(1, host.num_instances_by_os_type['windoze'])
         self.assertEqual(42, host.num_io_ops)
 
+    def test_update_from_compute_node_skips_older(self):
+        updated_at = timeutils.utcnow()
+        compute = dict(stats=[dict(key='num_instances', value='5'),
+                              dict(key='num_proj_12345', value='3')],
+                       memory_mb=0, free_disk_gb=0, local_gb=0,
+                       local_gb_used=0, free_ram_mb=0, vcpus=0, vcpus_used=0,
+                       updated_at=updated_at)
+
+        host = host_manager.HostState("fakehost", "fakenode")
+        host.update_from_compute_node(compute)
+        self.assertEqual(5, host.num_instances)
+
+        self.mox.StubOutWithMock(host_manager, 'HostStats')
+        self.mox.ReplayAll()
+        host.update_from_compute_node(dict(
+                compute, free_ram_mb=1024,
+                updated_at=updated_at - datetime.timedelta(seconds=1)))
+        self.assertEqual(0, host.free_ram_mb)
+        self.mox.UnsetStubs()
+
+        host.update_from_compute_node(dict(compute, free_ram_mb=1024))
+        self.assertEqual(1024, host.free_ram_mb)
+
+        compute = dict(compute, updated_at=updated_at + datetime.timedelta(1),
+                       stats=[dict(key='num_instances', value='1'),
+                              dict(key='num_proj_23456', value='1')])
+        host.update_from_compute_node(compute)
+        self.assertEqual(1, host.num_instances)
+        self.assertEqual({'23456': 1}, host.num_instances_by_project)
+
+    def test_update_from_compute_node_reuses_stats(self):
+        updated_at = timeutils.utcnow()
+        compute = dict(stats=[dict(key='num_instances', value='5'),
+                              dict(key='num_proj_12345', value='3')],
+                       memory_mb=0, free_disk_gb=0, local_gb=0,
+                       local_gb_used=0, free_ram_mb=0, vcpus=0, vcpus_used=0,
+                       updated_at=updated_at)
+        instance = dict(root_gb=0, ephemeral_gb=0, memory_mb=0, vcpus=0,
+                        project_id='12345', vm_state=vm_states.BUILDING,
+                        task_state=None, os_type='Linux')
+
+        host = host_manager.HostState("fakehost", "fakenode")
+        host.update_from_compute_node(compute)
+        host.consume_from_instance(instance)
+        self.assertEqual(4, host.num_instances_by_project['12345'])
+
+        self.mox.StubOutWithMock(host_manager, 'HostStats')
+        self.mox.ReplayAll()
+        host.update_from_compute_node(dict(
+                compute, updated_at=timeutils.utcnow() +
+                datetime.timedelta(seconds=1)))
+        self.assertEqual(5, host.num_instances)
+        self.assertEqual({'12345': 3}, host.num_instances_by_project)
+        self.assertEqual({}, host.vm_states)
+        self.mox.UnsetStubs()
+
+        host.update_from_compute_node(dict(
+                compute, updated_at=timeutils.utcnow() +
+                datetime.timedelta(seconds=2),
+                stats=[dict(key='num_instances', value='6')]))
+        self.assertEqual(6, host.num_instances)
+        self.assertEqual({}, host.num_instances_by_project)
+
+    def test_host_stats(self):
+        stats = host_manager.HostStats([
+                dict(key='num_instances', value='2'),
+                dict(key='io_workload', value='1'),
+                dict(key='num_vm_%s' % vm_states.ACTIVE, value='2'),
+                dict(key='num_os_type_linux', value='2'),
+                dict(key='num_unknown', value='7')])
+        self.assertEqual(2, stats.num_instances)
+        self.assertEqual(1, stats.num_io_ops)
+        self.assertEqual({vm_states.ACTIVE: 2}, stats.vm_states)
+        self.assertEqual({'linux': 2}, stats.num_instances_by_os_type)
+        self.assertEqual({}, stats.num_instances_by_project)
+        self.assertEqual({}, stats.task_states)
+
     def test_stat_consumption_from_instance(self):
         host = host_manager.HostState("fakehost", "fakenode")
 
@@ -0,0 +1,53 @@
+# Copyright 2013 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For the benchmark harness.
+"""
+
+from nova import test
+from nova.tests import benchmarks
+from nova.tests.network import iptables_benchmark
+from nova.tests.scheduler import benchmark as scheduler_benchmark
+
+
+class BenchmarkHarnessTestCase(test.TestCase):
+    def _run(self, *argv):
+        module, args, remaining = benchmarks.parse_args(
+                ['benchmark.py'] + list(argv))
+        reports = module.run(args)
+        for report in reports:
+            self.assertTrue(module.format_report(report))
+        return module, args, remaining, reports
+
+    def test_scheduler(self):
+        module, args, remaining, reports = self._run(
+                'scheduler', '--hosts', '10,20', '--requests', '5',
+                '--config-file', 'nova.conf')
+        self.assertEqual(module, scheduler_benchmark)
+        self.assertEqual(remaining,
+                         ['benchmark.py', '--config-file', 'nova.conf'])
+        self.assertEqual([report['hosts'] for report in reports], [10, 20])
+
+    def test_iptables(self):
+        module, args, remaining, reports = self._run(
+                'iptables', '--rules', '100', '--applies', '1', '--json')
+        self.assertEqual(module, iptables_benchmark)
+        self.assertTrue(args.json)
+        self.assertEqual(len(reports), 1)
+
+    def test_jsonutils(self):
+        module, args, remaining, reports = self._run(
+                'jsonutils', '--iterations', '1')
+        self.assertEqual(reports[0]['payloads'], 2)
@@ -29,6 +29,7 @@ from nova.openstack.common import cfg
 from nova.openstack.common import timeutils
 from nova import test
 from nova.tests import matchers
+from nova import utils
 
 
 CONF = cfg.CONF
@@ -105,6 +106,21 @@ class DbApiTestCase(test.TestCase):
         result = db.instance_get_all_by_filters(self.context, {})
         self.assertEqual(2, len(result))
 
+    def test_instance_get_all_by_filters_fields(self):
+        self.create_instances_with_args(display_name='test1',
+                                        metadata={'foo': 'bar'})
+        result = db.instance_get_all_by_filters(
+                self.context, {'display_name': 'test1'},
+                fields=['display_name', 'metadata'])
+        self.assertEqual(1, len(result))
+        loaded = result[0].__dict__
+        self.assertEqual(loaded['display_name'], 'test1')
+        self.assertEqual(loaded['metadata'][0]['key'], 'foo')
+        self.assertIn('uuid', loaded)
+        self.assertNotIn('host', loaded)
+        self.assertNotIn('info_cache', loaded)
+        self.assertNotIn('system_metadata', loaded)
+
     def test_instance_get_all_by_filters_regex(self):
         self.create_instances_with_args(display_name='test1')
         self.create_instances_with_args(display_name='teeeest2')
@@ -183,6 +199,59 @@ class DbApiTestCase(test.TestCase):
                           self.context, {'display_name': '%test%'},
                           marker=str(stdlib_uuid.uuid4()))
 
+    def test_instance_get_all_by_filters_paginate_cursor(self):
+        self.flags(sql_connection="notdb://")
+        test1 = self.create_instances_with_args(display_name='test1')
+        test2 = self.create_instances_with_args(display_name='test2')
+        test3 = self.create_instances_with_args(display_name='test3')
+
+        def cursor(instance):
+            return utils.encode_pagination_cursor(
+                    {'created_at': instance['created_at'],
+                     'uuid': instance['uuid']})
+
+        for marker, expected in ((test1, [test2, test3]),
+                                 (test2, [test3]),
+                                 (test3, [])):
+            by_uuid = db.instance_get_all_by_filters(
+                    self.context, {'display_name': '%test%'},
+                    sort_dir="asc", marker=marker['uuid'])
+            by_cursor = db.instance_get_all_by_filters(
+                    self.context, {'display_name': '%test%'},
+                    sort_dir="asc", marker=cursor(marker))
+            self.assertEqual([i['uuid'] for i in expected],
+                             [i['uuid'] for i in by_uuid])
+            self.assertEqual([i['uuid'] for i in expected],
+                             [i['uuid'] for i in by_cursor])
+
+        result = db.instance_get_all_by_filters(
+                self.context, {'display_name': '%test%'},
+                marker=cursor(test3))
+        self.assertEqual([test2['uuid'], test1['uuid']],
+                         [i['uuid'] for i in result])
+
+        no_created_at = utils.encode_pagination_cursor({'uuid': test1['uuid']})
+        for marker in ('asdf', no_created_at):
+            self.assertRaises(exception.MarkerNotFound,
+                              db.instance_get_all_by_filters,
+                              self.context, {'display_name': '%test%'},
+                              marker=marker)
+
+    def test_instance_get_all_by_filters_paginate_null_sort_key(self):
+        self.flags(sql_connection="notdb://")
+        test1 = self.create_instances_with_args(display_name='test1')
+        test2 = self.create_instances_with_args(display_name='test2')
+        result = db.instance_get_all_by_filters(
+                self.context, {'display_name': '%test%'},
+                sort_key='launched_at', sort_dir='asc',
+                marker=test1['uuid'])
+        self.assertEqual([test2['uuid']], [i['uuid'] for i in result])
+        result = db.instance_get_all_by_filters(
+                self.context, {'display_name': '%test%'},
+                sort_key='launched_at', sort_dir='desc',
+                marker=test2['uuid'])
+        self.assertEqual([test1['uuid']], [i['uuid'] for i in result])
+
     def test_migration_get_unconfirmed_by_dest_compute(self):
         ctxt = context.get_admin_context()
 
@@ -814,8 +883,14 @@ class DbApiTestCase(test.TestCase):
         self.assertEqual(record['instance_hostname'], instance['hostname'])
         self.assertEqual(record['vif_id'], vif['id'])
         self.assertEqual(record['vif_address'], vif['address'])
+        self.assertEqual(record['id'],
+                         db.fixed_ip_get_by_address(ctxt, 'baz')['id'])
         data = db.network_get_associated_fixed_ips(ctxt, 1, 'nothing')
         self.assertEqual(len(data), 0)
+        data = db.network_get_associated_fixed_ips(ctxt, 1, address='baz')
+        self.assertEqual([record['address'] for record in data], ['baz'])
+        data = db.network_get_associated_fixed_ips(ctxt, 1, address='qux')
+        self.assertEqual(len(data), 0)
 
     def test_network_get_all_by_host(self):
         ctxt = context.get_admin_context()
@@ -1410,6 +1485,64 @@ class CapacityTestCase(test.TestCase):
         self.assertEqual(2, int(stats['num_proj_12345']))
         self.assertEqual(3, int(stats['num_vm_building']))
 
+    def test_compute_node_get_by_hosts(self):
+        self._create_helper('host1')
+        service = db.service_create(self.ctxt, dict(host='host2',
+                                                    binary='binary2',
+                                                    topic='compute',
+                                                    report_count=1,
+                                                    disabled=False))
+        compute_node_dict = dict(self.compute_node_dict,
+                                 service_id=service['id'],
+                                 hypervisor_hostname='hv2', stats={})
+        db.compute_node_create(self.ctxt, compute_node_dict)
+
+        nodes = db.compute_node_get_by_hosts(self.ctxt,
+                                             ['host1', 'host2', 'host3'])
+        self.assertEqual(sorted(nodes.keys()), ['host1', 'host2'])
+        self.assertEqual(nodes['host2']['hypervisor_hostname'], 'hv2')
+        self.assertEqual(nodes['host1']['service']['host'], 'host1')
+        self.assertEqual(db.compute_node_get_by_hosts(self.ctxt, []), {})
+
+    def test_compute_node_get_all_updated_since(self):
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        item1 = db.compute_node_create(self.ctxt,
+                                       dict(self.compute_node_dict, stats={}))
+        timeutils.advance_time_seconds(10)
+        since = timeutils.utcnow()
+        item2 = db.compute_node_create(self.ctxt,
+                                       dict(self.compute_node_dict, stats={}))
+
+        nodes = db.compute_node_get_all(self.ctxt, updated_since=since)
+        self.assertEqual([item2['id']], [node['id'] for node in nodes])
+
+        timeutils.advance_time_seconds(10)
+        since = timeutils.utcnow()
+        db.compute_node_update(self.ctxt, item1['id'], {'vcpus': 4})
+        nodes = db.compute_node_get_all(self.ctxt, updated_since=since)
+        self.assertEqual([item1['id']], [node['id'] for node in nodes])
+        self.assertEqual(4, nodes[0]['vcpus'])
+
+    def test_service_get_all_updated_since(self):
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        timeutils.advance_time_seconds(10)
+        since = timeutils.utcnow()
+        service = db.service_create(self.ctxt, dict(host='host2',
+                                                    binary='binary2',
+                                                    topic='compute',
+                                                    report_count=1,
+                                                    disabled=False))
+        services = db.service_get_all(self.ctxt, updated_since=since)
+        self.assertEqual([service['id']], [s['id'] for s in services])
+
+        timeutils.advance_time_seconds(10)
+        since = timeutils.utcnow()
+        db.service_update(self.ctxt, self.service['id'], {'report_count': 2})
+        services = db.service_get_all(self.ctxt, updated_since=since)
+        self.assertEqual([self.service['id']], [s['id'] for s in services])
+
     def test_compute_node_update(self):
         item = self._create_helper('host1')
 
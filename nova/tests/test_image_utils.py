@@ -14,8 +14,15 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import hashlib
 import os
+import time
 
+import fixtures
+import mox
+
+from nova import exception
+from nova.image import glance
 from nova import test
 from nova import utils
 
@@ -236,3 +243,162 @@ ID        TAG                 VM SIZE                DATE       VM CLOCK
         self.assertEquals(67108864, image_info.virtual_size)
         self.assertEquals(98304, image_info.disk_size)
         self.assertEquals(3, len(image_info.snapshots))
+
+
+class FakeImageService(object):
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def download(self, context, image_id, data):
+        for chunk in self.chunks:
+            data.write(chunk)
+
+
+class ImageFetchTestCase(test.TestCase):
+    def setUp(self):
+        super(ImageFetchTestCase, self).setUp()
+        self.tmpdir = self.useFixture(fixtures.TempDir()).path
+
+    def _stub_image_service(self, chunks):
+        self.stubs.Set(glance, 'get_remote_image_service',
+                       lambda context, href: (FakeImageService(chunks), href))
+
+    def test_image_file_skips_zero_blocks(self):
+        block = images.ImageFile.BLOCK_SIZE
+        data = ('a' * 10 + '\0' * (block - 10) + '\0' * block * 2 +
+                'b' * block + '\0' * (block + 7))
+        writes = []
+        path = os.path.join(self.tmpdir, 'image')
+
+        with open(path, 'wb') as image_file:
+            real_write = image_file.write
+
+            class RecordingFile(object):
+                def write(self, data):
+                    writes.append(len(data))
+                    real_write(data)
+
+                def __getattr__(self, name):
+                    return getattr(image_file, name)
+
+            fetched = images.ImageFile(RecordingFile())
+            # chunks not aligned to blocks, like a download delivers them
+            for start in xrange(0, len(data), 1000):
+                fetched.write(data[start:start + 1000])
+            fetched.close()
+
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+        self.assertEqual(writes, [block, block])
+        self.assertEqual(fetched.size, len(data))
+        self.assertEqual(fetched.checksum, hashlib.sha1(data).hexdigest())
+
+    def test_fetch_to_raw_raw_image(self):
+        chunks = ['x' * 300, '\0' * 100000, 'y' * 5]
+        self._stub_image_service(chunks)
+        self.mox.StubOutWithMock(images, 'qemu_img_info')
+        images.qemu_img_info(mox.IgnoreArg()).AndReturn(
+            images.QemuImgInfo('file format: raw'))
+        self.mox.ReplayAll()
+
+        path = os.path.join(self.tmpdir, 'image')
+        checksum = images.fetch_to_raw(None, 'fake-image', path, None, None)
+
+        self.assertEqual(checksum,
+                         hashlib.sha1(''.join(chunks)).hexdigest())
+        with open(path) as f:
+            self.assertEqual(f.read(), ''.join(chunks))
+        self.assertEqual(os.listdir(self.tmpdir), ['image'])
+
+    def test_fetch_to_raw_rejects_backing_file(self):
+        # NOTE: qemu-img info has the last word on the image, whatever
+        #       its header looks like.
+        self._stub_image_service(['x' * 1000])
+        self.mox.StubOutWithMock(images, 'qemu_img_info')
+        images.qemu_img_info(mox.IgnoreArg()).AndReturn(
+            images.QemuImgInfo('file format: vmdk\n'
+                               'backing file: /etc/shadow'))
+        self.mox.ReplayAll()
+
+        path = os.path.join(self.tmpdir, 'image')
+        self.assertRaises(exception.ImageUnacceptable, images.fetch_to_raw,
+                          None, 'fake-image', path, None, None)
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_fetch_to_raw_converts_qcow2_image(self):
+        self.flags(force_raw_images=True)
+        self._stub_image_service(['QFI\xfb\0\0\0\x02', '\0' * 1000])
+        path = os.path.join(self.tmpdir, 'image')
+
+        def fake_qemu_img_info(path):
+            fmt = path.endswith('.part') and 'qcow2' or 'raw'
+            return images.QemuImgInfo('file format: %s' % fmt)
+
+        def fake_convert_image(source, dest, out_format):
+            with open(dest, 'w') as f:
+                f.write('converted')
+
+        self.stubs.Set(images, 'qemu_img_info', fake_qemu_img_info)
+        self.stubs.Set(images, 'convert_image', fake_convert_image)
+
+        checksum = images.fetch_to_raw(None, 'fake-image', path, None, None)
+
+        self.assertEqual(checksum, None)
+        with open(path) as f:
+            self.assertEqual(f.read(), 'converted')
+        self.assertEqual(os.listdir(self.tmpdir), ['image'])
+
+
+class QemuImgInfoCacheTestCase(test.TestCase):
+    def setUp(self):
+        super(QemuImgInfoCacheTestCase, self).setUp()
+        self.stubs.Set(images, '_qemu_img_info_cache',
+                       images.QemuImgInfoCache())
+        self.path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                 'disk')
+        with open(self.path, 'w') as f:
+            f.write('disk')
+        self._set_mtime(1000)
+
+        self.runs = []
+
+        def fake_execute(*cmd):
+            self.runs.append(cmd[-1])
+            return 'file format: qcow2\nbacking file: base', ''
+
+        self.stubs.Set(utils, 'execute', fake_execute)
+
+    def _set_mtime(self, mtime):
+        os.utime(self.path, (mtime, mtime))
+
+    def test_info_cached(self):
+        info = images.qemu_img_info(self.path)
+        self.assertEqual(info.backing_file, 'base')
+        self.assertTrue(images.qemu_img_info(self.path) is info)
+        self.assertEqual(self.runs, [self.path])
+
+    def test_info_refreshed_when_file_changes(self):
+        images.qemu_img_info(self.path)
+        self._set_mtime(2000)
+        images.qemu_img_info(self.path)
+        with open(self.path, 'a') as f:
+            f.write('more')
+        self._set_mtime(2000)
+        images.qemu_img_info(self.path)
+        images.qemu_img_info(self.path)
+        self.assertEqual(self.runs, [self.path] * 3)
+
+    def test_info_of_recently_modified_file_not_cached(self):
+        self._set_mtime(time.time())
+        images.qemu_img_info(self.path)
+        images.qemu_img_info(self.path)
+        self.assertEqual(self.runs, [self.path] * 2)
+
+    def test_removed_files_pruned(self):
+        self.stubs.Set(images.QemuImgInfoCache, 'MAX_ENTRIES', 1)
+        images.qemu_img_info(self.path)
+        os.rename(self.path, self.path + '.new')
+        self.path += '.new'
+        images.qemu_img_info(self.path)
+        self.assertEqual(images._qemu_img_info_cache.entries.keys(),
+                         [self.path])
@@ -29,6 +29,7 @@ from nova import test
 from nova.compute import vm_states
 from nova import conductor
 from nova import db
+from nova.image import download
 from nova.openstack.common import cfg
 from nova.openstack.common import importutils
 from nova.openstack.common import log
@@ -501,6 +502,129 @@ class ImageCacheManagerTestCase(test.TestCase):
             # side effect of creating the checksum
             self.assertTrue(os.path.exists(info_fname))
 
+    @contextlib.contextmanager
+    def _make_chunked_file(self, data):
+        """Make a base file checksummed in chunks of four bytes."""
+        self.flags(checksum_base_images=True)
+        self.stubs.Set(imagecache, 'CHECKSUM_CHUNK_SIZE', 4)
+        self.stubs.Set(imagecache, 'CHECKSUM_READ_SIZE', 2)
+
+        with utils.tempdir() as tmpdir:
+            self.flags(instances_path=tmpdir)
+            self.flags(image_info_filename_pattern=('$instances_path/'
+                                                    '%(image)s.info'))
+            fname = os.path.join(tmpdir, 'aaa')
+            with open(fname, 'w') as f:
+                f.write(data)
+            yield fname
+
+    def test_verify_checksum_chunks(self):
+        with self._make_chunked_file('0123456789') as fname:
+            image_cache_manager = imagecache.ImageCacheManager()
+            res = image_cache_manager._verify_checksum('aaa', fname)
+            self.assertTrue(res is None)
+
+            chunks = imagecache.read_stored_info(fname, field='sha1-chunks')
+            self.assertEquals(chunks['sha1'],
+                              hashlib.sha1('0123456789').hexdigest())
+            self.assertEquals(chunks['hashes'],
+                              [hashlib.sha1(data).hexdigest()
+                               for data in ('0123', '4567', '89')])
+
+            # The checks after that compare the chunks
+            self.flags(checksum_interval_seconds=0)
+            res = image_cache_manager._verify_checksum('aaa', fname)
+            self.assertTrue(res)
+
+            with open(fname, 'w') as f:
+                f.write('0123X56789')
+            with self._intercept_log_messages() as stream:
+                res = image_cache_manager._verify_checksum('aaa', fname)
+                self.assertFalse(res)
+                self.assertNotEqual(stream.getvalue().find(
+                    'chunks [1] of 4 bytes differ'), -1)
+
+    def test_verify_checksum_resumes(self):
+        with self._make_chunked_file('0123456789') as fname:
+            image_cache_manager = imagecache.ImageCacheManager()
+            image_cache_manager._verify_checksum('aaa', fname)
+            self.flags(checksum_interval_seconds=0)
+
+            # Check the first two chunks, then stop as if restarted
+            job = imagecache.ChecksumJob('aaa', fname,
+                                         image_cache_manager.lock_path)
+            for i in range(3):
+                job.step()
+            self.assertFalse(job.done)
+
+            job = imagecache.ChecksumJob('aaa', fname,
+                                         image_cache_manager.lock_path)
+            job.step()
+            self.assertEquals(job.next_chunk, 2)
+            job.step()
+            self.assertTrue(job.done)
+            self.assertTrue(job.result)
+            self.assertTrue(imagecache.read_stored_info(
+                fname, field='sha1-progress') is None)
+
+    def test_verifier_spreads_reads(self):
+        self.flags(checksum_interval_seconds=10)
+        with self._make_chunked_file('0123456789') as fname:
+            image_cache_manager = imagecache.ImageCacheManager()
+            verifier = image_cache_manager.verifier
+            spawned = []
+            self.stubs.Set(imagecache.greenthread, 'spawn_n',
+                           lambda func: spawned.append(func))
+
+            self.assertTrue(verifier.check('aaa', fname) is None)
+            self.assertTrue(verifier.check('aaa', fname) is None)
+            self.assertEquals(len(verifier.jobs), 1)
+            verifier.start()
+
+            # Ten bytes to read within ten seconds
+            self.assertEquals(verifier.limiter.rate, 1)
+            self.assertEquals(spawned, [verifier.run])
+
+            sleeps = []
+            self.stubs.Set(download.greenthread, 'sleep', sleeps.append)
+            verifier.run()
+            self.assertEquals(verifier.jobs, [])
+            self.assertTrue(verifier.check('aaa', fname))
+            self.assertEquals(len(sleeps), 5)
+
+    def test_verifier_drops_failing_job(self):
+        with self._make_chunked_file('0123456789') as fname:
+            verifier = imagecache.ImageCacheManager().verifier
+            self.stubs.Set(imagecache.greenthread, 'spawn_n',
+                           lambda func: None)
+            verifier.check('bbb', fname + '.bad')
+            verifier.check('aaa', fname)
+            bad_job = verifier.jobs[0]
+
+            def fake_step(limiter=None):
+                raise ValueError('unexpected')
+
+            self.stubs.Set(bad_job, 'step', fake_step)
+            with self._intercept_log_messages() as stream:
+                verifier.run()
+                self.assertNotEqual(stream.getvalue().find(
+                    'verification failed unexpectedly'), -1)
+            self.assertEquals(verifier.jobs, [])
+            self.assertEquals(sorted(verifier.results), [fname,
+                                                         fname + '.bad'])
+            # The job behind the failing one still ran
+            self.assertTrue(imagecache.read_stored_checksum(fname))
+
+    def test_verifier_max_rate(self):
+        self.flags(checksum_interval_seconds=1, checksum_max_rate=1)
+        with self._make_chunked_file('0' * 4096) as fname:
+            verifier = imagecache.ImageCacheManager().verifier
+            self.stubs.Set(imagecache.greenthread, 'spawn_n',
+                           lambda func: None)
+            verifier.check('aaa', fname)
+            verifier.start()
+            self.assertEquals(verifier.limiter.rate, 1024)
+
     @contextlib.contextmanager
     def _make_base_file(self, checksum=True):
         """Make a base file for testing."""
@@ -695,6 +819,15 @@ class ImageCacheManagerTestCase(test.TestCase):
             image_cache_manager.used_images = {'123': (1, 0, ['banana-42'])}
             image_cache_manager._handle_base_image(img, fname)
 
+            # The check is queued, but has not run yet
+            self.assertEquals(image_cache_manager.corrupt_base_files, [])
+            image_cache_manager.verifier.run()
+
+            image_cache_manager._reset_state()
+            image_cache_manager.unexplained_images = [fname]
+            image_cache_manager.used_images = {'123': (1, 0, ['banana-42'])}
+            image_cache_manager._handle_base_image(img, fname)
+
             self.assertEquals(image_cache_manager.unexplained_images, [])
             self.assertEquals(image_cache_manager.removable_base_files, [])
             self.assertEquals(image_cache_manager.corrupt_base_files,
@@ -817,10 +950,6 @@ class ImageCacheManagerTestCase(test.TestCase):
         self.stubs.Set(virtutils, 'get_disk_backing_file',
                        lambda x: get_disk_backing_file(x))
 
-        # Fake out verifying checksums, as that is tested elsewhere
-        self.stubs.Set(image_cache_manager, '_verify_checksum',
-                       lambda x, y: y == hashed_42)
-
         # Fake getmtime as well
         orig_getmtime = os.path.getmtime
 
@@ -859,7 +988,7 @@ class ImageCacheManagerTestCase(test.TestCase):
             self.assertTrue(rem in image_cache_manager.removable_base_files)
 
         # Ensure there are no "corrupt" images as well
-        self.assertTrue(len(image_cache_manager.corrupt_base_files), 0)
+        self.assertEquals(image_cache_manager.corrupt_base_files, [])
 
     def test_verify_base_images_no_base(self):
         self.flags(instances_path='/tmp/no/such/dir/name/please')
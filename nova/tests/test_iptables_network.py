@@ -17,8 +17,11 @@
 #    under the License.
 """Unit Tests for network code."""
 
+from nova import exception
 from nova.network import linux_net
+from nova.openstack.common import timeutils
 from nova import test
+from nova.tests import fake_iptables
 
 
 class IptablesManagerTestCase(test.TestCase):
@@ -100,6 +103,133 @@ class IptablesManagerTestCase(test.TestCase):
                         '-s 1.2.3.4/5 -j DROP' % self.binary_name
                         not in new_lines)
 
+    def test_top_rules_keep_counters(self):
+        current_lines = list(self.sample_filter)
+        current_lines.insert(-2, '[5:300] -A FORWARD -j nova-filter-top ')
+        new_lines = self.manager._modify_rules(current_lines,
+                                               self.manager.ipv4['filter'])
+        forward = [line for line in new_lines
+                   if '-A FORWARD -j nova-filter-top' in line]
+        self.assertEqual(forward, ['[5:300] -A FORWARD -j nova-filter-top '])
+
+    def test_remove_rules_and_chains(self):
+        current_lines = list(self.sample_filter)
+        current_lines.insert(10, ':other-chain - [0:0]')
+        current_lines.insert(-2, '[3:4] -A other-chain -j DROP ')
+        current_lines.insert(-2, '[3:4] -A INPUT -j other-chain ')
+
+        table = self.manager.ipv4['filter']
+        table.add_chain('other-chain', wrap=False)
+        table.add_rule('other-chain', '-j DROP', wrap=False)
+        table.add_rule('INPUT', '-j other-chain', wrap=False)
+        table.add_rule('FORWARD', '-i virbr0 -o virbr0 -j ACCEPT',
+                       wrap=False)
+        table.remove_chain('other-chain', wrap=False)
+        table.remove_rule('FORWARD', '-i virbr0 -o virbr0 -j ACCEPT',
+                          wrap=False)
+        new_lines = self.manager._modify_rules(current_lines, table)
+
+        for line in new_lines:
+            self.assertFalse('other-chain' in line)
+        self.assertFalse('[0:0] -A FORWARD -i virbr0 -o virbr0 -j ACCEPT '
+                         in new_lines)
+        self.assertEqual(table.remove_chains, set())
+        self.assertEqual(table.remove_rules, [])
+
+    def _fake_iptables(self):
+        executes = []
+        tables = {'iptables': '\n'.join(self.sample_filter +
+                                        self.sample_nat),
+                  'ip6tables': '\n'.join(self.sample_filter)}
+
+        def fake_execute(*cmd, **kwargs):
+            executes.append(cmd)
+            command, action = cmd[0].split('-')
+            if action == 'save':
+                return tables[command], ''
+            if '--noflush' not in cmd:
+                tables[command] = kwargs['process_input']
+            else:
+                executes.append(kwargs['process_input'].split('\n'))
+            return '', ''
+
+        self.manager.execute = fake_execute
+        return executes
+
+    def test_apply_changed_chains(self):
+        self.flags(use_ipv6=True)
+        executes = self._fake_iptables()
+        table = self.manager.ipv4['filter']
+        table.add_chain('inst-1')
+        table.add_rule('inst-1', '-j DROP')
+        self.manager.apply()
+        self.assertEqual([cmd[0] for cmd in executes],
+                         ['iptables-save', 'iptables-restore',
+                          'ip6tables-save', 'ip6tables-restore'])
+
+        # Nothing changed, nothing to do
+        del executes[:]
+        self.manager.apply()
+        self.assertEqual(executes, [])
+
+        table.remove_chain('inst-1')
+        table.add_chain('inst-2')
+        table.add_rule('inst-2', '-j ACCEPT')
+        table.add_rule('local', '-j $inst-2')
+        self.manager.apply()
+        self.assertEqual(executes[0],
+                         ('iptables-restore', '-c', '--noflush'))
+        self.assertEqual(executes[1], [
+                '*filter',
+                ':%s-inst-2 - [0:0]' % self.binary_name,
+                ':%s-local - [0:0]' % self.binary_name,
+                ':%s-inst-1 - [0:0]' % self.binary_name,
+                '[0:0] -A %s-inst-2 -j ACCEPT' % self.binary_name,
+                '[0:0] -A %s-local -j %s-inst-2' % (self.binary_name,
+                                                    self.binary_name),
+                '-X %s-inst-1' % self.binary_name,
+                'COMMIT'])
+        self.assertEqual(len(executes), 2)
+
+    def test_apply_all_when_needed(self):
+        self.flags(use_ipv6=False)
+        executes = self._fake_iptables()
+        self.manager.apply()
+
+        # Changes outside of our wrapped chains
+        table = self.manager.ipv4['filter']
+        table.add_chain('shared', wrap=False)
+        del executes[:]
+        self.manager.apply()
+        self.assertEqual([cmd[0] for cmd in executes],
+                         ['iptables-save', 'iptables-restore'])
+
+        # The resync interval passed
+        table.add_rule('local', '-j DROP')
+        timeutils.set_time_override(timeutils.utcnow())
+        self.addCleanup(timeutils.clear_time_override)
+        timeutils.advance_time_seconds(301)
+        del executes[:]
+        self.manager.apply()
+        self.assertEqual([cmd[0] for cmd in executes],
+                         ['iptables-save', 'iptables-restore'])
+
+        # iptables-restore failed, as the tables drifted
+        def fail_noflush(*cmd, **kwargs):
+            if '--noflush' in cmd:
+                executes.append(cmd)
+                raise exception.ProcessExecutionError()
+            return fake_execute(*cmd, **kwargs)
+
+        fake_execute = self.manager.execute
+        self.manager.execute = fail_noflush
+        table.add_rule('local', '-j ACCEPT')
+        del executes[:]
+        self.manager.apply()
+        self.assertEqual([cmd[0] for cmd in executes],
+                         ['iptables-restore', 'iptables-save',
+                          'iptables-restore'])
+
     def test_nat_rules(self):
         current_lines = self.sample_nat
         new_lines = self.manager._modify_rules(current_lines,
@@ -170,3 +300,54 @@ class IptablesManagerTestCase(test.TestCase):
             self.assertTrue('[0:0] -A %s -j %s-%s' %
                             (chain, self.binary_name, chain) in new_lines,
                             "Built-in chain %s not wrapped" % (chain,))
+
+
+class IpsetManagerTestCase(test.TestCase):
+
+    def setUp(self):
+        super(IpsetManagerTestCase, self).setUp()
+        self.commands = fake_iptables.FakeIptables()
+        self.manager = linux_net.IpsetManager(self.commands.execute)
+
+    def test_set_members_creates_and_flushes_set(self):
+        self.commands.execute('ipset', 'create', 'nova-sg1-v4', 'hash:ip',
+                              'family', 'inet')
+        self.commands.execute('ipset', 'add', 'nova-sg1-v4', '10.0.0.9')
+        self.manager.set_members('nova-sg1-v4', 4, ['10.0.0.1', '10.0.0.2'])
+        self.assertEqual(self.commands.sets['nova-sg1-v4'],
+                         ('inet', set(['10.0.0.1', '10.0.0.2'])))
+
+        self.manager.set_members('nova-sg2-v6', 6, ['fe80::1'])
+        self.assertEqual(self.commands.sets['nova-sg2-v6'],
+                         ('inet6', set(['fe80::1'])))
+
+    def test_set_members_only_writes_changes(self):
+        self.manager.set_members('nova-sg1-v4', 4, ['10.0.0.1', '10.0.0.2'])
+        del self.commands.commands[:]
+
+        self.manager.set_members('nova-sg1-v4', 4, ['10.0.0.2', '10.0.0.1'])
+        self.assertEqual(self.commands.commands, [])
+
+        self.manager.set_members('nova-sg1-v4', 4, ['10.0.0.2', '10.0.0.3'])
+        self.assertEqual(self.commands.commands,
+                         [('ipset', 'del', '-exist', 'nova-sg1-v4',
+                           '10.0.0.1'),
+                          ('ipset', 'restore', '-exist')])
+        self.assertEqual(self.commands.sets['nova-sg1-v4'][1],
+                         set(['10.0.0.2', '10.0.0.3']))
+
+    def test_destroy_set_in_use(self):
+        self.manager.set_members('nova-sg1-v4', 4, ['10.0.0.1'])
+        self.commands.execute('iptables-restore', '-c', process_input=(
+            '*filter\n'
+            '[0:0] -A INPUT -m set --match-set nova-sg1-v4 src -j ACCEPT\n'
+            'COMMIT\n'))
+
+        self.assertFalse(self.manager.destroy('nova-sg1-v4'))
+        self.assertTrue('nova-sg1-v4' in self.manager.sets)
+
+        self.commands.execute('iptables-restore', '-c',
+                              process_input='*filter\nCOMMIT\n')
+        self.assertTrue(self.manager.destroy('nova-sg1-v4'))
+        self.assertFalse('nova-sg1-v4' in self.commands.sets)
+        self.assertFalse('nova-sg1-v4' in self.manager.sets)
@@ -0,0 +1,41 @@
+# Copyright 2013 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For the to_primitive() benchmark harness.
+"""
+
+from nova.openstack.common import jsonutils
+from nova import test
+from nova.tests import jsonutils_benchmark
+
+
+class JsonutilsBenchmarkTestCase(test.TestCase):
+    def test_payloads_convert(self):
+        instance = jsonutils_benchmark.fake_instance()
+        network_info = jsonutils_benchmark.fake_network_info(2)
+        payload = jsonutils_benchmark.notification_payload(instance,
+                                                           network_info)
+        self.assertEqual(payload['instance_id'], instance['uuid'])
+        msg = jsonutils.to_primitive(
+            jsonutils_benchmark.rpc_message(instance, network_info))
+        self.assertEqual(msg['args']['instance']['uuid'], instance['uuid'])
+        self.assertEqual(len(msg['args']['network_info']), 2)
+
+    def test_run_benchmark(self):
+        report = jsonutils_benchmark.run_benchmark(2)
+        self.assertEqual(report['payloads'], 4)
+        self.assertTrue(report['seconds'] > 0)
+        self.assertTrue(report['ms_per_payload'] > 0)
+        self.assertTrue(jsonutils_benchmark.format_report(report))
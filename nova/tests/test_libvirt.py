@@ -38,12 +38,14 @@ from nova.compute import vm_states
 from nova import context
 from nova import db
 from nova import exception
+from nova.network import linux_net
 from nova.openstack.common import cfg
 from nova.openstack.common import fileutils
 from nova.openstack.common import importutils
 from nova.openstack.common import jsonutils
 from nova.openstack.common import log as logging
 from nova import test
+from nova.tests import fake_iptables
 from nova.tests import fake_libvirt_utils
 from nova.tests import fake_network
 import nova.tests.image.fake
@@ -3839,6 +3841,9 @@ class IptablesFirewallTestCase(test.TestCase):
 
         from nova.network import linux_net
         linux_net.iptables_manager.execute = fake_iptables_execute
+        # NOTE: the shared manager may have applied rules in earlier
+        # tests, after which it would only rewrite the changed chains.
+        self.flags(iptables_full_resync_interval=0)
 
         _fake_stub_out_get_nw_info(self.stubs, lambda *a, **kw: network_model)
 
@@ -3899,6 +3904,115 @@ class IptablesFirewallTestCase(test.TestCase):
                         "TCP port 80/81 acceptance rule wasn't added")
         db.instance_destroy(admin_ctxt, instance_ref['uuid'])
 
+    def test_security_group_members_in_ipsets(self):
+        self.flags(firewall_use_ipset=True, iptables_full_resync_interval=0)
+        fake_commands = fake_iptables.FakeIptables()
+        self.stubs.Set(self.fw.iptables, 'execute', fake_commands.execute)
+        self.fw.ipset = linux_net.IpsetManager(fake_commands.execute)
+
+        admin_ctxt = context.get_admin_context()
+        instance_ref = self._create_instance_ref()
+        src_instance_ref = self._create_instance_ref()
+        other_instance_ref = self._create_instance_ref()
+        secgroup = db.security_group_create(admin_ctxt,
+                                            {'user_id': 'fake',
+                                             'project_id': 'fake',
+                                             'name': 'testgroup',
+                                             'description': 'test group'})
+        src_secgroup = db.security_group_create(admin_ctxt,
+                                                {'user_id': 'fake',
+                                                 'project_id': 'fake',
+                                                 'name': 'testsourcegroup',
+                                                 'description': 'src group'})
+        grant = {'parent_group_id': secgroup['id'],
+                 'protocol': 'tcp',
+                 'from_port': 80,
+                 'to_port': 81,
+                 'group_id': src_secgroup['id']}
+        grant_rule = db.security_group_rule_create(admin_ctxt, grant)
+        db.instance_add_security_group(admin_ctxt, instance_ref['uuid'],
+                                       secgroup['id'])
+        db.instance_add_security_group(admin_ctxt, src_instance_ref['uuid'],
+                                       src_secgroup['id'])
+
+        addresses = {src_instance_ref['uuid']: '10.0.0.2',
+                     other_instance_ref['uuid']: '10.0.0.3'}
+
+        class FakeNetworkInfo(object):
+            def __init__(self, address):
+                self.address = address
+
+            def fixed_ips(self):
+                return [{'address': self.address, 'version': 4}]
+
+        def fake_get_nw_info(_self, context, instance):
+            return FakeNetworkInfo(addresses[instance['uuid']])
+
+        _fake_stub_out_get_nw_info(self.stubs, fake_get_nw_info)
+
+        network_info = _fake_network_info(self.stubs, 1)
+        self.fw.prepare_instance_filter(instance_ref, network_info)
+
+        set_name = 'nova-sg%s-v4' % src_secgroup['id']
+        self.assertEqual(fake_commands.sets[set_name],
+                         ('inet', set(['10.0.0.2'])))
+        rules = fake_commands.rules()
+        self.assertEqual(len([rule for rule in rules
+                              if '-j ACCEPT -p tcp -m multiport --dports '
+                                 '80:81 -m set --match-set %s src' % set_name
+                              in rule]), 1)
+        self.assertFalse([rule for rule in rules if '10.0.0.2' in rule])
+
+        # Members joining and leaving only change the set
+        db.instance_add_security_group(admin_ctxt,
+                                       other_instance_ref['uuid'],
+                                       src_secgroup['id'])
+        del fake_commands.commands[:]
+        self.fw.refresh_security_group_members(src_secgroup['id'])
+        self.assertEqual(fake_commands.sets[set_name][1],
+                         set(['10.0.0.2', '10.0.0.3']))
+        self.assertEqual(fake_commands.commands,
+                         [('ipset', 'restore', '-exist')])
+
+        db.instance_remove_security_group(admin_ctxt,
+                                          src_instance_ref['uuid'],
+                                          src_secgroup['id'])
+        del fake_commands.commands[:]
+        self.fw.refresh_security_group_members(src_secgroup['id'])
+        self.assertEqual(fake_commands.sets[set_name][1], set(['10.0.0.3']))
+        self.assertEqual(fake_commands.commands,
+                         [('ipset', 'del', '-exist', set_name, '10.0.0.2')])
+
+        # and so do refreshes of the rules of the instances granting access
+        db.instance_add_security_group(admin_ctxt, src_instance_ref['uuid'],
+                                       src_secgroup['id'])
+        self.fw.refresh_instance_security_rules(instance_ref)
+        self.assertEqual(fake_commands.sets[set_name][1],
+                         set(['10.0.0.2', '10.0.0.3']))
+
+        db.instance_remove_security_group(admin_ctxt,
+                                          src_instance_ref['uuid'],
+                                          src_secgroup['id'])
+        self.fw.refresh_instance_security_rules(instance_ref)
+        self.assertEqual(fake_commands.sets[set_name][1], set(['10.0.0.3']))
+
+        # The set goes away with the last rule matching on it
+        db.security_group_rule_destroy(admin_ctxt, grant_rule['id'])
+        self.fw.refresh_security_group_rules(secgroup['id'])
+        self.assertFalse(set_name in fake_commands.sets)
+        self.assertFalse(src_secgroup['id'] in self.fw.security_group_sets)
+
+        db.security_group_rule_create(admin_ctxt, grant)
+        self.fw.refresh_security_group_rules(secgroup['id'])
+        self.assertEqual(fake_commands.sets[set_name][1], set(['10.0.0.3']))
+
+        # or with the last instance using it
+        self.stubs.Set(self.fw.nwfilter, 'unfilter_instance',
+                       lambda *args: None)
+        self.fw.unfilter_instance(instance_ref, network_info)
+        self.assertFalse(set_name in fake_commands.sets)
+        self.assertFalse(src_secgroup['id'] in self.fw.security_group_sets)
+
     def test_filters_for_instance_with_ip_v6(self):
         self.flags(use_ipv6=True)
         network_info = _fake_network_info(self.stubs, 1)
@@ -3956,7 +4070,87 @@ class IptablesFirewallTestCase(test.TestCase):
 
         self.fw.prepare_instance_filter(instance_ref, mox.IgnoreArg())
         self.fw.instances[instance_ref['id']] = instance_ref
+        self.fw._index_security_groups(instance_ref['id'], ["fake"])
         self.fw.do_refresh_security_group_rules("fake")
+        self.fw.do_refresh_security_group_rules("other")
+
+    def test_refresh_only_instances_using_security_group(self):
+        admin_ctxt = context.get_admin_context()
+        groups = [db.security_group_create(admin_ctxt,
+                                           {'user_id': 'fake',
+                                            'project_id': 'fake',
+                                            'name': 'group%d' % i})
+                  for i in xrange(3)]
+        db.security_group_rule_create(admin_ctxt,
+                                      {'parent_group_id': groups[1]['id'],
+                                       'group_id': groups[2]['id']})
+        network_info = _fake_network_info(self.stubs, 1)
+        _fake_stub_out_get_nw_info(self.stubs)
+        instances = []
+        for group in groups[:2]:
+            instance_ref = self._create_instance_ref()
+            db.instance_add_security_group(admin_ctxt, instance_ref['uuid'],
+                                           group['id'])
+            self.fw.prepare_instance_filter(instance_ref, network_info)
+            instances.append(instance_ref)
+
+        rebuilt = []
+        instance_rules = self.fw.instance_rules
+
+        def fake_instance_rules(instance, network_info):
+            rebuilt.append(instance['id'])
+            return instance_rules(instance, network_info)
+
+        self.stubs.Set(self.fw, 'instance_rules', fake_instance_rules)
+
+        self.fw.refresh_security_group_rules(groups[0]['id'])
+        self.assertEqual(rebuilt, [instances[0]['id']])
+
+        # The second instance's rules use the third group as grantee
+        del rebuilt[:]
+        self.fw.refresh_security_group_members(groups[2]['id'])
+        self.assertEqual(rebuilt, [instances[1]['id']])
+
+        del rebuilt[:]
+        self.stubs.Set(self.fw.nwfilter, 'unfilter_instance',
+                       lambda *args: None)
+        self.fw.unfilter_instance(instances[1], network_info)
+        self.fw.refresh_security_group_members(groups[2]['id'])
+        self.fw.refresh_security_group_rules(groups[1]['id'])
+        self.assertEqual(rebuilt, [])
+        self.assertEqual(self.fw.security_group_instances,
+                         {groups[0]['id']: set([instances[0]['id']])})
+
+    def test_refresh_security_group_rules_of_new_member(self):
+        admin_ctxt = context.get_admin_context()
+        groups = [db.security_group_create(admin_ctxt,
+                                           {'user_id': 'fake',
+                                            'project_id': 'fake',
+                                            'name': 'group%d' % i})
+                  for i in xrange(2)]
+        db.security_group_rule_create(admin_ctxt,
+                                      {'parent_group_id': groups[1]['id'],
+                                       'protocol': 'tcp',
+                                       'from_port': 22,
+                                       'to_port': 22,
+                                       'cidr': '192.168.99.0/24'})
+        network_info = _fake_network_info(self.stubs, 1)
+        _fake_stub_out_get_nw_info(self.stubs)
+        instance_ref = self._create_instance_ref()
+        db.instance_add_security_group(admin_ctxt, instance_ref['uuid'],
+                                       groups[0]['id'])
+        self.fw.prepare_instance_filter(instance_ref, network_info)
+
+        # as compute_api.add_to_instance does
+        db.instance_add_security_group(admin_ctxt, instance_ref['uuid'],
+                                       groups[1]['id'])
+        self.fw.refresh_security_group_rules(groups[1]['id'])
+
+        rules = [str(rule) for rule in self.fw.iptables.ipv4['filter'].rules]
+        self.assertTrue([rule for rule in rules
+                         if '--dport 22 -s 192.168.99.0/24' in rule])
+        self.assertEqual(self.fw.security_group_instances[groups[1]['id']],
+                         set([instance_ref['id']]))
 
     def test_unfilter_instance_undefines_nwfilter(self):
         admin_ctxt = context.get_admin_context()
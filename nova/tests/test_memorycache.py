@@ -0,0 +1,135 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For the in process memcache client.
+"""
+
+import datetime
+
+from nova.common import memorycache
+from nova.openstack.common import timeutils
+from nova import test
+
+
+class MemoryCacheTestCase(test.TestCase):
+    def setUp(self):
+        super(MemoryCacheTestCase, self).setUp()
+        self.now = datetime.datetime(2013, 1, 1, 12, 0, 0)
+        timeutils.set_time_override(self.now)
+        self.addCleanup(timeutils.clear_time_override)
+
+    def _advance(self, seconds):
+        timeutils.advance_time_seconds(seconds)
+
+    def test_get_client_default(self):
+        self.assertTrue(isinstance(memorycache.get_client(),
+                                   memorycache.Client))
+
+    def test_set_get(self):
+        client = memorycache.Client()
+        self.assertTrue(client.set('foo', 'bar'))
+        self.assertEqual(client.get('foo'), 'bar')
+        self.assertEqual(client.get('missing'), None)
+        stats = client.get_stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['entries'], 1)
+        self.assertEqual(stats['bytes'], 3)
+
+    def test_expiry(self):
+        client = memorycache.Client()
+        client.set('short', 'a', time=10)
+        client.set('long', 'b', time=100)
+        client.set('forever', 'c')
+        self._advance(10)
+        self.assertEqual(client.get('short'), None)
+        self.assertEqual(client.get('long'), 'b')
+        self._advance(90)
+        self.assertEqual(client.get('long'), None)
+        self.assertEqual(client.get('forever'), 'c')
+        self.assertEqual(client.get_stats()['expirations'], 2)
+
+    def test_reset_extends_expiry(self):
+        client = memorycache.Client()
+        client.set('foo', 'a', time=10)
+        self._advance(5)
+        client.set('foo', 'b', time=10)
+        self._advance(6)
+        self.assertEqual(client.get('foo'), 'b')
+        self._advance(4)
+        self.assertEqual(client.get('foo'), None)
+
+    def test_lru_eviction_by_entries(self):
+        client = memorycache.Client(max_entries=2, max_bytes=0)
+        client.set('a', '1')
+        client.set('b', '2')
+        # Touch 'a' so that 'b' becomes least recently used.
+        client.get('a')
+        client.set('c', '3')
+        self.assertEqual(client.get('b'), None)
+        self.assertEqual(client.get('a'), '1')
+        self.assertEqual(client.get('c'), '3')
+        self.assertEqual(client.get_stats()['evictions'], 1)
+
+    def test_lru_eviction_by_bytes(self):
+        client = memorycache.Client(max_entries=0, max_bytes=10)
+        client.set('a', '12345')
+        client.set('b', '12345')
+        client.set('c', '1')
+        self.assertEqual(client.get('a'), None)
+        self.assertEqual(client.get('b'), '12345')
+        self.assertEqual(client.get_stats()['bytes'], 6)
+
+    def test_add(self):
+        client = memorycache.Client()
+        self.assertTrue(client.add('foo', 'a'))
+        self.assertFalse(client.add('foo', 'b'))
+        self.assertEqual(client.get('foo'), 'a')
+
+    def test_incr(self):
+        client = memorycache.Client()
+        self.assertEqual(client.incr('foo'), None)
+        client.set('foo', '1', time=10)
+        self.assertEqual(client.incr('foo'), 2)
+        self.assertEqual(client.incr('foo', delta=8), 10)
+        self.assertEqual(client.get('foo'), '10')
+        self._advance(10)
+        self.assertEqual(client.get('foo'), None)
+
+    def test_delete(self):
+        client = memorycache.Client()
+        client.set('foo', 'a')
+        client.delete('foo')
+        self.assertEqual(client.get('foo'), None)
+        self.assertEqual(client.get_stats()['bytes'], 0)
+
+    def test_expiry_heap_is_compacted(self):
+        client = memorycache.Client()
+        for i in range(1000):
+            client.set('foo', str(i), time=60)
+        self.assertTrue(len(client._expiry) < 100)
+
+    def test_lru_queue_is_compacted(self):
+        client = memorycache.Client(max_entries=2, max_bytes=0)
+        client.set('a', '1')
+        client.set('b', '2')
+        for i in range(1000):
+            client.get('a')
+        self.assertTrue(len(client._used) < 100)
+        client.set('c', '3')
+        self.assertEqual(client.get('b'), None)
+        self.assertEqual(client.get('a'), '1')
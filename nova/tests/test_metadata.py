@@ -26,6 +26,7 @@ import re
 import webob
 
 from nova.api.metadata import base
+from nova.api.metadata import cache
 from nova.api.metadata import handler
 from nova.api.metadata import password
 from nova import block_device
@@ -517,6 +518,89 @@ class MetadataHandlerTestCase(test.TestCase):
         self.assertEqual(response.status_int, 500)
 
 
+class MetadataDocumentTestCase(test.TestCase):
+    def setUp(self):
+        super(MetadataDocumentTestCase, self).setUp()
+        fake_network.stub_out_nw_api_get_instance_nw_info(self.stubs,
+                                                          spectacular=True)
+        self.mdinst = fake_InstanceMetadata(self.stubs, INSTANCES[0],
+                                            address='10.0.0.1',
+                                            content=[('/etc/foo', 'bar')])
+
+    def test_lookups_match_instance_metadata(self):
+        document = base.MetadataDocument(self.mdinst)
+        for path in ('/', '/latest', '/2009-04-04/meta-data/',
+                     '/2009-04-04/meta-data/public-keys/0/openssh-key',
+                     '/latest/meta-data/placement/availability-zone',
+                     '/1.0/meta-data/local-ipv4', '/latest/user-data',
+                     '/openstack', '/openstack/2012-08-10',
+                     '/openstack/latest/user_data',
+                     '/openstack/content/0000'):
+            self.assertEqual(document.lookup(path),
+                             self.mdinst.lookup(path))
+
+        path = '/openstack/2012-08-10/meta_data.json'
+        self.assertEqual(json.loads(document.lookup(path)),
+                         json.loads(self.mdinst.lookup(path)))
+
+        mdjson = json.loads(
+                document.lookup('/openstack/latest/meta_data.json'))
+        self.assertTrue('random_seed' in mdjson)
+        del mdjson['random_seed']
+        self.assertEqual(mdjson, self.mdinst.get_openstack_metadata(
+                base.OPENSTACK_VERSIONS[-1]))
+        self.assertFalse('random_seed' in document.get_openstack_metadata(
+                base.OPENSTACK_VERSIONS[-1]))
+
+        self.assertRaises(base.InvalidMetadataPath,
+                          document.lookup, '/9999-99-99/meta-data')
+
+    def test_handler_renders_once(self):
+        calls = []
+
+        def fake_get_metadata_by_address(address):
+            calls.append(address)
+            return self.mdinst
+
+        self.stubs.Set(base, 'get_metadata_by_address',
+                       fake_get_metadata_by_address)
+        app = handler.MetadataRequestHandler()
+        self.stubs.Set(cache, '_CACHE', app._cache)
+
+        md = app.get_metadata_by_remote_address('10.0.0.1')
+        self.assertTrue(isinstance(md, base.MetadataDocument))
+        self.assertEqual(app.get_metadata_by_remote_address('10.0.0.1'), md)
+        self.assertEqual(calls, ['10.0.0.1'])
+
+        cache.notify(None, {'event_type': 'compute.instance.create.end',
+                            'payload': {'instance_id': 'other'}})
+        cache.notify(None, {'event_type': 'compute.metrics.update',
+                            'payload': {'instance_id': md.uuid}})
+        app.get_metadata_by_remote_address('10.0.0.1')
+        self.assertEqual(calls, ['10.0.0.1'])
+
+        cache.notify(None, {'event_type': 'security_group.add_to_instance',
+                            'payload': {'instance_id': md.uuid}})
+        app.get_metadata_by_remote_address('10.0.0.1')
+        self.assertEqual(calls, ['10.0.0.1', '10.0.0.1'])
+
+    def test_address_index_checks_document(self):
+        metadata_cache = cache.MetadataCache()
+        metadata_cache.set(base.MetadataDocument(self.mdinst),
+                           index_address=True)
+        self.assertEqual(
+                metadata_cache.get_by_address('10.0.0.1').uuid,
+                INSTANCES[0]['uuid'])
+        self.assertEqual(metadata_cache.get_by_address('10.0.0.2'), None)
+        self.assertEqual(
+                metadata_cache.get_by_instance_id(INSTANCES[0]['uuid'],
+                                                  '10.0.0.2'),
+                None)
+
+        metadata_cache.invalidate(INSTANCES[0]['uuid'])
+        self.assertEqual(metadata_cache.get_by_address('10.0.0.1'), None)
+
+
 class MetadataPasswordTestCase(test.TestCase):
     def setUp(self):
         super(MetadataPasswordTestCase, self).setUp()
@@ -135,6 +135,43 @@ class PolicyTestCase(test.TestCase):
         action = "example:early_or_success"
         policy.enforce(self.context, action, self.target)
 
+    def test_decisions_cached_in_context(self):
+        calls = []
+
+        def fakeurlopen(url, post_data):
+            calls.append(url)
+            return StringIO.StringIO("True")
+        self.stubs.Set(urllib2, 'urlopen', fakeurlopen)
+        action = "example:get_http"
+        policy.enforce(self.context, action, {'uuid': 'a'})
+        policy.enforce(self.context, action, {'uuid': 'a'})
+        self.assertEqual(len(calls), 1)
+
+        policy.enforce(self.context, action, {'uuid': 'b'})
+        self.assertEqual(len(calls), 2)
+
+        other_context = context.RequestContext('fake', 'fake')
+        policy.enforce(other_context, action, {'uuid': 'a'})
+        self.assertEqual(len(calls), 3)
+
+    def test_decisions_keyed_on_inputs(self):
+        action = "example:my_file"
+        target = {'project_id': 'fake', 'display_name': 'a'}
+        policy.enforce(self.context, action, target)
+        target['display_name'] = 'b'
+        policy.enforce(self.context, action, target)
+        self.assertEqual(len(self.context._policy_decisions[1]), 1)
+
+        self.context.project_id = 'another'
+        self.assertRaises(exception.PolicyNotAuthorized, policy.enforce,
+                          self.context, action, target)
+
+    def test_decisions_cached_for_missing_keys(self):
+        action = "example:my_file"
+        self.assertRaises(exception.PolicyNotAuthorized, policy.enforce,
+                          self.context, action, {})
+        self.assertEqual(len(self.context._policy_decisions[1]), 1)
+
     def test_ignore_case_role_check(self):
         lowercase_action = "example:lowercase_admin"
         uppercase_action = "example:uppercase_admin"
@@ -180,6 +217,59 @@ class DefaultPolicyTestCase(test.TestCase):
                 self.context, "example:noexist", {})
 
 
+class CompiledRulesTestCase(test.TestCase):
+    def setUp(self):
+        super(CompiledRulesTestCase, self).setUp()
+        self.rules = policy.Rules.load_json("""{
+            "default": "!",
+            "admin": "role:admin or is_admin:True",
+            "owner": "project_id:%(project_id)s",
+            "admin_or_owner": "rule:admin or (rule:owner and not role:dunce)",
+            "named": "user_id:fake and (role:a or role:b or role:c)",
+            "loop": "role:admin or rule:loop",
+            "missing": "rule:nowhere and rule:default"
+        }""", "default")
+        common_policy.set_rules(self.rules)
+
+    def _check_same(self, name, target, creds):
+        expected = self.rules[name](target, creds)
+        self.assertEqual(self.rules.compiled(name)(target, creds), expected)
+        return expected
+
+    def test_same_as_tree(self):
+        creds = {'project_id': 'fake', 'user_id': 'fake', 'roles': ['b'],
+                 'is_admin': False}
+        admin_creds = dict(creds, roles=['Admin'])
+        for name in ('admin', 'admin_or_owner', 'named', 'missing',
+                     'nowhere'):
+            for target in ({'project_id': 'fake'}, {'project_id': 'x'}):
+                self._check_same(name, target, creds)
+                self._check_same(name, target, admin_creds)
+        self.assertTrue(self._check_same('admin_or_owner',
+                                         {'project_id': 'fake'}, creds))
+        self.assertFalse(self._check_same('admin_or_owner',
+                                          {'project_id': 'x'}, creds))
+
+    def test_self_reference(self):
+        self.assertTrue(self.rules.compiled('loop')(
+            {}, {'roles': ['admin']}))
+        self.assertEqual(self.rules.inputs('loop'), (None, None))
+
+    def test_inputs(self):
+        self.assertEqual(self.rules.inputs('admin_or_owner'),
+                         (frozenset(['project_id']),
+                          frozenset(['roles', 'is_admin', 'project_id'])))
+        self.assertEqual(self.rules.inputs('nowhere'),
+                         (frozenset(), frozenset()))
+
+    def test_changed_rule_recompiled(self):
+        self.assertFalse(self.rules.compiled('owner')(
+            {'project_id': 'x'}, {'project_id': 'fake'}))
+        self.rules['owner'] = common_policy.parse_rule('@')
+        self.assertTrue(self.rules.compiled('owner')(
+            {'project_id': 'x'}, {'project_id': 'fake'}))
+
+
 class IsAdminCheckTestCase(test.TestCase):
     def test_init_true(self):
         check = policy.IsAdminCheck('is_admin', 'True')
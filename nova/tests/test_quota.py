@@ -18,6 +18,8 @@
 
 import datetime
 
+import eventlet
+
 from nova import compute
 from nova.compute import instance_types
 from nova import context
@@ -291,6 +293,12 @@ class FakeDriver(object):
                             expire, project_id))
         return self.reservations
 
+    def reserve_batch(self, context, resources, batch, expire=None,
+                      project_id=None):
+        self.called.append(('reserve_batch', context, resources, batch,
+                            expire, project_id))
+        return [self.reservations for deltas in batch]
+
     def commit(self, context, reservations, project_id=None):
         self.called.append(('commit', context, reservations, project_id))
 
@@ -652,6 +660,20 @@ class QuotaEngineTestCase(test.TestCase):
                 'resv-01', 'resv-02', 'resv-03', 'resv-04',
                 ])
 
+    def test_reserve_batch(self):
+        context = FakeContext(None, None)
+        driver = FakeDriver(reservations=['resv-01', 'resv-02'])
+        quota_obj = self._make_quota_obj(driver)
+        batch = [dict(test_resource1=4), dict(test_resource2=3)]
+        result = quota_obj.reserve_batch(context, batch, expire=3600)
+
+        self.assertEqual(driver.called, [
+                ('reserve_batch', context, quota_obj._resources, batch,
+                 3600, None),
+                ])
+        self.assertEqual(result, [['resv-01', 'resv-02'],
+                                  ['resv-01', 'resv-02']])
+
     def test_commit(self):
         context = FakeContext(None, None)
         driver = FakeDriver()
@@ -1226,6 +1248,30 @@ class DbQuotaDriverTestCase(test.TestCase):
             return ['resv-1', 'resv-2', 'resv-3']
         self.stubs.Set(db, 'quota_reserve', fake_quota_reserve)
 
+        def fake_quota_reserve_batch(context, resources, quotas, batch,
+                                     expire, until_refresh, max_age,
+                                     project_id=None, defer_refresh=False,
+                                     stats=None):
+            self.calls.append(('quota_reserve_batch', expire, until_refresh,
+                               max_age))
+            for deltas in batch:
+                over = [res for res, delta in deltas.items()
+                        if delta > quotas[res]]
+                if over:
+                    stats['update_misses'] += len(over)
+                    raise exception.OverQuota(overs=over, quotas=quotas,
+                                              usages={})
+            stats['rows_updated'] += len(set().union(*batch))
+            return [['resv-1', 'resv-2', 'resv-3'] for deltas in batch]
+        self.stubs.Set(db, 'quota_reserve_batch', fake_quota_reserve_batch)
+
+        def fake_quota_usage_refresh(context, resources, keys, until_refresh,
+                                     max_age, project_id=None, force=False):
+            self.calls.append(('quota_usage_refresh', project_id, keys))
+            return {}
+        self.stubs.Set(db, 'quota_usage_refresh', fake_quota_usage_refresh)
+        self.stubs.Set(eventlet, 'spawn_n', lambda func, *args: func(*args))
+
     def test_reserve_bad_expire(self):
         self._stub_get_project_quotas()
         self._stub_quota_reserve()
@@ -1246,7 +1292,7 @@ class DbQuotaDriverTestCase(test.TestCase):
         expire = timeutils.utcnow() + datetime.timedelta(seconds=86400)
         self.assertEqual(self.calls, [
                 'get_project_quotas',
-                ('quota_reserve', expire, 0, 0),
+                ('quota_reserve_batch', expire, 0, 0),
                 ])
         self.assertEqual(result, ['resv-1', 'resv-2', 'resv-3'])
 
@@ -1260,7 +1306,7 @@ class DbQuotaDriverTestCase(test.TestCase):
         expire = timeutils.utcnow() + datetime.timedelta(seconds=3600)
         self.assertEqual(self.calls, [
                 'get_project_quotas',
-                ('quota_reserve', expire, 0, 0),
+                ('quota_reserve_batch', expire, 0, 0),
                 ])
         self.assertEqual(result, ['resv-1', 'resv-2', 'resv-3'])
 
@@ -1275,7 +1321,7 @@ class DbQuotaDriverTestCase(test.TestCase):
         expire = timeutils.utcnow() + expire_delta
         self.assertEqual(self.calls, [
                 'get_project_quotas',
-                ('quota_reserve', expire, 0, 0),
+                ('quota_reserve_batch', expire, 0, 0),
                 ])
         self.assertEqual(result, ['resv-1', 'resv-2', 'resv-3'])
 
@@ -1289,7 +1335,7 @@ class DbQuotaDriverTestCase(test.TestCase):
 
         self.assertEqual(self.calls, [
                 'get_project_quotas',
-                ('quota_reserve', expire, 0, 0),
+                ('quota_reserve_batch', expire, 0, 0),
                 ])
         self.assertEqual(result, ['resv-1', 'resv-2', 'resv-3'])
 
@@ -1304,7 +1350,8 @@ class DbQuotaDriverTestCase(test.TestCase):
 
         self.assertEqual(self.calls, [
                 'get_project_quotas',
-                ('quota_reserve', expire, 500, 0),
+                ('quota_reserve_batch', expire, 500, 0),
+                ('quota_usage_refresh', 'test_project', ['instances']),
                 ])
         self.assertEqual(result, ['resv-1', 'resv-2', 'resv-3'])
 
@@ -1319,10 +1366,96 @@ class DbQuotaDriverTestCase(test.TestCase):
 
         self.assertEqual(self.calls, [
                 'get_project_quotas',
-                ('quota_reserve', expire, 0, 86400),
+                ('quota_reserve_batch', expire, 0, 86400),
+                ('quota_usage_refresh', 'test_project', ['instances']),
                 ])
         self.assertEqual(result, ['resv-1', 'resv-2', 'resv-3'])
 
+    def test_reserve_until_refresh_inline(self):
+        self._stub_get_project_quotas()
+        self._stub_quota_reserve()
+        self.flags(until_refresh=500, quota_usage_refresh_async=False)
+        expire = timeutils.utcnow() + datetime.timedelta(seconds=120)
+        self.driver.reserve(FakeContext('test_project', 'test_class'),
+                            quota.QUOTAS._resources,
+                            dict(instances=2), expire=expire)
+
+        self.assertEqual(self.calls, [
+                'get_project_quotas',
+                ('quota_reserve_batch', expire, 500, 0),
+                ])
+
+    def test_reserve_locking_all_usages(self):
+        self._stub_get_project_quotas()
+        self._stub_quota_reserve()
+        self.flags(quota_conditional_reservations=False)
+        expire = timeutils.utcnow() + datetime.timedelta(seconds=120)
+        result = self.driver.reserve(FakeContext('test_project', 'test_class'),
+                                     quota.QUOTAS._resources,
+                                     dict(instances=2), expire=expire)
+
+        self.assertEqual(self.calls, [
+                'get_project_quotas',
+                ('quota_reserve', expire, 0, 0),
+                ])
+        self.assertEqual(result, ['resv-1', 'resv-2', 'resv-3'])
+
+    def test_reserve_batch(self):
+        self._stub_get_project_quotas()
+        self._stub_quota_reserve()
+        result = self.driver.reserve_batch(
+                FakeContext('test_project', 'test_class'),
+                quota.QUOTAS._resources,
+                [dict(instances=1), dict(instances=1, cores=2)])
+
+        expire = timeutils.utcnow() + datetime.timedelta(seconds=86400)
+        self.assertEqual(self.calls, [
+                'get_project_quotas',
+                ('quota_reserve_batch', expire, 0, 0),
+                ])
+        self.assertEqual(result, [['resv-1', 'resv-2', 'resv-3'],
+                                  ['resv-1', 'resv-2', 'resv-3']])
+
+    def test_reserve_stats(self):
+        self._stub_get_project_quotas()
+        self._stub_quota_reserve()
+        context = FakeContext('test_project', 'test_class')
+        self.driver.reserve_batch(context, quota.QUOTAS._resources,
+                                  [dict(instances=1), dict(instances=1)])
+        self.assertRaises(exception.OverQuota, self.driver.reserve,
+                          context, quota.QUOTAS._resources,
+                          dict(instances=20, cores=2))
+
+        stats = self.driver.get_stats()
+        self.assertEqual(stats['reserve_calls'], 2)
+        self.assertEqual(stats['reserve_requests'], 3)
+        self.assertEqual(stats['rows_updated'], 1)
+        self.assertEqual(stats['update_misses'], 1)
+        self.assertEqual(stats['over_quota'], 1)
+        self.assertEqual(stats['over_quota_resources'], dict(instances=1))
+        self.assertTrue(stats['reserve_time'] >= stats['reserve_time_max'])
+        self.assertEqual(stats['usage_refresh']['requested'], 0)
+
+    def test_reserve_stats_logged(self):
+        self.flags(quota_stats_log_interval=60)
+        self._stub_get_project_quotas()
+        self._stub_quota_reserve()
+        logged = []
+        self.stubs.Set(quota.LOG, 'debug', logged.append)
+        now = [1000.0]
+        self.stubs.Set(quota.time, 'time', lambda: now[0])
+        self.driver._stats_logged_at = now[0]
+        context = FakeContext('test_project', 'test_class')
+
+        self.driver.reserve(context, quota.QUOTAS._resources,
+                            dict(instances=1))
+        self.assertEqual(logged, [])
+        now[0] += 60
+        self.driver.reserve(context, quota.QUOTAS._resources,
+                            dict(instances=1))
+        self.assertEqual(len(logged), 1)
+        self.assertTrue('reserve_calls' in logged[0])
+
     def test_usage_reset(self):
         calls = []
 
@@ -1369,6 +1502,53 @@ class FakeUsage(sqa_models.QuotaUsage):
         pass
 
 
+class QuotaUsageReconcilerTestCase(test.TestCase):
+    def setUp(self):
+        super(QuotaUsageReconcilerTestCase, self).setUp()
+        self.reconciler = quota.QuotaUsageReconciler()
+        self.spawned = []
+        self.refreshed = []
+
+        def fake_quota_usage_refresh(context, resources, keys, until_refresh,
+                                     max_age, project_id=None, force=False):
+            if project_id == 'bad_project':
+                raise exception.DBError()
+            self.refreshed.append((project_id, keys))
+            return dict((key, 1) for key in keys)
+
+        self.stubs.Set(db, 'quota_usage_refresh', fake_quota_usage_refresh)
+        self.stubs.Set(eventlet, 'spawn_n', self.spawned.append)
+
+    def test_requests_are_coalesced(self):
+        resources = quota.QUOTAS._resources
+        self.reconciler.request_refresh(resources, 'project1', ['instances'])
+        self.reconciler.request_refresh(resources, 'project2', ['ram'])
+        self.reconciler.request_refresh(resources, 'project1', ['cores'])
+        self.assertEqual(len(self.spawned), 1)
+        self.assertEqual(self.reconciler.get_stats()['pending'], 2)
+
+        self.spawned[0]()
+        self.assertEqual(sorted(self.refreshed), [
+                ('project1', ['cores', 'instances']),
+                ('project2', ['ram']),
+                ])
+        self.assertEqual(self.reconciler.get_stats(), dict(
+                requested=3, coalesced=1, refreshed=2, failed=0, pending=0))
+
+        self.reconciler.request_refresh(resources, 'project1', ['ram'])
+        self.assertEqual(len(self.spawned), 2)
+
+    def test_failed_refresh(self):
+        resources = quota.QUOTAS._resources
+        self.reconciler.request_refresh(resources, 'bad_project', ['ram'])
+        self.reconciler.request_refresh(resources, 'project1', ['ram'])
+        self.spawned[0]()
+        self.assertEqual(self.refreshed, [('project1', ['ram'])])
+        stats = self.reconciler.get_stats()
+        self.assertEqual(stats['failed'], 1)
+        self.assertEqual(stats['refreshed'], 1)
+
+
 class QuotaReserveSqlAlchemyTestCase(test.TestCase):
     # nova.db.sqlalchemy.api.quota_reserve is so complex it needs its
     # own test case, and since it's a quota manipulator, this is the
@@ -1909,6 +2089,148 @@ class QuotaReserveSqlAlchemyTestCase(test.TestCase):
                 ])
 
 
+class QuotaReserveBatchSqlAlchemyTestCase(test.TestCase):
+    def setUp(self):
+        super(QuotaReserveBatchSqlAlchemyTestCase, self).setUp()
+        self.context = context.RequestContext('fake_user', 'fake_project')
+        self.sync_called = []
+        self.in_use = dict(instances=1, cores=2, ram=512)
+
+        def sync(context, project_id, session):
+            self.sync_called.append(project_id)
+            return self.in_use.copy()
+
+        self.resources = dict((name, quota.ReservableResource(name, sync))
+                              for name in ('instances', 'cores', 'ram'))
+        self.quotas = dict(instances=5, cores=10, ram=4096)
+        self.expire = timeutils.utcnow() + datetime.timedelta(seconds=3600)
+
+    def _reserve(self, batch, until_refresh=0, max_age=0):
+        return sqa_api.quota_reserve_batch(self.context, self.resources,
+                                           self.quotas, batch, self.expire,
+                                           until_refresh, max_age)
+
+    def _usages(self):
+        usages = db.quota_usage_get_all_by_project(self.context,
+                                                   'fake_project')
+        del usages['project_id']
+        return usages
+
+    def test_reserve_batch(self):
+        result = self._reserve([dict(instances=1, cores=2),
+                                dict(instances=2, ram=1024)])
+
+        self.assertEqual(self.sync_called, ['fake_project'])
+        self.assertEqual(self._usages(), dict(
+                instances=dict(in_use=1, reserved=3),
+                cores=dict(in_use=2, reserved=2),
+                ram=dict(in_use=512, reserved=1024)))
+        self.assertEqual([len(r) for r in result], [2, 2])
+        self.assertEqual(db.reservation_get(self.context,
+                                            result[1][0])['project_id'],
+                         'fake_project')
+
+        db.reservation_commit(self.context, result[0],
+                              project_id='fake_project')
+        db.reservation_rollback(self.context, result[1],
+                                project_id='fake_project')
+        self.assertEqual(self._usages(), dict(
+                instances=dict(in_use=2, reserved=0),
+                cores=dict(in_use=4, reserved=0),
+                ram=dict(in_use=512, reserved=0)))
+
+    def test_reserve_batch_no_refresh(self):
+        self._reserve([dict(instances=1)])
+        self._reserve([dict(instances=1)])
+        self.assertEqual(self.sync_called, ['fake_project'])
+        self.assertEqual(self._usages()['instances'],
+                         dict(in_use=1, reserved=2))
+
+    def test_reserve_batch_until_refresh(self):
+        self._reserve([dict(instances=1)], until_refresh=2)
+        self._reserve([dict(instances=1)], until_refresh=2)
+        self.assertEqual(len(self.sync_called), 1)
+        self.in_use['instances'] = 2
+        self._reserve([dict(instances=1)], until_refresh=2)
+        self.assertEqual(len(self.sync_called), 2)
+        self.assertEqual(self._usages()['instances'],
+                         dict(in_use=2, reserved=3))
+
+    def test_reserve_batch_defer_refresh(self):
+        sqa_api.quota_reserve_batch(self.context, self.resources,
+                                    self.quotas, [dict(instances=1)],
+                                    self.expire, 1, 0, defer_refresh=True)
+        self.assertEqual(len(self.sync_called), 1)
+        self.in_use['instances'] = 2
+        sqa_api.quota_reserve_batch(self.context, self.resources,
+                                    self.quotas, [dict(instances=1)],
+                                    self.expire, 1, 0, defer_refresh=True)
+        self.assertEqual(len(self.sync_called), 1)
+        self.assertEqual(self._usages()['instances'],
+                         dict(in_use=1, reserved=2))
+
+        result = db.quota_usage_refresh(self.context, self.resources,
+                                        ['instances', 'ram'], 1, 0)
+        self.assertEqual(len(self.sync_called), 2)
+        self.assertEqual(result, dict(instances=2, cores=2, ram=512))
+        self.assertEqual(self._usages()['instances'],
+                         dict(in_use=2, reserved=2))
+
+        # Nothing is due any more, so no row is locked
+        locks = []
+        get_quota_usages = sqa_api._get_quota_usages
+
+        def fake_get_quota_usages(*args, **kwargs):
+            locks.append(kwargs.get('lock', True))
+            return get_quota_usages(*args, **kwargs)
+
+        self.stubs.Set(sqa_api, '_get_quota_usages', fake_get_quota_usages)
+        result = db.quota_usage_refresh(self.context, self.resources,
+                                        ['instances'], 1, 0)
+        self.assertEqual(result, {})
+        self.assertEqual(locks, [False])
+        result = db.quota_usage_refresh(self.context, self.resources,
+                                        ['instances'], 1, 0, force=True)
+        self.assertEqual(len(self.sync_called), 3)
+
+    def test_reserve_batch_over_quota(self):
+        self._reserve([dict(cores=2)])
+        exc = self.assertRaises(exception.OverQuota, self._reserve,
+                                [dict(instances=2, cores=4),
+                                 dict(instances=2, cores=4)])
+
+        self.assertEqual(exc.kwargs['overs'], ['cores'])
+        # Nothing from the refused batch stays reserved
+        self.assertEqual(self._usages(), dict(
+                instances=dict(in_use=1, reserved=0),
+                cores=dict(in_use=2, reserved=2),
+                ram=dict(in_use=512, reserved=0)))
+
+    def test_reserve_batch_stats(self):
+        stats = {}
+        sqa_api.quota_reserve_batch(self.context, self.resources,
+                                    self.quotas, [dict(cores=2)],
+                                    self.expire, 0, 0, stats=stats)
+        self.assertEqual(stats, dict(rows_refreshed=3, rows_updated=1,
+                                     update_misses=0))
+
+        self.assertRaises(exception.OverQuota, sqa_api.quota_reserve_batch,
+                          self.context, self.resources, self.quotas,
+                          [dict(instances=4, cores=8)], self.expire, 0, 0,
+                          stats=stats)
+        self.assertEqual(stats, dict(rows_refreshed=3, rows_updated=2,
+                                     update_misses=1, rows_handed_back=1))
+
+    def test_reserve_batch_unlimited_and_reduction(self):
+        self.quotas['ram'] = -1
+        self.in_use['instances'] = 10
+        self._reserve([dict(instances=-2, ram=100000)])
+        self.assertEqual(self._usages(), dict(
+                instances=dict(in_use=10, reserved=0),
+                cores=dict(in_use=2, reserved=0),
+                ram=dict(in_use=512, reserved=100000)))
+
+
 class NoopQuotaDriverTestCase(test.TestCase):
     def setUp(self):
         super(NoopQuotaDriverTestCase, self).setUp()
@@ -21,6 +21,7 @@ import os
 import os.path
 import StringIO
 import tempfile
+import urllib
 
 import mox
 
@@ -789,3 +790,21 @@ class MetadataToDictTestCase(test.TestCase):
 
     def test_metadata_to_dict_empty(self):
         self.assertEqual(utils.metadata_to_dict([]), {})
+
+
+class PaginationCursorTestCase(test.TestCase):
+    def test_round_trip(self):
+        values = {'created_at': datetime.datetime(2013, 1, 2, 3, 4, 5, 6),
+                  'id': 42,
+                  'display_name': u'server'}
+        cursor = utils.encode_pagination_cursor(values)
+        self.assertEqual(utils.decode_pagination_cursor(cursor), values)
+
+    def test_cursor_is_url_safe(self):
+        cursor = utils.encode_pagination_cursor({'display_name': '?>?>?>'})
+        self.assertEqual(cursor, urllib.quote(cursor))
+
+    def test_decode_invalid(self):
+        for cursor in ('asdf', '', 'W10', u'\u2603'):
+            self.assertRaises(ValueError,
+                              utils.decode_pagination_cursor, cursor)
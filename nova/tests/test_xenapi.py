@@ -2073,7 +2073,7 @@ class XenAPIDom0IptablesFirewallTestCase(stubs.XenAPITestBase):
                                        'to_port': 299,
                                        'cidr': '192.168.99.0/24'})
         #validate the extra rule
-        self.fw.refresh_security_group_rules(secgroup)
+        self.fw.refresh_security_group_rules(secgroup['id'])
         regex = re.compile('\[0\:0\] -A .* -j ACCEPT -p udp --dport 200:299'
                            ' -s 192.168.99.0/24')
         self.assertTrue(len(filter(regex.match, self._out_rules)) > 0,
@@ -232,13 +232,13 @@ class FakeSessionForFirewallTests(FakeSessionForVMTests):
                     output = '\n'.join(self._in6_filter_rules)
                 if cmd == ['iptables-save', '-c']:
                     output = '\n'.join(self._in_rules)
-                if cmd == ['iptables-restore', '-c', ]:
+                if cmd[:2] == ['iptables-restore', '-c']:
                     lines = process_input.split('\n')
                     if '*filter' in lines:
                         if self._test_case is not None:
                             self._test_case._out_rules = lines
                         output = '\n'.join(lines)
-                if cmd == ['ip6tables-restore', '-c', ]:
+                if cmd[:2] == ['ip6tables-restore', '-c']:
                     lines = process_input.split('\n')
                     if '*filter' in lines:
                         output = '\n'.join(lines)
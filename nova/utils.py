@@ -19,6 +19,7 @@
 
 """Utilities and helper functions."""
 
+import base64
 import contextlib
 import datetime
 import errno
@@ -47,6 +48,7 @@ from nova import exception
 from nova.openstack.common import cfg
 from nova.openstack.common import excutils
 from nova.openstack.common import importutils
+from nova.openstack.common import jsonutils
 from nova.openstack.common import log as logging
 from nova.openstack.common import timeutils
 
@@ -1268,3 +1270,36 @@ def metadata_to_dict(metadata):
     for item in metadata:
         result[item['key']] = item['value']
     return result
+
+
+def encode_pagination_cursor(values):
+    """Encode a dictionary of sort key values as an opaque marker.
+
+    The cursor lets the next page be fetched by seeking to the values
+    instead of first looking up the last item of the previous page.
+    """
+    cursor = {}
+    for key, value in values.iteritems():
+        if isinstance(value, datetime.datetime):
+            value = {'datetime': timeutils.strtime(value)}
+        cursor[key] = value
+    return base64.urlsafe_b64encode(jsonutils.dumps(cursor)).rstrip('=')
+
+
+def decode_pagination_cursor(cursor):
+    """Return the sort key values encoded by encode_pagination_cursor().
+
+    Raises ValueError if cursor isn't such a marker.
+    """
+    try:
+        cursor = str(cursor)
+        padding = '=' * (-len(cursor) % 4)
+        values = jsonutils.loads(base64.urlsafe_b64decode(cursor + padding))
+        if not isinstance(values, dict):
+            raise ValueError()
+        for key, value in values.items():
+            if isinstance(value, dict):
+                values[key] = timeutils.parse_strtime(value['datetime'])
+    except (TypeError, KeyError, UnicodeEncodeError, ValueError):
+        raise ValueError(_('Invalid pagination cursor %s') % cursor)
+    return values
@@ -37,6 +37,11 @@ firewall_opts = [
     cfg.BoolOpt('allow_same_net_traffic',
                 default=True,
                 help='Whether to allow network traffic from same network'),
+    cfg.BoolOpt('firewall_use_ipset',
+                default=False,
+                help='Keep the members of security groups used as rule '
+                     'sources in ipsets, instead of writing an iptables '
+                     'rule for every member'),
 ]
 
 CONF = cfg.CONF
@@ -144,8 +149,19 @@ class IptablesFirewallDriver(FirewallDriver):
     def __init__(self, virtapi, **kwargs):
         super(IptablesFirewallDriver, self).__init__(virtapi)
         self.iptables = linux_net.iptables_manager
+        self.ipset = linux_net.ipset_manager
         self.instances = {}
         self.network_infos = {}
+        # security group id -> {ip version: set name} for the ipsets
+        # holding the members of groups granted access
+        self.security_group_sets = {}
+        # instance id -> ids of the security groups whose ipsets the
+        # instance's rules match on
+        self.instance_set_groups = {}
+        # security group id -> ids of the instances whose rules use the
+        # group, directly or as the grantee of a rule, and the reverse
+        self.security_group_instances = {}
+        self.instance_security_groups = {}
         self.basically_filtered = False
 
         self.iptables.ipv4['filter'].add_chain('sg-fallback')
@@ -165,6 +181,7 @@ class IptablesFirewallDriver(FirewallDriver):
 
     def filter_defer_apply_off(self):
         self.iptables.defer_apply_off()
+        self._destroy_unused_sets()
 
     def unfilter_instance(self, instance, network_info):
         # make sure this is legacy nw_info
@@ -173,8 +190,10 @@ class IptablesFirewallDriver(FirewallDriver):
         if self.instances.pop(instance['id'], None):
             # NOTE(vish): use the passed info instead of the stored info
             self.network_infos.pop(instance['id'])
+            self._index_security_groups(instance['id'], [])
+            self.instance_set_groups.pop(instance['id'], None)
             self.remove_filters_for_instance(instance)
-            self.iptables.apply()
+            self._apply_rules()
         else:
             LOG.info(_('Attempted to unfilter instance which is not '
                      'filtered'), instance=instance)
@@ -190,7 +209,7 @@ class IptablesFirewallDriver(FirewallDriver):
         LOG.debug(_('Filters added to instance'), instance=instance)
         self.refresh_provider_fw_rules()
         LOG.debug(_('Provider Firewall Rules refreshed'), instance=instance)
-        self.iptables.apply()
+        self._apply_rules()
 
     def _create_filter(self, ips, chain_name):
         return ['-d %s -j $%s' % (ip, chain_name) for ip in ips]
@@ -328,6 +347,10 @@ class IptablesFirewallDriver(FirewallDriver):
         network_info = self._handle_network_info_model(network_info)
 
         ctxt = context.get_admin_context()
+        instance_id = instance['id']
+        security_group_ids = set()
+        set_group_ids = set()
+        member_ips = {}
 
         ipv4_rules = []
         ipv6_rules = []
@@ -353,12 +376,15 @@ class IptablesFirewallDriver(FirewallDriver):
 
         # then, security group chains and rules
         for security_group in security_groups:
+            security_group_ids.add(security_group['id'])
             rules = self._virtapi.security_group_rule_get_by_security_group(
                 ctxt, security_group)
 
             for rule in rules:
                 LOG.debug(_('Adding security group rule: %r'), rule,
                           instance=instance)
+                if rule['grantee_group']:
+                    security_group_ids.add(rule['grantee_group']['id'])
 
                 if not rule['cidr']:
                     version = 4
@@ -391,7 +417,13 @@ class IptablesFirewallDriver(FirewallDriver):
                     args += ['-s', rule['cidr']]
                     fw_rules += [' '.join(args)]
                 else:
-                    if rule['grantee_group']:
+                    if rule['grantee_group'] and CONF.firewall_use_ipset:
+                        set_name = self._security_group_set(
+                            ctxt, rule['grantee_group'], version, member_ips)
+                        set_group_ids.add(rule['grantee_group']['id'])
+                        args += ['-m set --match-set %s src' % set_name]
+                        fw_rules += [' '.join(args)]
+                    elif rule['grantee_group']:
                         # FIXME(jkoelker) This needs to be ported up into
                         #                 the compute manager which already
                         #                 has access to a nw_api handle,
@@ -416,40 +448,195 @@ class IptablesFirewallDriver(FirewallDriver):
         ipv4_rules += ['-j $sg-fallback']
         ipv6_rules += ['-j $sg-fallback']
 
+        self._index_security_groups(instance_id, security_group_ids)
+        if set_group_ids:
+            self.instance_set_groups[instance_id] = set_group_ids
+        else:
+            self.instance_set_groups.pop(instance_id, None)
         return ipv4_rules, ipv6_rules
 
+    def _index_security_groups(self, instance_id, security_group_ids):
+        """Record the security groups an instance's rules depend on."""
+        for security_group_id in self.instance_security_groups.pop(
+                instance_id, ()):
+            instance_ids = self.security_group_instances[security_group_id]
+            instance_ids.discard(instance_id)
+            if not instance_ids:
+                del self.security_group_instances[security_group_id]
+
+        if security_group_ids:
+            self.instance_security_groups[instance_id] = set(
+                security_group_ids)
+            for security_group_id in security_group_ids:
+                self.security_group_instances.setdefault(
+                    security_group_id, set()).add(instance_id)
+
+    def _security_group_instances(self, security_group_id, members=False):
+        """Return the filtered instances using a security group.
+
+        With members, the instances the database now has as members of
+        the group are included, as an instance which just joined it is
+        not indexed under it until its rules are rebuilt.
+        """
+        instance_ids = set(self.security_group_instances.get(
+            security_group_id, ()))
+        if members:
+            ctxt = context.get_admin_context()
+            for instance_id, instance in self.instances.items():
+                security_groups = (self._virtapi.
+                                   security_group_get_by_instance(ctxt,
+                                                                  instance))
+                if any(security_group['id'] == security_group_id
+                       for security_group in security_groups):
+                    instance_ids.add(instance_id)
+        return [self.instances[instance_id]
+                for instance_id in sorted(instance_ids)
+                if instance_id in self.instances]
+
+    @staticmethod
+    def _security_group_set_name(security_group_id, version):
+        # ipset names are limited to 31 characters
+        return 'nova-sg%s-v%d' % (security_group_id, version)
+
+    def _security_group_member_ips(self, ctxt, security_group):
+        """Return the fixed ips of the group's members by ip version."""
+        # FIXME(jkoelker) This needs to be ported up into the compute
+        #                 manager, see instance_rules.
+        nw_api = network.API()
+        ips = {4: [], 6: []}
+        for instance in security_group['instances']:
+            nw_info = nw_api.get_instance_nw_info(ctxt, instance)
+            for ip in nw_info.fixed_ips():
+                ips[ip['version']].append(ip['address'])
+        return ips
+
+    def _security_group_set(self, ctxt, security_group, version, member_ips):
+        """Return the name of the ipset holding a group's members.
+
+        The members of the set are brought up to date each time the
+        rules using it are built, as refreshing an instance's rules is
+        how a change of membership is passed on.  member_ips holds the
+        members already found for each group by the caller.
+        """
+        ips = member_ips.get(security_group['id'])
+        if ips is None:
+            ips = self._security_group_member_ips(ctxt, security_group)
+            member_ips[security_group['id']] = ips
+        sets = self.security_group_sets.setdefault(security_group['id'], {})
+        name = self._security_group_set_name(security_group['id'], version)
+        self.ipset.set_members(name, version, ips[version])
+        sets[version] = name
+        return name
+
+    def _refresh_security_group_sets(self, security_group_id):
+        """Bring the ipsets of a group in line with its members.
+
+        The instance chains match on the sets, so they stay as they are.
+        The group's members are found through the rules of the instances
+        on this host granting the group access; if there are none left,
+        its sets are destroyed.
+        """
+        sets = self.security_group_sets.get(security_group_id)
+        if not sets:
+            return
+
+        ctxt = context.get_admin_context()
+        for instance in self._security_group_instances(security_group_id):
+            security_groups = self._virtapi.security_group_get_by_instance(
+                ctxt, instance)
+            for security_group in security_groups:
+                rules = (self._virtapi.
+                         security_group_rule_get_by_security_group(
+                             ctxt, security_group))
+                for rule in rules:
+                    grantee_group = rule['grantee_group']
+                    if (grantee_group and
+                            grantee_group['id'] == security_group_id):
+                        ips = self._security_group_member_ips(ctxt,
+                                                              grantee_group)
+                        for version, name in sets.items():
+                            self.ipset.set_members(name, version,
+                                                   ips[version])
+                        return
+
+        for version, name in sets.items():
+            if self.ipset.destroy(name):
+                del sets[version]
+        if not sets:
+            del self.security_group_sets[security_group_id]
+
+    def _destroy_unused_sets(self):
+        """Destroy the ipsets of groups no instance's rules match on.
+
+        This is done once the rules are applied, as a set can't be
+        destroyed while iptables uses it.  A set which can't be destroyed
+        is kept and tried again the next time.
+        """
+        if self.iptables.iptables_apply_deferred:
+            return
+        used = set()
+        for security_group_ids in self.instance_set_groups.itervalues():
+            used.update(security_group_ids)
+        for security_group_id, sets in self.security_group_sets.items():
+            if security_group_id in used:
+                continue
+            for version, name in sets.items():
+                if self.ipset.destroy(name):
+                    del sets[version]
+            if not sets:
+                del self.security_group_sets[security_group_id]
+
+    def _apply_rules(self):
+        """Apply the iptables rules and drop the ipsets left unused."""
+        self.iptables.apply()
+        self._destroy_unused_sets()
+
     def instance_filter_exists(self, instance, network_info):
         pass
 
     def refresh_security_group_members(self, security_group):
+        if CONF.firewall_use_ipset:
+            self._refresh_security_group_sets(security_group)
+            return
         self.do_refresh_security_group_rules(security_group)
         self.iptables.apply()
 
     def refresh_security_group_rules(self, security_group):
         self.do_refresh_security_group_rules(security_group)
-        self.iptables.apply()
+        self._apply_rules()
 
     def refresh_instance_security_rules(self, instance):
         self.do_refresh_instance_rules(instance)
-        self.iptables.apply()
+        self._apply_rules()
 
     @lockutils.synchronized('iptables', 'nova-', external=True)
-    def _inner_do_refresh_rules(self, instance, ipv4_rules,
-                                               ipv6_rules):
-        self.remove_filters_for_instance(instance)
-        self.add_filters_for_instance(instance, ipv4_rules, ipv6_rules)
+    def _inner_do_refresh_rules(self, instances_rules):
+        for instance, ipv4_rules, ipv6_rules in instances_rules:
+            self.remove_filters_for_instance(instance)
+            self.add_filters_for_instance(instance, ipv4_rules, ipv6_rules)
 
     def do_refresh_security_group_rules(self, security_group):
-        for instance in self.instances.values():
+        """Rebuild the chains of the instances using a security group.
+
+        Only instances whose rules refer to the group, as one of their
+        own groups or as the grantee of a rule, and the instances which
+        are now members of the group are rebuilt.  Their rules are all
+        computed before the chains are swapped under one lock.
+        """
+        instances_rules = []
+        for instance in self._security_group_instances(security_group,
+                                                       members=True):
             network_info = self.network_infos[instance['id']]
             ipv4_rules, ipv6_rules = self.instance_rules(instance,
                                                          network_info)
-            self._inner_do_refresh_rules(instance, ipv4_rules, ipv6_rules)
+            instances_rules.append((instance, ipv4_rules, ipv6_rules))
+        if instances_rules:
+            self._inner_do_refresh_rules(instances_rules)
 
     def do_refresh_instance_rules(self, instance):
         network_info = self.network_infos[instance['id']]
         ipv4_rules, ipv6_rules = self.instance_rules(instance, network_info)
-        self._inner_do_refresh_rules(instance, ipv4_rules, ipv6_rules)
+        self._inner_do_refresh_rules([(instance, ipv4_rules, ipv6_rules)])
 
     def refresh_provider_fw_rules(self):
         """See :class:`FirewallDriver` docs."""
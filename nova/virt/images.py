@@ -21,10 +21,13 @@
 Handling of VM disk images.
 """
 
+import hashlib
 import os
 import re
+import time
 
 from nova import exception
+from nova.image import download
 from nova.image import glance
 from nova.openstack.common import cfg
 from nova.openstack.common import log as logging
@@ -49,7 +52,7 @@ class QemuImgInfo(object):
     TOP_LEVEL_RE = re.compile(r"^([\w\d\s\_\-]+):(.*)$")
     SIZE_RE = re.compile(r"\(\s*(\d+)\s+bytes\s*\)", re.I)
 
-    def __init__(self, cmd_output):
+    def __init__(self, cmd_output=None):
         details = self._parse(cmd_output)
         self.image = details.get('image')
         self.backing_file = details.get('backing_file')
@@ -174,14 +177,69 @@ class QemuImgInfo(object):
         return contents
 
 
+class QemuImgInfoCache(object):
+    """The parsed qemu-img info of image files, kept until they change.
+
+    An entry is used for as long as the inode, mtime and size of its file
+    are those the file had when qemu-img was run on it.
+    """
+
+    MAX_ENTRIES = 1000
+
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.entries.pop(path, None)
+            return self._run(path)
+
+        key = (st.st_ino, st.st_mtime, st.st_size)
+        entry = self.entries.get(path)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+
+        started = time.time()
+        info = self._run(path)
+        # NOTE: a file modified within the mtime granularity of the time
+        #       qemu-img ran may change again with the same mtime, so its
+        #       info is not kept.
+        if st.st_mtime < started - 1:
+            self._add(path, key, info)
+        else:
+            self.entries.pop(path, None)
+        return info
+
+    def _run(self, path):
+        out, err = utils.execute('env', 'LC_ALL=C', 'LANG=C',
+                                 'qemu-img', 'info', path)
+        return QemuImgInfo(out)
+
+    def _add(self, path, key, info):
+        if len(self.entries) >= self.MAX_ENTRIES:
+            for cached_path in self.entries.keys():
+                if not os.path.exists(cached_path):
+                    del self.entries[cached_path]
+            if len(self.entries) >= self.MAX_ENTRIES:
+                self.entries.clear()
+        self.entries[path] = (key, info)
+
+
+_qemu_img_info_cache = QemuImgInfoCache()
+
+
 def qemu_img_info(path):
-    """Return an object containing the parsed output from qemu-img info."""
+    """Return an object containing the parsed output from qemu-img info.
+
+    The output is cached until the file changes, so callers must not
+    modify the object returned.
+    """
     if not os.path.exists(path):
         return QemuImgInfo()
 
-    out, err = utils.execute('env', 'LC_ALL=C', 'LANG=C',
-                             'qemu-img', 'info', path)
-    return QemuImgInfo(out)
+    return _qemu_img_info_cache.get(path)
 
 
 def convert_image(source, dest, out_format):
@@ -190,21 +248,122 @@ def convert_image(source, dest, out_format):
     utils.execute(*cmd)
 
 
+class ImageFile(object):
+    """Write an image file as it is downloaded, in one pass.
+
+    The data is hashed with SHA1 on the way.  Blocks of zeros are
+    skipped instead of written, leaving holes in the file, so the file
+    must be newly created.
+    """
+
+    BLOCK_SIZE = 65536
+    ZERO_BLOCK = '\0' * BLOCK_SIZE
+
+    def __init__(self, image_file):
+        self.image_file = image_file
+        self.sha1 = hashlib.sha1()
+        self.size = 0
+        self._pending = []
+        self._pending_size = 0
+
+    def write(self, data):
+        if not data:
+            return
+        self.sha1.update(data)
+        self.size += len(data)
+        self._pending.append(data)
+        self._pending_size += len(data)
+        if self._pending_size >= self.BLOCK_SIZE:
+            data = ''.join(self._pending)
+            end = len(data) - len(data) % self.BLOCK_SIZE
+            self._write_blocks(data[:end])
+            self._pending = [data[end:]]
+            self._pending_size = len(data) - end
+
+    def close(self):
+        """Write what is left and set the final size of the file."""
+        self._write_blocks(''.join(self._pending))
+        self._pending = []
+        self._pending_size = 0
+        self.image_file.truncate(self.size)
+
+    @property
+    def checksum(self):
+        return self.sha1.hexdigest()
+
+    def _write_blocks(self, data):
+        for start in xrange(0, len(data), self.BLOCK_SIZE):
+            block = data[start:start + self.BLOCK_SIZE]
+            if block == self.ZERO_BLOCK[:len(block)]:
+                self.image_file.seek(len(block), os.SEEK_CUR)
+            else:
+                self.image_file.write(block)
+
+
+class DownloadedFile(object):
+    """An image file downloaded out of order, so not hashed on the way."""
+
+    checksum = None
+
+
+def _fetch_in_ranges(context, image_service, image_id, path):
+    """Download an image in chunks, if its image service allows it.
+
+    An interrupted download is left in place, to be resumed by the next
+    one.  Returns None if the image has to be downloaded in one stream.
+    """
+    get_data_request = getattr(image_service, 'get_data_request', None)
+    if get_data_request is None:
+        return None
+    request = get_data_request(context, image_id)
+    if request is None:
+        return None
+    url, headers = request
+    ranged = download.RangedDownload(url, path, headers)
+    if not ranged.probe():
+        ranged.discard_state()
+        return None
+    ranged.fetch()
+    return DownloadedFile()
+
+
 def fetch(context, image_href, path, _user_id, _project_id):
+    """Download an image to path.
+
+    Returns the ImageFile the image was written through, which knows its
+    checksum, or a DownloadedFile if it was downloaded in chunks.
+    """
     # TODO(vish): Improve context handling and add owner and auth data
     #             when it is added to glance.  Right now there is no
     #             auth checking in glance, so we assume that access was
     #             checked before we got here.
     (image_service, image_id) = glance.get_remote_image_service(context,
                                                                 image_href)
+    if CONF.image_download_chunk_size:
+        fetched = _fetch_in_ranges(context, image_service, image_id, path)
+        if fetched is not None:
+            return fetched
+
+    throttle = download.get_throttle()
     with utils.remove_path_on_error(path):
-        with open(path, "wb") as image_file:
-            image_service.download(context, image_id, image_file)
+        with throttle.semaphore:
+            with open(path, "wb") as image_file:
+                fetched = ImageFile(image_file)
+                image_service.download(context, image_id,
+                                       download.ThrottledWriter(fetched))
+                fetched.close()
+    return fetched
 
 
 def fetch_to_raw(context, image_href, path, user_id, project_id):
+    """Download an image to path, converting it to raw if configured.
+
+    Returns the SHA1 checksum of the file at path if it is the image as
+    downloaded in one stream, or None if it was converted or downloaded
+    in chunks.
+    """
     path_tmp = "%s.part" % path
-    fetch(context, image_href, path_tmp, user_id, project_id)
+    fetched = fetch(context, image_href, path_tmp, user_id, project_id)
 
     with utils.remove_path_on_error(path_tmp):
         data = qemu_img_info(path_tmp)
@@ -233,6 +392,9 @@ def fetch_to_raw(context, image_href, path, user_id, project_id):
                         data.file_format)
 
                 os.rename(staged, path)
+                os.unlink(path_tmp)
+                return None
 
         else:
             os.rename(path_tmp, path)
+            return fetched.checksum
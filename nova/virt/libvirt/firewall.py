@@ -244,8 +244,10 @@ class IptablesFirewallDriver(base_firewall.IptablesFirewallDriver):
         if self.instances.pop(instance['id'], None):
             # NOTE(vish): use the passed info instead of the stored info
             self.network_infos.pop(instance['id'])
+            self._index_security_groups(instance['id'], [])
+            self.instance_set_groups.pop(instance['id'], None)
             self.remove_filters_for_instance(instance)
-            self.iptables.apply()
+            self._apply_rules()
             self.nwfilter.unfilter_instance(instance, network_info)
         else:
             LOG.info(_('Attempted to unfilter instance which is not '
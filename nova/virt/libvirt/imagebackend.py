@@ -26,6 +26,7 @@ from nova.openstack.common import lockutils
 from nova import utils
 from nova.virt.disk import api as disk
 from nova.virt.libvirt import config as vconfig
+from nova.virt.libvirt import imagecache
 from nova.virt.libvirt import snapshots
 from nova.virt.libvirt import utils as libvirt_utils
 
@@ -48,6 +49,7 @@ __imagebackend_opts = [
 CONF = cfg.CONF
 CONF.register_opts(__imagebackend_opts)
 CONF.import_opt('base_dir_name', 'nova.virt.libvirt.imagecache')
+CONF.import_opt('checksum_base_images', 'nova.virt.libvirt.imagecache')
 
 
 class Image(object):
@@ -118,7 +120,12 @@ class Image(object):
                                 lock_path=self.lock_path)
         def call_if_not_exists(target, *args, **kwargs):
             if not os.path.exists(target):
-                fetch_func(target=target, *args, **kwargs)
+                checksum = fetch_func(target=target, *args, **kwargs)
+                # NOTE: fetch_image hashes the image as it downloads it,
+                #       which saves the image cache from reading it back.
+                if checksum and CONF.checksum_base_images:
+                    imagecache.write_stored_checksum(target,
+                                                     checksum=checksum)
 
         if not os.path.exists(self.path):
             base_dir = os.path.join(CONF.instances_path, CONF.base_dir_name)
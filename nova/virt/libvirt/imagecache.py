@@ -28,8 +28,11 @@ import os
 import re
 import time
 
+from eventlet import greenthread
+
 from nova.compute import task_states
 from nova.compute import vm_states
+from nova.image import download
 from nova.openstack.common import cfg
 from nova.openstack.common import fileutils
 from nova.openstack.common import jsonutils
@@ -68,6 +71,12 @@ imagecache_opts = [
     cfg.IntOpt('checksum_interval_seconds',
                default=3600,
                help='How frequently to checksum base images'),
+    cfg.IntOpt('checksum_max_rate',
+               default=0,
+               help='Maximum rate in KB/s at which base images are read '
+                    'to checksum them. The reads are spread over '
+                    'checksum_interval_seconds in any case. 0 means no '
+                    'limit'),
     ]
 
 CONF = cfg.CONF
@@ -202,17 +211,289 @@ def read_stored_checksum(target, timestamped=True):
     return read_stored_info(target, field='sha1', timestamped=timestamped)
 
 
-def write_stored_checksum(target):
-    """Write a checksum to disk for a file in _base."""
+def write_stored_checksum(target, checksum=None):
+    """Write a checksum to disk for a file in _base.
+
+    The file is hashed unless its checksum is given.
+    """
 
-    with open(target, 'r') as img_file:
-        checksum = utils.hash_file(img_file)
+    if checksum is None:
+        with open(target, 'r') as img_file:
+            checksum = utils.hash_file(img_file)
     write_stored_info(target, field='sha1', value=checksum)
 
 
+CHECKSUM_CHUNK_SIZE = 64 * 1024 * 1024
+CHECKSUM_READ_SIZE = 1024 * 1024
+
+
+class ChecksumJob(object):
+    """Checksum a base image one chunk at a time.
+
+    The SHA1 of every chunk of an image is stored along with the SHA1 of
+    the whole image, and later checks compare the chunks one by one.  How
+    far a check got is stored too, so a check interrupted by a restart
+    carries on from the chunk it stopped at.  Images without chunk hashes
+    yet are hashed whole, which records their chunk hashes.
+    """
+
+    def __init__(self, img_id, base_file, lock_path, create_if_missing=True):
+        self.img_id = img_id
+        self.base_file = base_file
+        self.lock_path = lock_path
+        self.create_if_missing = create_if_missing
+
+        self.done = False
+        self.result = None
+
+        self.stored_checksum = None
+        self.chunk_count = None
+        self.next_chunk = 0
+        self.bad_chunks = []
+        # The stored chunk hashes to compare with, if there are any...
+        self.chunk_hashes = None
+        # ...otherwise the image is hashed whole
+        self.sha1 = None
+        self.new_chunk_hashes = []
+
+    def remaining_bytes(self):
+        try:
+            size = os.path.getsize(self.base_file)
+        except OSError:
+            return 0
+        return max(size - self.next_chunk * CHECKSUM_CHUNK_SIZE, 0)
+
+    def step(self, limiter=None):
+        """Start the check or check the next chunk, reading no faster than
+        limiter allows.  Sets done and result after the last chunk.
+        """
+        if self.chunk_count is None:
+            self._locked(self._start)
+        else:
+            self._check_chunk(limiter)
+            if self.next_chunk == self.chunk_count:
+                self._locked(self._finish_check)
+            elif self.chunk_hashes is not None:
+                self._locked(self._save_progress)
+
+    def _locked(self, func):
+        lock_name = 'hash-%s' % os.path.split(self.base_file)[-1]
+
+        # Protect against other nova-computes performing checksums at the same
+        # time if we are using shared storage
+        @lockutils.synchronized(lock_name, 'nova-', external=True,
+                                lock_path=self.lock_path)
+        def inner_locked():
+            func()
+
+        inner_locked()
+
+    def _finish(self, result):
+        self.done = True
+        self.result = result
+
+    def _start(self):
+        (stored_checksum, stored_timestamp) = read_stored_checksum(
+            self.base_file, timestamped=True)
+        if stored_checksum:
+            # NOTE(mikal): Checksums are timestamped. If we have recently
+            # checksummed (possibly on another compute node if we are using
+            # shared storage), then we don't need to checksum again.
+            if (stored_timestamp and
+                time.time() - stored_timestamp <
+                CONF.checksum_interval_seconds):
+                return self._finish(True)
+
+            # NOTE(mikal): If there is no timestamp, then the checksum was
+            # performed by a previous version of the code. The timestamp is
+            # written once the checksum verifies.
+
+        else:
+            LOG.info(_('image %(id)s at (%(base_file)s): image '
+                       'verification skipped, no hash stored'),
+                     {'id': self.img_id,
+                      'base_file': self.base_file})
+
+            # NOTE(mikal): If the checksum file is missing, then we should
+            # create one. Images downloaded from glance are hashed while
+            # they are fetched, so this is left for images that were
+            # converted to raw or fetched by an earlier version.
+            if not (CONF.checksum_base_images and self.create_if_missing):
+                return self._finish(None)
+            LOG.info(_('%(id)s (%(base_file)s): generating checksum'),
+                     {'id': self.img_id,
+                      'base_file': self.base_file})
+
+        self.stored_checksum = stored_checksum
+        size = os.path.getsize(self.base_file)
+        self.chunk_count = max(1, ((size + CHECKSUM_CHUNK_SIZE - 1) //
+                                   CHECKSUM_CHUNK_SIZE))
+
+        chunks = read_stored_info(self.base_file, field='sha1-chunks')
+        if (stored_checksum and chunks and
+            chunks.get('sha1') == stored_checksum and
+            chunks.get('chunk_size') == CHECKSUM_CHUNK_SIZE and
+            len(chunks.get('hashes', [])) == self.chunk_count):
+            self.chunk_hashes = chunks['hashes']
+            progress = read_stored_info(self.base_file, field='sha1-progress')
+            if progress and progress.get('sha1') == stored_checksum:
+                self.next_chunk = progress['next_chunk']
+                self.bad_chunks = progress['bad_chunks']
+                LOG.info(_('image %(id)s at (%(base_file)s): resuming '
+                           'verification at chunk %(chunk)d'),
+                         {'id': self.img_id,
+                          'base_file': self.base_file,
+                          'chunk': self.next_chunk})
+        else:
+            self.sha1 = hashlib.sha1()
+
+    def _check_chunk(self, limiter):
+        chunk_sha1 = hashlib.sha1()
+        with open(self.base_file, 'rb') as f:
+            f.seek(self.next_chunk * CHECKSUM_CHUNK_SIZE)
+            remaining = CHECKSUM_CHUNK_SIZE
+            while remaining:
+                data = f.read(min(CHECKSUM_READ_SIZE, remaining))
+                if not data:
+                    break
+                if limiter:
+                    limiter.consume(len(data))
+                chunk_sha1.update(data)
+                if self.sha1 is not None:
+                    self.sha1.update(data)
+                remaining -= len(data)
+
+        if self.sha1 is not None:
+            self.new_chunk_hashes.append(chunk_sha1.hexdigest())
+        elif chunk_sha1.hexdigest() != self.chunk_hashes[self.next_chunk]:
+            self.bad_chunks.append(self.next_chunk)
+        self.next_chunk += 1
+
+    def _save_progress(self):
+        write_stored_info(self.base_file, field='sha1-progress',
+                          value={'sha1': self.stored_checksum,
+                                 'next_chunk': self.next_chunk,
+                                 'bad_chunks': self.bad_chunks})
+
+    def _finish_check(self):
+        if self.sha1 is not None:
+            current_checksum = self.sha1.hexdigest()
+            bad = (self.stored_checksum and
+                   current_checksum != self.stored_checksum)
+        else:
+            write_stored_info(self.base_file, field='sha1-progress',
+                              value=None)
+            current_checksum = self.stored_checksum
+            bad = bool(self.bad_chunks)
+
+        if bad:
+            LOG.error(_('image %(id)s at (%(base_file)s): image '
+                        'verification failed'),
+                      {'id': self.img_id,
+                       'base_file': self.base_file})
+            if self.bad_chunks:
+                LOG.error(_('image %(id)s at (%(base_file)s): chunks '
+                            '%(chunks)s of %(chunk_size)d bytes differ'),
+                          {'id': self.img_id,
+                           'base_file': self.base_file,
+                           'chunks': self.bad_chunks,
+                           'chunk_size': CHECKSUM_CHUNK_SIZE})
+            return self._finish(False)
+
+        if self.sha1 is not None:
+            write_stored_info(self.base_file, field='sha1-chunks',
+                              value={'sha1': current_checksum,
+                                     'chunk_size': CHECKSUM_CHUNK_SIZE,
+                                     'hashes': self.new_chunk_hashes})
+        write_stored_info(self.base_file, field='sha1',
+                          value=current_checksum)
+        self._finish(self.stored_checksum and True or None)
+
+
+class ChecksumVerifier(object):
+    """Check the checksums of base images in a background greenthread.
+
+    The images due are read at the rate which checks them all within
+    checksum_interval_seconds, at most checksum_max_rate, so that a lot
+    of large images coming due together does not flood the disk.
+    """
+
+    def __init__(self, lock_path):
+        self.lock_path = lock_path
+        self.jobs = []
+        self.results = {}
+        self.limiter = download.RateLimiter(0)
+        self.running = False
+
+    def check(self, img_id, base_file):
+        """Queue a check of base_file if one is due.
+
+        Returns the result of the last check: True if the checksum was
+        ok, False if it was not, and None if it is not known.
+        """
+        if not [job for job in self.jobs if job.base_file == base_file]:
+            (stored_checksum, stored_timestamp) = read_stored_checksum(
+                base_file, timestamped=True)
+            if (stored_checksum and stored_timestamp and
+                time.time() - stored_timestamp <
+                CONF.checksum_interval_seconds):
+                self.results[base_file] = True
+            else:
+                self.jobs.append(ChecksumJob(img_id, base_file,
+                                             self.lock_path))
+        return self.results.get(base_file)
+
+    def forget(self, base_file):
+        self.jobs = [job for job in self.jobs if job.base_file != base_file]
+        self.results.pop(base_file, None)
+
+    def start(self):
+        """Pace the checks queued and run them if they are not running."""
+        if not self.jobs:
+            return
+        remaining = sum(job.remaining_bytes() for job in self.jobs)
+        rate = float(remaining) / max(CONF.checksum_interval_seconds, 1)
+        if CONF.checksum_max_rate:
+            rate = min(rate, CONF.checksum_max_rate * 1024)
+        self.limiter.rate = max(rate, 1)
+
+        if not self.running:
+            self.running = True
+            greenthread.spawn_n(self.run)
+
+    def run(self):
+        """Run the checks queued, a chunk at a time."""
+        try:
+            while self.jobs:
+                job = self.jobs[0]
+                try:
+                    job.step(self.limiter)
+                except (IOError, OSError), e:
+                    LOG.warning(_('image %(id)s at (%(base_file)s): '
+                                  'verification aborted: %(error)s'),
+                                {'id': job.img_id,
+                                 'base_file': job.base_file,
+                                 'error': e})
+                    job.done = True
+                except Exception:
+                    # Drop the job, or it would block the ones behind it
+                    LOG.exception(_('image %(id)s at (%(base_file)s): '
+                                    'verification failed unexpectedly'),
+                                  {'id': job.img_id,
+                                   'base_file': job.base_file})
+                    job.done = True
+                if job.done:
+                    if job in self.jobs:
+                        self.jobs.remove(job)
+                    self.results[job.base_file] = job.result
+        finally:
+            self.running = False
+
+
 class ImageCacheManager(object):
     def __init__(self):
         self.lock_path = os.path.join(CONF.instances_path, 'locks')
+        self.verifier = ChecksumVerifier(self.lock_path)
         self._reset_state()
 
     def _reset_state(self):
@@ -352,66 +633,20 @@ class ImageCacheManager(object):
         Note that if the checksum fails to verify this is logged, but no actual
         action occurs. This is something sysadmins should monitor for and
         handle manually when it occurs.
+
+        This reads the whole file at once and is only used by the tests;
+        verify_base_images checks base files in the background through
+        the ChecksumVerifier instead.
         """
 
         if not CONF.checksum_base_images:
             return None
 
-        lock_name = 'hash-%s' % os.path.split(base_file)[-1]
-
-        # Protect against other nova-computes performing checksums at the same
-        # time if we are using shared storage
-        @lockutils.synchronized(lock_name, 'nova-', external=True,
-                                lock_path=self.lock_path)
-        def inner_verify_checksum():
-            (stored_checksum, stored_timestamp) = read_stored_checksum(
-                base_file, timestamped=True)
-            if stored_checksum:
-                # NOTE(mikal): Checksums are timestamped. If we have recently
-                # checksummed (possibly on another compute node if we are using
-                # shared storage), then we don't need to checksum again.
-                if (stored_timestamp and
-                    time.time() - stored_timestamp <
-                    CONF.checksum_interval_seconds):
-                    return True
-
-                # NOTE(mikal): If there is no timestamp, then the checksum was
-                # performed by a previous version of the code.
-                if not stored_timestamp:
-                    write_stored_info(base_file, field='sha1',
-                                      value=stored_checksum)
-
-                with open(base_file, 'r') as f:
-                    current_checksum = utils.hash_file(f)
-
-                if current_checksum != stored_checksum:
-                    LOG.error(_('image %(id)s at (%(base_file)s): image '
-                                'verification failed'),
-                              {'id': img_id,
-                               'base_file': base_file})
-                    return False
-
-                else:
-                    return True
-
-            else:
-                LOG.info(_('image %(id)s at (%(base_file)s): image '
-                           'verification skipped, no hash stored'),
-                         {'id': img_id,
-                          'base_file': base_file})
-
-                # NOTE(mikal): If the checksum file is missing, then we should
-                # create one. We don't create checksums when we download images
-                # from glance because that would delay VM startup.
-                if CONF.checksum_base_images and create_if_missing:
-                    LOG.info(_('%(id)s (%(base_file)s): generating checksum'),
-                             {'id': img_id,
-                              'base_file': base_file})
-                    write_stored_checksum(base_file)
-
-                return None
-
-        return inner_verify_checksum()
+        job = ChecksumJob(img_id, base_file, self.lock_path,
+                          create_if_missing=create_if_missing)
+        while not job.done:
+            job.step()
+        return job.result
 
     def _remove_base_file(self, base_file):
         """Remove a single base file if it is old enough.
@@ -437,6 +672,7 @@ class ImageCacheManager(object):
             LOG.info(_('Removing base file: %s'), base_file)
             try:
                 os.remove(base_file)
+                self.verifier.forget(base_file)
                 signature = get_info_filename(base_file)
                 if os.path.exists(signature):
                     os.remove(signature)
@@ -461,14 +697,12 @@ class ImageCacheManager(object):
 
         if (base_file and os.path.exists(base_file)
             and os.path.isfile(base_file)):
-            # _verify_checksum returns True if the checksum is ok, and None if
-            # there is no checksum file
-            checksum_result = self._verify_checksum(img_id, base_file)
-            if not checksum_result is None:
-                image_bad = not checksum_result
-
-            # Give other threads a chance to run
-            time.sleep(0)
+            # The verifier returns True if the last checksum was ok, and None
+            # if there is none yet. It checks files due in the background.
+            if CONF.checksum_base_images:
+                checksum_result = self.verifier.check(img_id, base_file)
+                if not checksum_result is None:
+                    image_bad = not checksum_result
 
         instances = []
         if img_id in self.used_images:
@@ -579,5 +813,8 @@ class ImageCacheManager(object):
                 for base_file in self.removable_base_files:
                     self._remove_base_file(base_file)
 
+        # Checksum the base files due in the background
+        self.verifier.start()
+
         # That's it
         LOG.debug(_('Verification complete'))
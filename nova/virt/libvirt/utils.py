@@ -497,8 +497,12 @@ def get_fs_info(path):
 
 
 def fetch_image(context, target, image_id, user_id, project_id):
-    """Grab image."""
-    images.fetch_to_raw(context, image_id, target, user_id, project_id)
+    """Grab image.
+
+    Returns the SHA1 checksum of target, if it was computed on the way.
+    """
+    return images.fetch_to_raw(context, image_id, target, user_id,
+                               project_id)
 
 
 def get_instance_path(instance):
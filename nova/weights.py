@@ -52,6 +52,13 @@ class BaseWeigher(object):
             obj.weight += (self._weight_multiplier() *
                            self._weigh_object(obj.obj, weight_properties))
 
+    def weigh_columns(self, columns, weight_properties):
+        """Return an array of weights, multiplier included, for all objects
+        in columns, or None if the weigher can only weigh one object at a
+        time.  Override in a subclass to support columnar evaluation.
+        """
+        return None
+
 
 class BaseWeightHandler(loadables.BaseLoader):
     object_class = WeighedObject
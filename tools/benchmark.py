@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Run one of nova's benchmarks.
+
+Run like:
+
+    ./tools/benchmark.py scheduler --hosts 1000,10000 --requests 200
+    ./tools/benchmark.py iptables --rules 1000,10000,100000
+    ./tools/benchmark.py jsonutils --iterations 1000
+
+./tools/benchmark.py <benchmark> --help lists a benchmark's options.
+Arguments not recognized by the benchmark are handed to nova's
+configuration parser, so options for a run can be set with
+--config-file.
+"""
+
+import gettext
+import os
+import sys
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(__file__),
+                                   os.pardir, os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'nova', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+gettext.install('nova', unicode=1)
+
+from nova.tests import benchmarks
+
+
+if __name__ == '__main__':
+    benchmarks.main(sys.argv)